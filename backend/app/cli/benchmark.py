@@ -0,0 +1,452 @@
+"""Latency benchmark for the API, driven through the app in process.
+
+Seeds throwaway users, products, carts and past orders, then runs virtual
+users through realistic scenarios (browse the catalog, fill a cart, check
+out, read order history, log in) against the FastAPI app over an in process
+ASGI transport, so what's measured is the app and the database, not a
+network. Reports p50/p95/p99 latency, throughput and SQL statements per
+request for every endpoint, and removes the seeded rows afterwards.
+
+    python -m app.cli.benchmark --concurrency 8 --iterations 20 --out run.json
+    python -m app.cli.benchmark --compare run.json
+
+With --compare it exits 1 when an endpoint's p95 got slower by more than
+--threshold, or when it started issuing more queries per request. Point
+DATABASE_URL at a scratch postgres database, the crud layer relies on
+postgres only statements so sqlite can't stand in for it.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import delete, event, insert, select
+
+from app.database import async_session_factory, engine
+from app.main import app
+from app.models.dbmodel import Cart, CartItem, Order, OrderItem, Product, User
+from app.schemas.schema import OrderStatus
+from app.services.catalog_cache import catalog_cache
+from app.utils.security import create_access_token, get_password_hash
+
+SCENARIOS = ("browse", "search", "cart", "checkout", "history", "login")
+PASSWORD = "bench-password"
+
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+# statements executed by the request currently running in this context
+_query_counter: contextvars.ContextVar[list[int] | None] = contextvars.ContextVar(
+    "benchmark_query_counter", default=None
+)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    queries: list[int] = field(default_factory=list)
+    errors: int = 0
+
+    def summary(self, elapsed: float) -> dict:
+        ordered = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+            return round(ordered[index] * 1000, 3)
+
+        return {
+            "requests": len(ordered),
+            "errors": self.errors,
+            "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+            "queries_per_request": round(statistics.fmean(self.queries), 2),
+        }
+
+
+@dataclass
+class Seed:
+    tag: str
+    users: list[tuple[User, dict[str, str]]]
+    product_ids: list[uuid.UUID]
+    search_terms: list[str]
+
+
+class Recorder:
+    def __init__(self, client: AsyncClient) -> None:
+        self.client = client
+        self.stats: dict[str, EndpointStats] = {}
+
+    async def request(
+        self, method: str, url: str, *, expected: tuple[int, ...] = (), **kwargs
+    ):
+        # expected: error statuses a scenario can legitimately run into,
+        # anything else >= 400 (a 404 included) counts as an error
+        name = f"{method} {_UUID.sub('{id}', url.split('?')[0])}"
+        counter = [0]
+        token = _query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            res = await self.client.request(method, url, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _query_counter.reset(token)
+
+        stats = self.stats.setdefault(name, EndpointStats())
+        stats.latencies.append(elapsed)
+        stats.queries.append(counter[0])
+        if res.status_code >= 400 and res.status_code not in expected:
+            stats.errors += 1
+        return res
+
+
+async def seed(*, users: int, products: int, orders_per_user: int) -> Seed:
+    tag = uuid.uuid4().hex[:8]
+    hashed = await get_password_hash(PASSWORD)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    categories = ["kitchen", "garden", "office", "toys", "books", None]
+    words = ["oak", "steel", "linen", "ceramic", "cotton", "glass", "walnut", "wool"]
+    things = ["mug", "lamp", "chair", "shelf", "blanket", "bowl", "desk", "vase"]
+
+    product_rows = []
+    for i in range(products):
+        word, thing = random.choice(words), random.choice(things)
+        product_rows.append(
+            {
+                "id": uuid.uuid4(),
+                "name": f"bench-{tag}-{word}-{thing}-{i}",
+                "price": random.randint(100, 50_000),
+                "description": f"{word} {thing} for benchmarking",
+                "stock": 1_000_000,
+                "category": random.choice(categories),
+                "image_url": " ",
+            }
+        )
+    user_rows = [
+        {
+            "id": uuid.uuid4(),
+            "username": f"bench-{tag}-{i}",
+            "useremail": f"bench-{tag}-{i}@bench.invalid",
+            "userphone": f"bench-{tag}-{i}",
+            "hashed_password": hashed,
+            "is_admin": False,
+            "created_at": now,
+        }
+        for i in range(users)
+    ]
+
+    order_rows = []
+    item_rows = []
+    for user in user_rows:
+        for n in range(orders_per_user):
+            order_id = uuid.uuid4()
+            lines = random.sample(product_rows, k=min(3, len(product_rows)))
+            order_rows.append(
+                {
+                    "id": order_id,
+                    "user_id": user["id"],
+                    "ordered_at": now - timedelta(hours=n + 1),
+                    "total_price": sum(p["price"] for p in lines),
+                    "status": OrderStatus.DELIVERED.value,
+                    "phone_number": "0",
+                    "longitude": 0.0,
+                    "latitude": 0.0,
+                    "address": "benchmark",
+                }
+            )
+            item_rows += [
+                {
+                    "id": uuid.uuid4(),
+                    "order_id": order_id,
+                    "product_id": p["id"],
+                    "quantity": 1,
+                    "price_at_purchase": p["price"],
+                }
+                for p in lines
+            ]
+
+    async with async_session_factory() as session:
+        await session.execute(insert(Product), product_rows)
+        await session.execute(insert(User), user_rows)
+        if order_rows:
+            await session.execute(insert(Order), order_rows)
+            await session.execute(insert(OrderItem), item_rows)
+        await session.commit()
+    await catalog_cache.invalidate()
+
+    seeded_users = []
+    for row in user_rows:
+        token = await create_access_token(row["id"], timedelta(hours=1))
+        seeded_users.append((User(**row), {"Authorization": f"Bearer {token}"}))
+    return Seed(
+        tag=tag,
+        users=seeded_users,
+        product_ids=[row["id"] for row in product_rows],
+        search_terms=words + things,
+    )
+
+
+async def cleanup(data: Seed) -> None:
+    user_ids = select(User.id).where(
+        User.username.like(f"bench-{data.tag}-%")  # pyright: ignore
+    )
+    order_ids = select(Order.id).where(Order.user_id.in_(user_ids))  # pyright: ignore
+    cart_ids = select(Cart.id).where(Cart.user_id.in_(user_ids))  # pyright: ignore
+    async with async_session_factory() as session:
+        await session.execute(
+            delete(OrderItem).where(
+                OrderItem.order_id.in_(order_ids)
+            )  # pyright: ignore
+        )
+        await session.execute(
+            delete(Order).where(Order.user_id.in_(user_ids))  # pyright: ignore
+        )
+        await session.execute(
+            delete(CartItem).where(CartItem.cart_id.in_(cart_ids))  # pyright: ignore
+        )
+        await session.execute(
+            delete(Cart).where(Cart.user_id.in_(user_ids))  # pyright: ignore
+        )
+        await session.execute(
+            delete(Product).where(
+                Product.name.like(f"bench-{data.tag}-%")  # pyright: ignore
+            )
+        )
+        await session.execute(
+            delete(User).where(
+                User.username.like(f"bench-{data.tag}-%")
+            )  # pyright: ignore
+        )
+        await session.commit()
+    await catalog_cache.invalidate(product_ids=data.product_ids)
+
+
+async def run_scenario(name: str, rec: Recorder, data: Seed, worker: int) -> None:
+    user, headers = data.users[worker % len(data.users)]
+
+    if name == "browse":
+        for sort in ("name", "price"):
+            res = await rec.request("GET", "/products/", params={"sort": sort})
+            cursor = res.json().get("next_cursor")
+            if cursor:
+                await rec.request(
+                    "GET", "/products/", params={"sort": sort, "cursor": cursor}
+                )
+
+    elif name == "search":
+        await rec.request(
+            "GET", "/products/search", params={"q": random.choice(data.search_terms)}
+        )
+
+    elif name == "cart":
+        for product_id in random.sample(data.product_ids, k=3):
+            await rec.request(
+                "POST",
+                f"/cart/item/{product_id}",
+                params={"quantity": 1},
+                headers=headers,
+            )
+        await rec.request(
+            "PATCH",
+            "/cart/",
+            json={
+                "operations": [
+                    {"op": "add", "product_id": str(product_id), "quantity": 1}
+                    for product_id in random.sample(data.product_ids, k=3)
+                ]
+            },
+            headers=headers,
+        )
+        await rec.request("GET", "/cart/", headers=headers)
+        # another worker on the same user may have just checked the cart out
+        await rec.request("GET", "/cart/total", headers=headers, expected=(404,))
+        await rec.request("DELETE", "/cart/", headers=headers)
+
+    elif name == "checkout":
+        await rec.request(
+            "PATCH",
+            "/cart/",
+            json={
+                "operations": [
+                    {"op": "set", "product_id": str(product_id), "quantity": 1}
+                    for product_id in random.sample(data.product_ids, k=2)
+                ]
+            },
+            headers=headers,
+        )
+        await rec.request(
+            "POST",
+            "/order/",
+            json={
+                "phone_number": "0",
+                "latitude": 0.0,
+                "longitude": 0.0,
+                "address": "benchmark",
+            },
+            headers=headers,
+        )
+
+    elif name == "history":
+        res = await rec.request("GET", "/order/history", headers=headers)
+        cursor = res.json().get("next_cursor")
+        if cursor:
+            await rec.request(
+                "GET", "/order/history", params={"cursor": cursor}, headers=headers
+            )
+        await rec.request("GET", "/order/", headers=headers)
+
+    elif name == "login":
+        await rec.request(
+            "POST",
+            "/auth/token",
+            data={"username": user.useremail, "password": PASSWORD},
+        )
+
+
+def _print_report(report: dict) -> None:
+    print(
+        f"{'endpoint':<34} {'reqs':>6} {'err':>4} {'rps':>8} {'p50 ms':>9}"
+        f" {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}"
+    )
+    for name, s in sorted(report["endpoints"].items()):
+        print(
+            f"{name:<34} {s['requests']:>6} {s['errors']:>4} {s['throughput_rps']:>8}"
+            f" {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9}"
+            f" {s['queries_per_request']:>8}"
+        )
+    print(
+        f"\n{report['total_requests']} requests in {report['elapsed_seconds']}s,"
+        f" {report['throughput_rps']} req/s"
+    )
+
+
+def compare(current: dict, baseline: dict, *, threshold: float) -> list[str]:
+    regressions = []
+    for name, base in baseline["endpoints"].items():
+        now = current["endpoints"].get(name)
+        if now is None:
+            continue
+        if now["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {now['p95_ms']}ms")
+        if now["queries_per_request"] > base["queries_per_request"]:
+            regressions.append(
+                f"{name}: queries/request {base['queries_per_request']}"
+                f" -> {now['queries_per_request']}"
+            )
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> int:
+    if engine.dialect.name != "postgresql":
+        print("benchmark needs postgres, DATABASE_URL points at", engine.dialect.name)
+        return 2
+
+    random.seed(args.seed)
+    scenarios = args.scenario or list(SCENARIOS)
+    data = await seed(
+        users=max(args.users, args.concurrency),
+        products=args.products,
+        orders_per_user=args.orders_per_user,
+    )
+    event.listen(engine.sync_engine, "before_cursor_execute", _count_query)
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://benchmark"
+        ) as client:
+            rec = Recorder(client)
+
+            async def worker(n: int) -> None:
+                for _ in range(args.iterations):
+                    for name in scenarios:
+                        await run_scenario(name, rec, data, n)
+
+            # one untimed pass so connection setup and cold caches don't
+            # land in the numbers
+            for name in scenarios:
+                await run_scenario(name, rec, data, 0)
+            rec.stats.clear()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", _count_query)
+        await cleanup(data)
+        await engine.dispose()
+
+    total = sum(len(s.latencies) for s in rec.stats.values())
+    report = {
+        "meta": {
+            "scenarios": scenarios,
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "users": args.users,
+            "products": args.products,
+            "orders_per_user": args.orders_per_user,
+            "seed": args.seed,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "total_requests": total,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "endpoints": {
+            name: stats.summary(elapsed) for name, stats in rec.stats.items()
+        },
+    }
+    _print_report(report)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, threshold=args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"\nno regressions against {args.compare}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--orders-per-user", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the results as json here")
+    parser.add_argument("--compare", help="baseline json from an earlier --out")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="allowed p95 slowdown against the baseline, 0.2 = 20%%",
+    )
+    return asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
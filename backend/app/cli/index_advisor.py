@@ -0,0 +1,255 @@
+"""Flags sequential scans in the queries the crud layer sends to postgres.
+
+Runs every crud function once against throwaway data inside a transaction
+that is rolled back at the end, records each statement sent to the driver,
+then EXPLAINs them with enable_seqscan off. With seq scans discouraged the
+planner picks any index that can serve the query, so a Seq Scan that is
+still in the plan means the index is missing.
+
+    python -m app.cli.index_advisor
+
+Exits with 1 when anything is flagged so it can gate CI.
+"""
+
+import asyncio
+import json
+import sys
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.database import engine
+from app.schemas.schema import (
+    CartOperation,
+    CartOperationType,
+    CreateOrderRequest,
+    ProductCreate,
+    ProductFileFormat,
+    ProductSort,
+    UserCreate,
+)
+from app.services import crud
+
+# tables that are fine to scan whole. the import staging table is always
+# read in full
+ALLOWED_SEQ_SCANS: set[str] = {"product_import"}
+
+_SKIP_PREFIXES = (
+    "SAVEPOINT",
+    "RELEASE",
+    "ROLLBACK",
+    "BEGIN",
+    "COMMIT",
+    "SET",
+    "EXPLAIN",
+    "CREATE",
+    "ANALYZE",
+)
+
+
+async def _import_body(name: str):
+    yield f"name,price\n{name},100\n".encode()
+
+
+async def exercise_crud(session: AsyncSession) -> None:
+    tag = uuid.uuid4().hex[:8]
+
+    user = await crud.create_user(
+        session=session,
+        user_create=UserCreate(
+            username=f"index-advisor-{tag}",
+            useremail=f"index-advisor-{tag}@example.invalid",
+            userphone=f"index-advisor-{tag}",
+            password=tag,
+        ),
+    )
+    await crud.get_user_by_email(session=session, email=user.useremail)
+
+    product = await crud.create_product(
+        session=session,
+        product_create=ProductCreate(
+            name=f"index-advisor-{tag}",
+            price=100,
+            description="index advisor probe",
+            category="index-advisor",
+        ),
+    )
+    await crud.update_product_stock(session=session, name=product.name, stock=10)
+    # striped from here on, so the cart and checkout below take the sharded
+    # path. taking it all at once goes through the gather
+    await crud.set_stock_shards(session=session, product_id=product.id, shards=4)
+    await crud.take_sharded_stock(session=session, product_id=product.id, quantity=10)
+    await crud.update_product_stock(session=session, name=product.name, stock=10)
+    await crud.get_product_by_name(session=session, name=product.name)
+    await crud.get_product_by_id(session=session, product_id=product.id)
+    for sort in ProductSort:
+        page = await crud.get_products_paginated(session=session, limit=5, sort=sort)
+        if page.next_cursor:
+            await crud.get_products_paginated(
+                session=session, limit=5, sort=sort, cursor=page.next_cursor
+            )
+    async for _ in crud.stream_products(
+        session=session,
+        statement=crud.stream_products_statement(
+            sort=ProductSort.PRICE, batch_size=100
+        ),
+    ):
+        pass
+    await crud.search_products(
+        session=session,
+        q="index advisor",
+        category="index-advisor",
+        min_price=1,
+        max_price=1000,
+        limit=5,
+        offset=0,
+    )
+    await crud.import_products(
+        session=session,
+        body=_import_body(product.name),
+        file_format=ProductFileFormat.CSV,
+    )
+    async for _ in crud.export_products(
+        session=session, file_format=ProductFileFormat.NDJSON
+    ):
+        pass
+
+    cart = await crud.check_for_cart_or_create(session=session, user=user)
+    await crud.create_cart_item(
+        session=session, cart_id=cart.id, product=product, quantity=2
+    )
+    await crud.get_cartitems(session=session, user=user)
+    await crud.get_cart_summary(session=session, user=user)
+    await crud.get_total_price(session=session, user=user)
+    await crud.update_quantity(
+        session=session, user=user, product_id=product.id, new_quantity=3
+    )
+
+    cart_item = await crud.create_cart_item(
+        session=session, cart_id=cart.id, product=product, quantity=1
+    )
+    await crud.inc_dec_cart_item_quantity(
+        session=session, user=user, cart_item_id=cart_item.id, amount=1
+    )
+    await crud.apply_cart_operations(
+        session=session,
+        user=user,
+        operations=[
+            CartOperation(op=CartOperationType.ADD, product_id=product.id, quantity=1),
+            CartOperation(op=CartOperationType.SET, product_id=product.id, quantity=3),
+        ],
+    )
+    await crud.reprice_cart_summaries(
+        session=session, product_id=product.id, old_price=100, new_price=100
+    )
+
+    await crud.reserve_cart(session=session, user=user)
+    await crud.release_cart_reservations(session=session, user=user)
+    await crud.reserve_cart(session=session, user=user)
+    await crud.release_expired_reservations(session=session, batch_size=100)
+    order_id = await crud.checkout_cart(
+        payload=CreateOrderRequest(
+            phone_number="0", latitude=0.0, longitude=0.0, address="index advisor"
+        ),
+        session=session,
+        user=user,
+    )
+    await crud.get_payable_order(session=session, order_id=order_id, user=user)
+    await crud.set_order_payment_pidx(
+        session=session, order_id=order_id, user=user, pidx=f"index-advisor-{tag}"
+    )
+    await crud.get_users_orders(session=session, user=user)
+    await crud.get_users_order_items(session=session, user=user)
+    async for _ in crud.stream_users_orders(session=session, user=user, batch_size=100):
+        pass
+    async for _ in crud.stream_users_order_items(
+        session=session, user=user, batch_size=100
+    ):
+        pass
+    history = await crud.get_order_history(session=session, user=user, limit=1)
+    if history.next_cursor:
+        await crud.get_order_history(
+            session=session, user=user, limit=1, cursor=history.next_cursor
+        )
+    await crud.restore_order_items_stock(order_id=order_id, session=session)
+    await crud.clear_cart(session=session, user=user)
+
+
+def _seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+async def _explain(conn: AsyncConnection, statement: str, parameters) -> list[str]:
+    result = await conn.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {statement}", parameters
+    )
+    plan = result.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _seq_scans(plan[0]["Plan"])
+
+
+async def run() -> int:
+    if engine.dialect.name != "postgresql":
+        print(
+            "index advisor needs postgres, DATABASE_URL points at", engine.dialect.name
+        )
+        return 2
+
+    captured: dict[str, object] = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if executemany or statement.lstrip().upper().startswith(_SKIP_PREFIXES):
+            return
+        # first set of parameters seen per statement is enough to plan it
+        captured.setdefault(statement, parameters)
+
+    async with engine.connect() as conn:
+        outer = await conn.begin()
+        try:
+            # crud functions commit, the savepoint mode turns those commits
+            # into savepoint releases so the outer rollback still wipes it all
+            session = AsyncSession(
+                bind=conn,
+                expire_on_commit=False,
+                join_transaction_mode="create_savepoint",
+            )
+            event.listen(conn.sync_connection, "before_cursor_execute", record)
+            try:
+                await exercise_crud(session)
+            finally:
+                event.remove(conn.sync_connection, "before_cursor_execute", record)
+
+            await conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            flagged = []
+            for statement, parameters in captured.items():
+                tables = [
+                    t
+                    for t in await _explain(conn, statement, parameters)
+                    if t not in ALLOWED_SEQ_SCANS
+                ]
+                if tables:
+                    flagged.append((statement, tables))
+        finally:
+            await outer.rollback()
+
+    print(f"explained {len(captured)} statements")
+    for statement, tables in flagged:
+        print(f"\nSEQ SCAN on {', '.join(sorted(set(tables)))}:")
+        print("  " + " ".join(statement.split()))
+
+    if flagged:
+        print(f"\n{len(flagged)} statement(s) fall back to a sequential scan")
+        return 1
+    print("no sequential scans found")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
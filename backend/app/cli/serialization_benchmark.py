@@ -0,0 +1,223 @@
+"""Per row cost of encoding list responses, old path against the fast path.
+
+The old path is what the list endpoints did before: build a pydantic model
+per row, then let FastAPI validate and serialize the list against the
+route's response_model (its own serialize_response, with the field the
+route really uses) and render it with JSONResponse. The fast path is the
+RowSerializer the routes use now, plain rows straight to JSON bytes.
+
+Rows are made up in memory, no database is touched, so this measures the
+encoding only.
+
+    python -m app.cli.serialization_benchmark --rows 1000 --repeat 50
+
+Both paths have to produce the same JSON, it exits 1 when they don't.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from asyncpg.pgproto.pgproto import UUID
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from sqlalchemy import Row
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+
+from app.endpoints.cart_routes import CART_ITEM_ROWS
+from app.endpoints.order_routes import ORDER_ITEM_ROWS, ORDER_ROWS
+from app.main import app
+from app.models.dbmodel import Product
+from app.schemas.schema import (
+    CartItemDisplay,
+    OrderDisplay,
+    OrderItemDisplay,
+    OrderStatus,
+    ProductPage,
+)
+from app.services.crud.product import PRODUCT_ROWS
+from app.utils.serialization import FastJSONResponse, orjson
+
+
+@dataclass
+class Case:
+    name: str
+    route: str
+    make_row: Callable[[int], dict[str, Any]]
+    old: Callable[[list[Row], APIRoute], Any]
+    new: Callable[[list[Row]], bytes]
+
+
+def _rows(make_row: Callable[[int], dict[str, Any]], count: int) -> list[Row]:
+    data = [make_row(i) for i in range(count)]
+    keys = list(data[0])
+    result = IteratorResult(
+        SimpleResultMetaData(keys), iter(tuple(d.values()) for d in data)
+    )
+    return list(result.all())
+
+
+def _route(path: str) -> APIRoute:
+    for route in app.routes:
+        if (
+            isinstance(route, APIRoute)
+            and route.path == path
+            and "GET" in route.methods
+        ):
+            return route
+    raise LookupError(f"no GET route {path}")
+
+
+async def _through_response_model(models: list, route: APIRoute) -> bytes:
+    content = await serialize_response(
+        field=route.secure_cloned_response_field,
+        response_content=models,
+        is_coroutine=True,
+    )
+    return JSONResponse(content).body
+
+
+def _old_list(schema):
+    async def old(rows: list[Row], route: APIRoute) -> bytes:
+        models = [schema(**row._mapping) for row in rows]
+        return await _through_response_model(models, route)
+
+    return old
+
+
+async def _old_product_page(rows: list[Row], route: APIRoute) -> bytes:
+    # Product objects into a ProductPage, dumped for the cache, JSONResponse
+    page = ProductPage(items=[Product(**row._mapping) for row in rows])  # type: ignore
+    return JSONResponse(page.model_dump(mode="json")).body
+
+
+def _new_product_page(rows: list[Row]) -> bytes:
+    page = {
+        "items": PRODUCT_ROWS.jsonable(rows),
+        "next_cursor": None,
+        "prev_cursor": None,
+    }
+    return FastJSONResponse(page).body
+
+
+_NOW = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def _uuid() -> UUID:
+    # the class asyncpg really returns for uuid columns
+    return UUID(uuid.uuid4().bytes)
+
+
+CASES = [
+    Case(
+        name="cart items",
+        route="/cart/",
+        make_row=lambda i: {
+            "id": _uuid(),
+            "name": f"product {i}",
+            "quantity": i % 5 + 1,
+            "price": 100 + i,
+            "product_id": _uuid(),
+        },
+        old=_old_list(CartItemDisplay),
+        new=CART_ITEM_ROWS.json,
+    ),
+    Case(
+        name="orders",
+        route="/order/",
+        make_row=lambda i: {
+            "id": _uuid(),
+            "total_price": 1000 + i,
+            "address": f"{i} some street, kathmandu",
+            "status": OrderStatus.PAID.value,
+            "ordered_at": _NOW - timedelta(minutes=i),
+        },
+        old=_old_list(OrderDisplay),
+        new=ORDER_ROWS.json,
+    ),
+    Case(
+        name="order items",
+        route="/order/orderitems",
+        make_row=lambda i: {
+            "id": _uuid(),
+            "order_id": _uuid(),
+            "name": f"product {i}",
+            "quantity": i % 5 + 1,
+            "status": OrderStatus.SHIPPED.value,
+            "date": _NOW - timedelta(minutes=i),
+            "price_at_purchase": 100 + i,
+        },
+        old=_old_list(OrderItemDisplay),
+        new=ORDER_ITEM_ROWS.json,
+    ),
+    Case(
+        name="product page",
+        route="/products/",
+        make_row=lambda i: {
+            "id": _uuid(),
+            "name": f"product {i}",
+            "price": 100 + i,
+            "description": "a product description of a realistic length " * 2,
+            "stock": i % 50,
+            "category": "Home",
+            "image_url": f"https://cdn.example.com/products/{i}.jpg",
+        },
+        old=_old_product_page,
+        new=_new_product_page,
+    ),
+]
+
+
+async def _best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        if asyncio.iscoroutine(result):
+            await result
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def run(rows: int, repeat: int) -> int:
+    encoder = "orjson" if orjson is not None else "pydantic_core"
+    print(f"{rows} rows per payload, best of {repeat}, encoder: {encoder}")
+    print(f"{'payload':<14}{'old us/row':>12}{'fast us/row':>13}{'speedup':>9}")
+
+    mismatches = 0
+    for case in CASES:
+        route = _route(case.route)
+        data = _rows(case.make_row, rows)
+
+        old_body = await case.old(data, route)
+        new_body = case.new(data)
+        if json.loads(old_body) != json.loads(new_body):
+            print(f"{case.name}: fast path output differs from the old one")
+            mismatches += 1
+            continue
+
+        old = await _best_of(lambda: case.old(data, route), repeat)
+        new = await _best_of(lambda: case.new(data), repeat)
+        print(
+            f"{case.name:<14}{old / rows * 1e6:>12.2f}{new / rows * 1e6:>13.2f}"
+            f"{old / new:>8.1f}x"
+        )
+    return 1 if mismatches else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.rows, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
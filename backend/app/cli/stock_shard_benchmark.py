@@ -0,0 +1,276 @@
+"""Concurrent checkouts of one hot product, single stock row against striped.
+
+Seeds a throwaway product and a set of buyers with one unit of it in their
+cart, then has every buyer check out at the same time through the same crud
+call the order route uses, round after round. That is repeated for each
+--shards value (0 is the plain Product.stock row) and the checkout
+throughput and latency are reported side by side. The seeded rows are
+removed afterwards.
+
+    python -m app.cli.stock_shard_benchmark --buyers 32 --rounds 20 --shards 0 8 16
+
+--hold-ms keeps each checkout's transaction open that much longer before
+the commit, standing in for a database that isn't on the same machine. The
+stock lock is held for the whole transaction, so that is where a single row
+hurts most. Concurrency is capped by the connection pool (DB_POOL_SIZE +
+DB_MAX_OVERFLOW). Needs postgres like the other benchmarks.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, insert, select, update
+
+from app.database import async_session_factory, engine
+from app.models.dbmodel import (
+    Cart,
+    CartItem,
+    Order,
+    OrderItem,
+    Product,
+    ProductStockShard,
+    User,
+)
+from app.schemas.schema import CreateOrderRequest
+from app.services import crud
+from app.services.crud.stock_shards import PRODUCT_STOCK, SHARD_TAKES
+
+PRICE = 500
+PAYLOAD = CreateOrderRequest(
+    phone_number="0", latitude=0.0, longitude=0.0, address="stock shard benchmark"
+)
+
+
+async def seed(*, tag: str, buyers: int) -> tuple[uuid.UUID, list[User]]:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    product_id = uuid.uuid4()
+    users = [
+        User(
+            id=uuid.uuid4(),
+            username=f"shardbench-{tag}-{i}",
+            useremail=f"shardbench-{tag}-{i}@bench.invalid",
+            userphone=f"shardbench-{tag}-{i}",
+            # nobody logs in, checkout is called directly
+            hashed_password="!",
+            is_admin=False,
+            created_at=now,
+        )
+        for i in range(buyers)
+    ]
+    async with async_session_factory() as session:
+        await session.execute(
+            insert(Product).values(
+                id=product_id,
+                name=f"shardbench-{tag}",
+                price=PRICE,
+                description="stock shard benchmark",
+                stock=0,
+                stock_shards=0,
+            )
+        )
+        await session.execute(insert(User), [user.model_dump() for user in users])
+        await session.execute(
+            insert(Cart),
+            [
+                {"id": uuid.uuid4(), "user_id": user.id, "item_count": 0}
+                for user in users
+            ],
+        )
+        await session.commit()
+    return product_id, users
+
+
+async def fill_carts(*, users: list[User], product_id: uuid.UUID) -> None:
+    # one unit per buyer, with the cart totals to match
+    async with async_session_factory() as session:
+        result = await session.execute(
+            select(Cart.id).where(
+                Cart.user_id.in_([user.id for user in users])  # pyright: ignore
+            )
+        )
+        cart_ids = result.scalars().all()
+        await session.execute(
+            insert(CartItem),
+            [
+                {
+                    "id": uuid.uuid4(),
+                    "cart_id": cart_id,
+                    "product_id": product_id,
+                    "quantity": 1,
+                }
+                for cart_id in cart_ids
+            ],
+        )
+        await session.execute(
+            update(Cart)
+            .where(Cart.id.in_(cart_ids))  # pyright: ignore
+            .values(item_count=1, subtotal=PRICE)
+        )
+        await session.commit()
+
+
+async def checkout(user: User, hold: float) -> float:
+    started = time.perf_counter()
+    async with async_session_factory() as session:
+        await crud.checkout_cart(payload=PAYLOAD, session=session, user=user)
+        if hold:
+            await asyncio.sleep(hold)
+        await session.commit()
+    return time.perf_counter() - started
+
+
+async def run_setting(
+    *,
+    shards: int,
+    product_id: uuid.UUID,
+    product_name: str,
+    users: list[User],
+    rounds: int,
+    hold: float,
+) -> dict:
+    # exactly enough for every checkout, striped the way an admin would
+    async with async_session_factory() as session:
+        await crud.set_stock_shards(session=session, product_id=product_id, shards=0)
+        await crud.update_product_stock(
+            session=session, name=product_name, stock=len(users) * rounds
+        )
+        await crud.set_stock_shards(
+            session=session, product_id=product_id, shards=shards
+        )
+
+    takes_before = dict(SHARD_TAKES)
+    latencies: list[float] = []
+    errors = 0
+    elapsed = 0.0
+    for _ in range(rounds):
+        await fill_carts(users=users, product_id=product_id)
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(checkout(user, hold) for user in users), return_exceptions=True
+        )
+        elapsed += time.perf_counter() - started
+        for result in results:
+            if isinstance(result, BaseException):
+                errors += 1
+            else:
+                latencies.append(result)
+
+    async with async_session_factory() as session:
+        result = await session.execute(
+            select(PRODUCT_STOCK).where(Product.id == product_id)
+        )
+        left = result.scalar_one()
+
+    ordered = sorted(latencies) or [0.0]
+    return {
+        "shards": shards,
+        "checkouts": len(latencies),
+        "errors": errors,
+        "per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "stock_left": left,
+        "takes": {path: SHARD_TAKES[path] - takes_before[path] for path in SHARD_TAKES},
+    }
+
+
+async def cleanup(*, tag: str, product_id: uuid.UUID) -> None:
+    user_ids = select(User.id).where(
+        User.username.like(f"shardbench-{tag}-%")  # pyright: ignore
+    )
+    order_ids = select(Order.id).where(Order.user_id.in_(user_ids))  # pyright: ignore
+    cart_ids = select(Cart.id).where(Cart.user_id.in_(user_ids))  # pyright: ignore
+    async with async_session_factory() as session:
+        await session.execute(
+            delete(OrderItem).where(
+                OrderItem.order_id.in_(order_ids)
+            )  # pyright: ignore
+        )
+        await session.execute(
+            delete(Order).where(Order.user_id.in_(user_ids))  # pyright: ignore
+        )
+        await session.execute(
+            delete(CartItem).where(CartItem.cart_id.in_(cart_ids))  # pyright: ignore
+        )
+        await session.execute(
+            delete(Cart).where(Cart.user_id.in_(user_ids))  # pyright: ignore
+        )
+        await session.execute(
+            delete(ProductStockShard).where(
+                ProductStockShard.product_id == product_id  # pyright: ignore
+            )
+        )
+        await session.execute(
+            delete(Product).where(Product.id == product_id)  # pyright: ignore
+        )
+        await session.execute(
+            delete(User).where(
+                User.username.like(f"shardbench-{tag}-%")  # pyright: ignore
+            )
+        )
+        await session.commit()
+
+
+async def run(args: argparse.Namespace) -> int:
+    if engine.dialect.name != "postgresql":
+        print("benchmark needs postgres, DATABASE_URL points at", engine.dialect.name)
+        return 2
+
+    tag = uuid.uuid4().hex[:8]
+    pool = engine.pool.size() + engine.pool._max_overflow  # type: ignore
+    product_id, users = await seed(tag=tag, buyers=args.buyers)
+    results = []
+    try:
+        for shards in args.shards:
+            results.append(
+                await run_setting(
+                    shards=shards,
+                    product_id=product_id,
+                    product_name=f"shardbench-{tag}",
+                    users=users,
+                    rounds=args.rounds,
+                    hold=args.hold_ms / 1000,
+                )
+            )
+    finally:
+        await cleanup(tag=tag, product_id=product_id)
+        await engine.dispose()
+
+    print(
+        f"{args.buyers} buyers of one product, {args.rounds} rounds, "
+        f"hold {args.hold_ms} ms, pool {pool} connections"
+    )
+    print(
+        f"{'shards':>6}{'checkouts/s':>13}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'errors':>8}{'left':>6}  takes"
+    )
+    failed = False
+    for r in results:
+        takes = ", ".join(f"{path} {count}" for path, count in r["takes"].items())
+        print(
+            f"{r['shards']:>6}{r['per_second']:>13.1f}{r['p50_ms']:>9.1f}"
+            f"{r['p95_ms']:>9.1f}{r['errors']:>8}{r['stock_left']:>6}  "
+            f"{takes if r['shards'] else '-'}"
+        )
+        # every unit is bought exactly once, anything else is a bug
+        failed = failed or r["errors"] > 0 or r["stock_left"] != 0
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--buyers", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 8, 16])
+    parser.add_argument("--hold-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,133 @@
 import os
-from typing import AsyncGenerator
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, TypeVar
 
-from sqlalchemy import text
+from sqlalchemy import event, make_url, text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.utils.env import env_bool, env_int
+
+T = TypeVar("T")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set!")
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+
+class PoolStats:
+    # plain counters, everything touching them runs on the event loop thread
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.total_wait_seconds += seconds
+        if seconds > self.max_wait_seconds:
+            self.max_wait_seconds = seconds
+
+
+pool_stats = PoolStats()
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    # times how long a caller waits to get a connection out of the pool,
+    # if this climbs the pool is too small for the number of workers
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+def _engine_options(url: str) -> dict:
+    options: dict = {
+        "echo": env_bool("DB_ECHO", False),
+        "future": True,
+    }
+
+    # sqlite (local runs / benchmarks) doesnt take queue pool settings
+    if make_url(url).get_backend_name() == "sqlite":
+        return options
+
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=env_int("DB_POOL_SIZE", 10),
+        max_overflow=env_int("DB_MAX_OVERFLOW", 10),
+        pool_timeout=env_int("DB_POOL_TIMEOUT", 30),
+        pool_recycle=env_int("DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=env_bool("DB_POOL_PRE_PING", True),
+    )
+
+    if make_url(url).get_driver_name() == "asyncpg":
+        # set to 0 when running behind pgbouncer in transaction mode
+        options["connect_args"] = {
+            "prepared_statement_cache_size": env_int("DB_STATEMENT_CACHE_SIZE", 100),
+        }
+
+    return options
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+
+# built once per process, making a sessionmaker per request was pure overhead
+async_session_factory = async_sessionmaker(
+    engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
+
+
+@event.listens_for(engine.sync_engine.pool, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.connects += 1
+
+
+@event.listens_for(engine.sync_engine.pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.checkouts += 1
+
+
+@event.listens_for(engine.sync_engine.pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.checkins += 1
+
+
+@event.listens_for(engine.sync_engine.pool, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.invalidations += 1
+
+
+def get_pool_status() -> dict:
+    pool = engine.sync_engine.pool
+    status = {
+        "pool_class": type(pool).__name__,
+        "checkouts": pool_stats.checkouts,
+        "checkins": pool_stats.checkins,
+        "connects": pool_stats.connects,
+        "invalidations": pool_stats.invalidations,
+        "total_wait_seconds": round(pool_stats.total_wait_seconds, 6),
+        "max_wait_seconds": round(pool_stats.max_wait_seconds, 6),
+        "avg_wait_seconds": (
+            round(pool_stats.total_wait_seconds / pool_stats.checkouts, 6)
+            if pool_stats.checkouts
+            else 0.0
+        ),
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+        )
+    return status
+
 
 # removing the init_db() to create the tables and everything because im making almebic do it instead useing alembic upgread head in the docker startup command script
 # async def init_db():
@@ -27,12 +146,16 @@ async def check_db_connection():
         raise e
 
 
-# async_sessionmaker returns a generator for the session not an actual session instance hence the generator hint
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async_session = async_sessionmaker(
-        engine,
-        class_=AsyncSession,
-        expire_on_commit=False,
-    )
-    async with async_session() as session:
+    async with async_session_factory() as session:
         yield session
+
+
+async def stream_with_own_session(
+    stream: Callable[..., AsyncIterator[T]], **kwargs: Any
+) -> AsyncIterator[T]:
+    # a streamed response body is still being read after the request scoped
+    # session from get_async_session is gone, so it reads through its own
+    async with async_session_factory() as session:
+        async for item in stream(session=session, **kwargs):
+            yield item
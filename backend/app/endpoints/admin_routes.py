@@ -3,22 +3,33 @@ import uuid
 from typing import Annotated, List
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_async_session
+from app.database import get_async_session, get_pool_status, stream_with_own_session
 from app.models.dbmodel import Product, User
 from app.schemas.schema import (
     CartItemDisplay,
     DisplayTotalPrice,
     ProductCreate,
     ProductDisplay,
+    ProductFileFormat,
+    ProductImportResult,
+    ProductStockShards,
+    ProductStockShardsUpdate,
     ProductUpdate,
 )
 
 # Unified import from the new modular structure
 from app.services import crud
 from app.services.deps import get_current_active_admin, get_current_user
+from app.services.khalti import khalti_client
+from app.services.payment_reconciler import payment_reconciler
+from app.services.reservation_sweeper import reservation_sweeper
+from app.utils.cache import CACHE_REGISTRY
+from app.utils.query_stats import query_stats
+from app.utils.security import hashing_pool
 
 router = APIRouter()
 
@@ -44,29 +55,107 @@ async def admin_create_new_product(
     return {"message": f"Successfully created product. Name:{product.name}"}
 
 
+@router.post("/products/import", response_model=ProductImportResult)
+async def admin_import_products(
+    request: Request,
+    db: session_dep,
+    format: ProductFileFormat = ProductFileFormat.CSV,
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    # the body is never read into memory, it's streamed into COPY as it arrives
+    return await crud.import_products(
+        session=db, body=request.stream(), file_format=format
+    )
+
+
+EXPORT_MEDIA_TYPES = {
+    ProductFileFormat.CSV: "text/csv",
+    ProductFileFormat.NDJSON: "application/x-ndjson",
+}
+
+
+@router.get("/products/export")
+async def admin_export_products(
+    format: ProductFileFormat = ProductFileFormat.CSV,
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    return StreamingResponse(
+        stream_with_own_session(crud.export_products, file_format=format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="products.{format.value}"'
+        },
+    )
+
+
 @router.patch("/products/{product_id}")
 async def update_product(
     product_id: uuid.UUID,
     product_data: ProductUpdate,
     db: session_dep,
+    userAdmin: User = Depends(get_current_active_admin),
 ):
-    # 1. Get the existing product from the DB
-    db_product = await db.get(Product, product_id)
-    if not db_product:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Product not found",
-        )
+    # goes through crud so the catalog cache gets invalidated
+    db_product = await crud.update_product(
+        session=db,
+        product_id=product_id,
+        product_update=product_data,
+    )
+    return db_product
 
-    # 2. Extract the data the user actually sent (ignore the None values)
-    # This returns a dictionary to me only with the values i updated
-    update_dict = product_data.model_dump(exclude_unset=True)
 
-    # 3. Apply the updates to the DB object
-    db_product.sqlmodel_update(update_dict)
+@router.put("/products/{product_id}/stock_shards", response_model=ProductStockShards)
+async def set_product_stock_shards(
+    product_id: uuid.UUID,
+    body: ProductStockShardsUpdate,
+    db: session_dep,
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    # stripe a hot product's stock before a sale so its buyers don't all
+    # queue on one row, shards=0 turns it back off
+    return await crud.set_stock_shards(
+        session=db, product_id=product_id, shards=body.shards
+    )
 
-    db.add(db_product)
-    await db.commit()
-    await db.refresh(db_product)
 
-    return db_product
+@router.get("/db/pool")
+async def db_pool_status(
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    # checkouts / waits / overflow, used to size DB_POOL_SIZE against worker count
+    return get_pool_status()
+
+
+@router.get("/cache")
+async def cache_stats(
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    return {name: cache.stats() for name, cache in CACHE_REGISTRY.items()}
+
+
+@router.get("/queries")
+async def query_stats_report(
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    return query_stats.stats()
+
+
+@router.get("/password_hashing")
+async def password_hashing_stats(
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    return hashing_pool.stats()
+
+
+@router.get("/payment_gateway")
+async def payment_gateway_stats(
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    return {**khalti_client.stats(), "reconciler": payment_reconciler.stats()}
+
+
+@router.get("/reservations")
+async def reservation_sweeper_stats(
+    userAdmin: User = Depends(get_current_active_admin),
+):
+    return reservation_sweeper.stats()
@@ -8,19 +8,27 @@ from sqlmodel import join, select
 from app.database import get_async_session
 from app.models.dbmodel import Cart, CartItem, Product, User
 from app.schemas.schema import (
+    CartBatchResult,
+    CartBatchUpdate,
+    CartReservation,
     CartItemDisplay,
     CartItemUpdate,
+    CartSummary,
     DisplayTotalPrice,
 )
 
 # Unified import from the new modular structure
 from app.services import crud
+from app.services.catalog_cache import catalog_cache
 from app.services.deps import get_current_active_admin, get_current_user
+from app.utils.serialization import RowSerializer
 
 router = APIRouter()
 
 session_dep = Annotated[AsyncSession, Depends(get_async_session)]
 
+CART_ITEM_ROWS = RowSerializer(CartItemDisplay)
+
 
 @router.get("/", response_model=List[CartItemDisplay])
 async def list_users_cart_items(
@@ -28,7 +36,8 @@ async def list_users_cart_items(
     user: User = Depends(get_current_user),
 ):
     # This now calls the optimized join query in crud/cart.py
-    return await crud.get_cartitems(session=db, user=user)
+    rows = await crud.get_cartitem_rows(session=db, user=user)
+    return CART_ITEM_ROWS.response(rows)
 
 
 @router.get("/total")
@@ -39,6 +48,14 @@ async def list_users_total_cart_price(
     return await crud.get_total_price(session=db, user=user)
 
 
+@router.get("/summary", response_model=CartSummary)
+async def get_cart_summary(
+    db: session_dep,
+    user: User = Depends(get_current_user),
+):
+    return await crud.get_cart_summary(session=db, user=user)
+
+
 @router.post("/item/{product_id}")
 async def add_to_cart(
     product_id: uuid.UUID,
@@ -82,6 +99,21 @@ async def remove_item_from_cart(
     await db.commit()
 
 
+@router.patch("/", response_model=CartBatchResult)
+async def update_cart(
+    batch: CartBatchUpdate,
+    db: session_dep,
+    user: User = Depends(get_current_user),
+):
+    # many add / set / remove operations in one round trip, returns the
+    # resulting cart so the client doesn't have to fetch it again
+    return await crud.apply_cart_operations(
+        session=db,
+        user=user,
+        operations=batch.operations,
+    )
+
+
 @router.delete("/")
 async def clear_cart(
     db: session_dep,
@@ -92,6 +124,28 @@ async def clear_cart(
         user=user,
     )
     await db.commit()
+    await catalog_cache.invalidate_committed(db)
+
+
+@router.post("/reserve", response_model=CartReservation)
+async def reserve_cart(
+    db: session_dep,
+    user: User = Depends(get_current_user),
+):
+    # call when checkout starts (and again to refresh the hold), the stock
+    # stays held for this cart until checkout, release or expiry
+    return await crud.reserve_cart(session=db, user=user)
+
+
+@router.delete("/reserve")
+async def release_cart_reservation(
+    db: session_dep,
+    user: User = Depends(get_current_user),
+):
+    released = await crud.release_cart_reservations(session=db, user=user)
+    await db.commit()
+    await catalog_cache.invalidate_committed(db)
+    return {"released": released}
 
 
 @router.patch("/item/{product_id}")
@@ -121,27 +175,9 @@ async def inc_dec_cart_item_quantity(
     amount: int,
     user: User = Depends(get_current_user),
 ):
-    stmt = (
-        select(CartItem, Product)
-        .join(Product, Product.id == CartItem.product_id)  # pyright: ignore
-        .where(
-            CartItem.id == cart_item_id,
-        )
+    return await crud.inc_dec_cart_item_quantity(
+        session=db,
+        user=user,
+        cart_item_id=cart_item_id,
+        amount=amount,
     )
-    result = await db.execute(stmt)
-    cart_item = result.fetchone()
-    if cart_item is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Item not found in cart"
-        )
-    cart_item.CartItem.quantity += amount
-
-    if cart_item.CartItem.quantity < 1:
-        cart_item.CartItem.quantity = 1
-
-    if cart_item.CartItem.quantity > cart_item.Product.stock:
-        cart_item.CartItem.quantity = cart_item.Product.stock
-
-    await db.commit()
-    await db.refresh(cart_item)
-    return cart_item
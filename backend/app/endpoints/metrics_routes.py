@@ -0,0 +1,142 @@
+import os
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+
+from app.database import get_pool_status
+from app.services.crud.stock_shards import SHARD_TAKES
+from app.services.khalti import khalti_client
+from app.services.reservation_sweeper import reservation_sweeper
+from app.utils.cache import CACHE_REGISTRY
+from app.utils.metrics import metrics
+from app.utils.query_stats import query_stats
+from app.utils.security import hashing_pool
+
+router = APIRouter()
+
+# scrapers authenticate with this bearer token when it's set, otherwise
+# /metrics is open and should be kept off the public network
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_CACHE_COUNTERS = ("hits", "misses", "evictions", "errors")
+_CACHE_GAUGES = ("size", "max_size", "hit_ratio")
+
+
+@metrics.collector
+def _db_pool_metrics():
+    pool = get_pool_status()
+    yield "db_pool_connections", "gauge", "DB pool connections by state.", {
+        (("state", state),): pool[state]
+        for state in ("size", "checked_out", "checked_in", "overflow")
+        if state in pool
+    }
+    yield "db_pool_checkouts_total", "counter", "DB pool checkouts.", {
+        (): pool["checkouts"]
+    }
+    yield "db_pool_connects_total", "counter", "New DB connections opened.", {
+        (): pool["connects"]
+    }
+    yield "db_pool_invalidations_total", "counter", "DB connections invalidated.", {
+        (): pool["invalidations"]
+    }
+    yield "db_pool_wait_seconds_total", "counter", "Time spent waiting on the pool.", {
+        (): pool["total_wait_seconds"]
+    }
+
+
+@metrics.collector
+def _password_hashing_metrics():
+    stats = hashing_pool.stats()
+    yield "password_hash_queue_depth", "gauge", "Hashes waiting for a worker.", {
+        (): stats["queue_depth"]
+    }
+    yield "password_hash_in_flight", "gauge", "Hashes running right now.", {
+        (): stats["in_flight"]
+    }
+    yield "password_hash_completed_total", "counter", "Hashes finished.", {
+        (): stats["completed"]
+    }
+    yield "password_hash_rejected_total", "counter", "Hashes refused with 503.", {
+        (): stats["rejected"]
+    }
+
+
+@metrics.collector
+def _cache_metrics():
+    caches = {name: cache.stats() for name, cache in CACHE_REGISTRY.items()}
+    for key in _CACHE_COUNTERS:
+        yield f"cache_{key}_total", "counter", f"Cache {key} by cache.", {
+            (("cache", name),): stats[key]
+            for name, stats in caches.items()
+            if key in stats
+        }
+    for key in _CACHE_GAUGES:
+        yield f"cache_{key}", "gauge", f"Cache {key} by cache.", {
+            (("cache", name),): stats[key]
+            for name, stats in caches.items()
+            if key in stats
+        }
+
+
+@metrics.collector
+def _query_metrics():
+    routes = query_stats.routes
+    yield "db_queries_total", "counter", "SQL statements run, by route.", {
+        (("route", route),): r.queries for route, r in routes.items()
+    }
+    yield "db_query_seconds_total", "counter", "Time spent in SQL, by route.", {
+        (("route", route),): r.db_seconds for route, r in routes.items()
+    }
+    yield (
+        "db_query_budget_exceeded_total",
+        "counter",
+        "Requests over the query budget, by route.",
+        {(("route", route),): r.over_budget for route, r in routes.items()},
+    )
+
+
+@metrics.collector
+def _payment_gateway_metrics():
+    breaker = khalti_client.breaker
+    yield "payment_gateway_circuit_open", "gauge", "1 while the breaker is open.", {
+        (): int(breaker.state == "open")
+    }
+    yield "payment_gateway_calls_total", "counter", "Calls made to khalti.", {
+        (): khalti_client.calls
+    }
+
+
+@metrics.collector
+def _reservation_metrics():
+    yield (
+        "stock_reservation_products_restocked_total",
+        "counter",
+        "Products given back stock from expired holds.",
+        {(): reservation_sweeper.products_restocked},
+    )
+    yield (
+        "stock_reservation_sweep_errors_total",
+        "counter",
+        "Reservation sweeps that failed.",
+        {(): reservation_sweeper.errors},
+    )
+
+
+@metrics.collector
+def _stock_shard_metrics():
+    yield (
+        "stock_shard_takes_total",
+        "counter",
+        "Stock taken from striped products, by how a shard was found.",
+        {(("path", path),): count for path, count in SHARD_TAKES.items()},
+    )
+
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    if METRICS_TOKEN is not None:
+        if request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -3,11 +3,19 @@ import uuid
 from typing import Annotated, List
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 
-from app.database import get_async_session
+from app.database import get_async_session, stream_with_own_session
 from app.models.dbmodel import Order, User
 
 # from app.schemas.schema import ( )
@@ -16,18 +24,29 @@ from app.schemas.schema import (
     VALID_TRANSACTIONS,
     CreateOrderRequest,
     OrderDisplay,
+    OrderHistoryPage,
     OrderIdBody,
     OrderItemDisplay,
     OrderStatus,
     OrderStatusUpdate,
 )
 from app.services import crud
+from app.services.catalog_cache import catalog_cache
 from app.services.deps import get_current_active_admin, get_current_user
+from app.utils.http_cache import etag_matches, make_etag, not_modified
+from app.utils.serialization import RowSerializer
+from app.utils.streaming import STREAM_BATCH_SIZE, stream_rows, wants_ndjson
 
 router = APIRouter()
 
 session_dep = Annotated[AsyncSession, Depends(get_async_session)]
 
+# per user data, the browser may keep it but has to revalidate every time
+ORDER_CACHE_CONTROL = "private, no-cache"
+
+ORDER_ROWS = RowSerializer(OrderDisplay)
+ORDER_ITEM_ROWS = RowSerializer(OrderItemDisplay)
+
 
 @router.post("/")
 async def order_items_in_cart(
@@ -39,25 +58,18 @@ async def order_items_in_cart(
         # Use begin_nested() instead of begin()
         # because i already use a .being() during my db initialization
         async with db.begin_nested():
-            order = await crud.create_order(
+            # reserves stock, writes the order + items and empties the cart
+            # in two statements, see crud/checkout.py
+            order_id = await crud.checkout_cart(
                 payload=payload,
                 session=db,
                 user=user,
             )
-            await crud.create_order_items(
-                session=db,
-                user=user,
-                order_id=order.id,
-            )
-            await crud.clear_cart(
-                session=db,
-                user=user,
-            )
 
         # The nested transaction commits to the main transaction here
         await db.commit()
-        await db.refresh(order)
-        return {"message": "Order placed successfully", "order_id": order.id}
+        await catalog_cache.invalidate_committed(db)
+        return {"message": "Order placed successfully", "order_id": order_id}
 
     except HTTPException as e:
         raise e
@@ -68,26 +80,101 @@ async def order_items_in_cart(
 
 @router.get("/orderitems", response_model=list[OrderItemDisplay])
 async def list_order_items(
+    request: Request,
     db: session_dep,
+    stream: bool = False,
     user: User = Depends(get_current_user),
 ):
+    # Accept: application/x-ndjson or ?stream=true sends it as it's read
+    if stream or wants_ndjson(request):
+        return stream_rows(
+            stream_with_own_session(
+                crud.stream_users_order_items, user=user, batch_size=STREAM_BATCH_SIZE
+            ),
+            serializer=ORDER_ITEM_ROWS,
+            ndjson=wants_ndjson(request),
+            headers={"Cache-Control": ORDER_CACHE_CONTROL},
+        )
+
     order_item = await crud.get_users_order_items(
         session=db,
         user=user,
     )
-    return order_item
+    # hashing the rows is far cheaper than serializing the whole list just
+    # to find out the client already has it. every column that's rendered
+    # goes in, name comes from Product and changes when it's renamed
+    etag = make_etag([tuple(row) for row in order_item])
+    headers = {"ETag": etag, "Cache-Control": ORDER_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(headers)
+
+    return ORDER_ITEM_ROWS.response(order_item, headers=headers)
 
 
 @router.get("/", response_model=list[OrderDisplay])
 async def list_orders(
+    request: Request,
     db: session_dep,
+    stream: bool = False,
     user: User = Depends(get_current_user),
 ):
+    if stream or wants_ndjson(request):
+        return stream_rows(
+            stream_with_own_session(
+                crud.stream_users_orders, user=user, batch_size=STREAM_BATCH_SIZE
+            ),
+            serializer=ORDER_ROWS,
+            ndjson=wants_ndjson(request),
+            headers={"Cache-Control": ORDER_CACHE_CONTROL},
+        )
+
     orders = await crud.get_users_orders(
         session=db,
         user=user,
     )
-    return orders
+    etag = make_etag([tuple(row) for row in orders])
+    headers = {"ETag": etag, "Cache-Control": ORDER_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(headers)
+
+    return ORDER_ROWS.response(orders, headers=headers)
+
+
+@router.get("/history", response_model=OrderHistoryPage)
+async def list_order_history(
+    request: Request,
+    response: Response,
+    db: session_dep,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
+    limit: int = Query(default=10, ge=1, le=50),
+):
+    # orders with their items nested, newest first, one page at a time
+    page = await crud.get_order_history(
+        session=db,
+        user=user,
+        limit=limit,
+        cursor=cursor,
+    )
+    etag = make_etag(
+        [
+            (
+                o.id,
+                o.status,
+                o.total_price,
+                o.address,
+                [(i.id, i.quantity, i.price_at_purchase) for i in o.items],
+            )
+            for o in page.items
+        ]
+        + [page.next_cursor]
+    )
+    headers = {"ETag": etag, "Cache-Control": ORDER_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(headers)
+
+    response.headers.update(headers)
+    return page
 
 
 @router.delete("/order_item/{order_item_id}")
@@ -107,6 +194,7 @@ async def delete_order_item(
         )
 
     await db.commit()
+    await catalog_cache.invalidate_committed(db)
     await db.refresh(product)
     return {"message": "Order cancelled", "new_stock": product.stock}
 
@@ -124,6 +212,7 @@ async def delete_order(
     )
 
     await db.commit()
+    await catalog_cache.invalidate_committed(db)
     return {"message": "Order cancelled"}
 
 
@@ -1,80 +1,59 @@
-import os
+from typing import Annotated
 
-import httpx
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.database import get_async_session
+from app.models.dbmodel import User
 from app.schemas.schema import PaymentInitiate
+from app.services import crud
+from app.services.deps import get_current_user
+from app.services.khalti import PAISA_PER_RUPEE, khalti_client
+from app.services.payment_reconciler import (
+    PAYMENT_VERIFY_WAIT_SECONDS,
+    payment_reconciler,
+)
 
 router = APIRouter()
 
+session_dep = Annotated[AsyncSession, Depends(get_async_session)]
+
 load_dotenv()
 
 
 # send a post requst to kpg with reuired info to get pidx and payment_rl
 @router.post("/initiate")
-async def initiate_kpg(data: PaymentInitiate):
+async def initiate_kpg(
+    data: PaymentInitiate,
+    db: session_dep,
+    user: User = Depends(get_current_user),
+):
+    order = await crud.get_payable_order(session=db, order_id=data.order_id, user=user)
     payload = {
         "return_url": "http://localhost:5173/payment/verify",
         "website_url": "http://localhost:5173",
-        "amount": data.amount,
-        "purchase_order_id": str(data.order_id),
-        "purchase_order_name": str(data.order_id),  # or any string works for now
+        "amount": order.total_price * PAISA_PER_RUPEE,
+        "purchase_order_id": str(order.id),
+        "purchase_order_name": str(order.id),  # or any string works for now
     }
-    KHALTI_SECRET_KEY = os.getenv("KHALTI_SECRET_KEY")
-    if KHALTI_SECRET_KEY is None:
-        raise RuntimeError("KHALTI_INITIATE_URL env var not set")
-
-    headers = {"Authorization": f"Key {KHALTI_SECRET_KEY}"}
-    print(f"KEY: '{KHALTI_SECRET_KEY}'")
-
-    KHALTI_INITIATE_URL = os.getenv("KHALTI_INITIATE_URL")
-    if KHALTI_INITIATE_URL is None:
-        raise RuntimeError("KHALTI_INITIATE_URL env var not set")
-
-    # async with httpx.AsyncClient() as client:
-    #     res = await client.post(
-    #         KHALTI_INITIATE_URL,
-    #         json=payload,
-    #         headers=headers,
-    #     )
-    # return res.json()  # contains payment_url, pidx
-
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            res = await client.post(
-                KHALTI_INITIATE_URL,
-                json=payload,
-                headers=headers,
-            )
-            res.raise_for_status()  # raises on 4xx/5xx from Khalti
-            return res.json()
-        except httpx.ConnectTimeout:
-            raise HTTPException(
-                status_code=502, detail=f"Khalti unreachable at: {KHALTI_INITIATE_URL}"
-            )
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=e.response.status_code, detail=e.response.text
-            )
+    res = await khalti_client.initiate(payload)
+    pidx = res.get("pidx") if isinstance(res, dict) else None
+    if not isinstance(pidx, str) or not pidx:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Khalti didn't return a pidx",
+        )
+    await crud.set_order_payment_pidx(
+        session=db, order_id=order.id, user=user, pidx=pidx
+    )
+    return res
 
 
 # verify with kpg that the transation was complete
 @router.get("/verify")
 async def verify_payment(pidx: str):
-    headers = {"Authorization": f"Key {os.getenv('KHALTI_SECRET_KEY')}"}
-
-    KHALTI_VERIFY_URL = os.getenv("KHALTI_VERIFY_URL")
-    if KHALTI_VERIFY_URL is None:
-        raise RuntimeError("KHALTI_INITIATE_URL env var not set")
-
-    async with httpx.AsyncClient() as client:
-        res = await client.post(
-            KHALTI_VERIFY_URL,
-            json={"pidx": pidx},
-            headers=headers,
-        )
-        data = res.json()
-        # data.status == "Completed" means payment successful
-        # update your order status here
-        return data
+    # data.status == "Completed" means payment successful, the order is
+    # already marked paid by then. "Pending" means khalti didn't answer in
+    # time, the reconciler keeps at it and the client can ask again
+    return await payment_reconciler.verify(pidx, wait=PAYMENT_VERIFY_WAIT_SECONDS)
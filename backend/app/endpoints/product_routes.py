@@ -3,21 +3,29 @@ import uuid
 from typing import Annotated, List
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_async_session
+from app.database import get_async_session, stream_with_own_session
 from app.models.dbmodel import User
 from app.schemas.schema import (
     CartItemDisplay,
     DisplayTotalPrice,
     ProductCreate,
     ProductDisplay,
+    ProductPage,
+    ProductSearchResult,
+    ProductSort,
 )
 
 # Unified import from the new modular structure
 from app.services import crud
+from app.services.crud.product import PRODUCT_ROWS
 from app.services.deps import get_current_active_admin, get_current_user
+from app.utils.env import env_int
+from app.utils.http_cache import etag_matches, not_modified
+from app.utils.serialization import FastJSONResponse
+from app.utils.streaming import STREAM_BATCH_SIZE, stream_rows, wants_ndjson
 
 router = APIRouter()
 load_dotenv()
@@ -25,25 +33,76 @@ load_dotenv()
 # Dependency Alias
 session_dep = Annotated[AsyncSession, Depends(get_async_session)]
 
+# browsers may reuse a catalog page this long before revalidating with the etag
+CATALOG_CACHE_CONTROL = (
+    f"public, max-age={env_int('CATALOG_HTTP_MAX_AGE', 10)}, must-revalidate"
+)
+
 
-@router.get("/", response_model=List[ProductDisplay])
+@router.get("/", response_model=ProductPage)
 async def list_products(
+    request: Request,
+    db: session_dep,
+    cursor: str | None = None,
+    sort: ProductSort = ProductSort.NAME,
+    limit: int | None = Query(default=None, ge=1, le=100),
+    stream: bool = False,
+):
+    # streamed, it's every product after cursor instead of one page, as a
+    # json array (?stream=true) or json lines (Accept: application/x-ndjson)
+    if stream or wants_ndjson(request):
+        statement = crud.stream_products_statement(
+            sort=sort, cursor=cursor, batch_size=STREAM_BATCH_SIZE
+        )
+        return stream_rows(
+            stream_with_own_session(crud.stream_products, statement=statement),
+            serializer=PRODUCT_ROWS,
+            ndjson=wants_ndjson(request),
+            headers={"Cache-Control": CATALOG_CACHE_CONTROL},
+        )
+
+    if limit is None:
+        limit_str = os.getenv("PRODUCT_LIMIT_PER_PAGE")
+        if not limit_str:
+            raise RuntimeError("PRODUCT_LIMIT_PER_PAGE env var not set")
+        limit = int(limit_str)
+
+    # keyset pagination, pass back next_cursor / prev_cursor to move between pages
+    page, etag = await crud.get_products_page_data(
+        session=db,
+        limit=limit,
+        sort=sort,
+        cursor=cursor,
+    )
+    headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(headers)
+
+    # already shaped like ProductPage, skip re-validating it on the way out
+    return FastJSONResponse(content=page, headers=headers)
+
+
+@router.get("/search", response_model=ProductSearchResult)
+async def search_products(
     db: session_dep,
+    q: str = Query(min_length=1, max_length=200),
+    category: str | None = None,
+    min_price: int | None = Query(default=None, ge=0),
+    max_price: int | None = Query(default=None, ge=0),
+    limit: int = Query(default=20, ge=1, le=100),
+    # relevance order has no stable key to seek on, so search pages by
+    # offset and caps how deep you can go
+    offset: int = Query(default=0, ge=0, le=1000),
 ):
-    limit_str = os.getenv("PRODUCT_LIMIT_PER_PAGE")
-    if not limit_str:
-        raise RuntimeError("PRODUCT_LIMIT_PER_PAGE env var not set")
-    page = 1
-    limit = int(limit_str)
-    offset = (page - 1) * limit
-
-    # Accessing via crud module
-    products = await crud.get_products_paginated(
+    return await crud.search_products(
         session=db,
+        q=q,
+        category=category,
+        min_price=min_price,
+        max_price=max_price,
         limit=limit,
         offset=offset,
     )
-    return products
 
 
 @router.get("/update_stock")
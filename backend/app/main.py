@@ -3,28 +3,56 @@ from contextlib import asynccontextmanager
 from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.database import check_db_connection
+from app.database import check_db_connection, engine
 from app.endpoints import (
     admin_routes,
     auth_routes,
     cart_routes,
+    metrics_routes,
     order_routes,
     payment_routes,
     product_routes,
 )
 from app.models.dbmodel import User
+from app.services.catalog_cache import catalog_cache
 from app.services.deps import get_current_user
+from app.services.khalti import khalti_client
+from app.services.payment_reconciler import (
+    PAYMENT_RECONCILER_ENABLED,
+    payment_reconciler,
+)
+from app.services.reservation_sweeper import (
+    RESERVATION_SWEEPER_ENABLED,
+    reservation_sweeper,
+)
+from app.utils.metrics import METRICS_ENABLED, MetricsMiddleware
+from app.utils.query_stats import QUERY_STATS_ENABLED, QueryStatsMiddleware, query_stats
+from app.utils.security import hashing_pool
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # await init_db()
     await check_db_connection()
+    await khalti_client.start()
+    if PAYMENT_RECONCILER_ENABLED:
+        payment_reconciler.start()
+    if RESERVATION_SWEEPER_ENABLED:
+        reservation_sweeper.start()
     yield
+    await reservation_sweeper.stop()
+    await payment_reconciler.stop()
+    await khalti_client.close()
+    hashing_pool.shutdown()
+    await catalog_cache.close()
+    await engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
 
+if QUERY_STATS_ENABLED:
+    query_stats.install(engine)
+    app.add_middleware(QueryStatsMiddleware, query_stats=query_stats)
 origins = [
     "http://localhost:5173",
 ]
@@ -36,6 +64,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if METRICS_ENABLED:
+    # added last so it's outermost and times everything below it, CORS included
+    app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(auth_routes.router, prefix="/auth")
@@ -44,6 +75,7 @@ app.include_router(cart_routes.router, prefix="/cart")
 app.include_router(order_routes.router, prefix="/order")
 app.include_router(admin_routes.router, prefix="/admin")
 app.include_router(payment_routes.router, prefix="/payment")
+app.include_router(metrics_routes.router)
 
 
 @app.get("/")
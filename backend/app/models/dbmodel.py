@@ -3,6 +3,7 @@ from datetime import datetime, timezone
 from typing import Any
 
 from pydantic_core.core_schema import nullable_schema
+from sqlalchemy import Index, UniqueConstraint, text
 from sqlmodel import Column, Field, Relationship, SQLModel, String
 
 from app.schemas.schema import OrderStatus, UserBase
@@ -24,6 +25,13 @@ class User(UserBase, table=True):
 
 class Product(SQLModel, table=True):
     __tablename__: Any = "Product"
+    # composite (sort_key, id) indexes so keyset pagination is an index range scan
+    # category is nullable so that one is on the coalesced value the query sorts by
+    __table_args__ = (
+        Index("ix_Product_name_id", "name", "id"),
+        Index("ix_Product_price_id", "price", "id"),
+        Index("ix_Product_category_id", text("coalesce(category, '')"), "id"),
+    )
 
     id: uuid.UUID = Field(
         default_factory=uuid.uuid4,
@@ -35,12 +43,28 @@ class Product(SQLModel, table=True):
     price: int
     description: str
     stock: int = Field(default=0, nullable=False)
-    category: str = Field(default="Home", nullable=True)
+    category: str = Field(default="Home", nullable=True, index=True)
     image_url: str = Field(default=" ", nullable=True)
+    # > 0 when the stock is striped over that many ProductStockShard rows,
+    # stock is then only what hasn't been spread over them yet
+    stock_shards: int = Field(default=0, nullable=False)
 
 
 class Order(SQLModel, table=True):
     __tablename__: Any = "Order"
+    # order history is a user's orders newest first, paged on (ordered_at, id)
+    # so this serves both the filter and the keyset walk. it also covers plain
+    # user_id lookups, no separate index for those
+    __table_args__ = (
+        Index("ix_Order_user_id_ordered_at_id", "user_id", "ordered_at", "id"),
+        # the payment reconciler only ever looks at pending orders that went
+        # to khalti, newest first
+        Index(
+            "ix_Order_pending_payment",
+            "ordered_at",
+            postgresql_where=text("status = 'pending' AND payment_pidx IS NOT NULL"),
+        ),
+    )
 
     id: uuid.UUID = Field(
         default_factory=uuid.uuid4,
@@ -58,6 +82,8 @@ class Order(SQLModel, table=True):
     longitude: float
     latitude: float
     address: str
+    # khalti's payment id from /payment/initiate
+    payment_pidx: str | None = Field(default=None, nullable=True, unique=True)
 
 
 class OrderItem(SQLModel, table=True):
@@ -72,6 +98,7 @@ class OrderItem(SQLModel, table=True):
     order_id: uuid.UUID = Field(
         foreign_key="Order.id",
         nullable=False,
+        index=True,
     )
     product_id: uuid.UUID = Field(
         foreign_key="Product.id",
@@ -89,14 +116,37 @@ class Cart(SQLModel, table=True):
         index=True,
         nullable=False,
     )
+    # one cart per user
     user_id: uuid.UUID = Field(
         foreign_key="User.id",
         nullable=False,
+        unique=True,
+        index=True,
+    )
+    # running totals over the cart's lines, every write to CartItem updates
+    # them in the same transaction (see crud/cart.py) so reading the total is
+    # one row instead of joining and summing the lines. version goes up on
+    # every change
+    item_count: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"}
+    )
+    subtotal: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"}
+    )
+    version: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"}
     )
 
 
 class CartItem(SQLModel, table=True):
     __tablename__: Any = "CartItem"
+    # one line per product in a cart, this also serves every cart_id lookup
+    # so there is no separate index on cart_id
+    __table_args__ = (
+        UniqueConstraint(
+            "cart_id", "product_id", name="uq_CartItem_cart_id_product_id"
+        ),
+    )
     id: uuid.UUID = Field(
         default_factory=uuid.uuid4,
         primary_key=True,
@@ -110,5 +160,52 @@ class CartItem(SQLModel, table=True):
     product_id: uuid.UUID = Field(
         foreign_key="Product.id",
         nullable=False,
+        index=True,
     )
     quantity: int
+
+
+class StockReservation(SQLModel, table=True):
+    __tablename__: Any = "StockReservation"
+    # a hold of quantity units of a product for one cart, taken out of
+    # Product.stock when checkout starts and turned into OrderItems by the
+    # checkout itself. expired holds are handed back to stock by the
+    # reservation sweeper. one hold per cart line, which also serves the
+    # cart_id lookups
+    __table_args__ = (
+        UniqueConstraint(
+            "cart_id", "product_id", name="uq_StockReservation_cart_id_product_id"
+        ),
+    )
+    id: uuid.UUID = Field(
+        default_factory=uuid.uuid4,
+        primary_key=True,
+        nullable=False,
+    )
+    cart_id: uuid.UUID = Field(
+        foreign_key="Cart.id",
+        nullable=False,
+    )
+    product_id: uuid.UUID = Field(
+        foreign_key="Product.id",
+        nullable=False,
+        index=True,
+    )
+    quantity: int = Field(nullable=False)
+    # the sweeper walks this oldest first
+    expires_at: datetime = Field(nullable=False, index=True)
+
+
+class ProductStockShard(SQLModel, table=True):
+    __tablename__: Any = "ProductStockShard"
+    # one slice of a hot product's stock. checkouts take from a random shard
+    # so concurrent buyers of the same product lock different rows, see
+    # crud/stock_shards.py. the product's stock is Product.stock plus the sum
+    # of its shards
+    product_id: uuid.UUID = Field(
+        foreign_key="Product.id",
+        primary_key=True,
+        nullable=False,
+    )
+    shard: int = Field(primary_key=True, nullable=False)
+    stock: int = Field(default=0, nullable=False)
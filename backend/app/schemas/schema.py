@@ -47,10 +47,75 @@ class ProductDisplay(SQLModel):
     price: int
     description: str
     stock: int
-    category: str
+    category: str | None
     image_url: str | None
 
 
+class ProductSort(str, Enum):
+    NAME = "name"
+    PRICE = "price"
+    CATEGORY = "category"
+
+
+class ProductPage(SQLModel):
+    items: list[ProductDisplay]
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+
+class ProductSearchHit(ProductDisplay):
+    rank: float
+
+
+class CategoryFacet(SQLModel):
+    category: str | None
+    count: int
+
+
+class ProductSearchResult(SQLModel):
+    items: list[ProductSearchHit]
+    total: int
+    facets: list[CategoryFacet]
+    limit: int
+    offset: int
+
+
+class ProductStockShardsUpdate(SQLModel):
+    # 0 turns striping off again
+    shards: int = Field(ge=0)
+
+
+class ProductStockShards(SQLModel):
+    product_id: uuid.UUID
+    shards: int
+    # the whole stock, whatever it's spread over
+    stock: int
+
+
+class ProductFileFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+class ProductImportRow(SQLModel):
+    # one json line of an import, anything left out keeps its current value
+    # (or the column default for a new product)
+    name: str
+    price: int | None = None
+    description: str | None = None
+    category: str | None = None
+    stock: int | None = None
+    image_url: str | None = None
+
+
+class ProductImportResult(SQLModel):
+    rows: int
+    inserted: int
+    updated: int
+    # duplicate names, blank names and products the file didn't change
+    unchanged: int
+
+
 class CartItemDisplay(SQLModel):
     id: uuid.UUID
     name: str
@@ -63,6 +128,45 @@ class DisplayTotalPrice(SQLModel):
     total_price: int
 
 
+class CartSummary(SQLModel):
+    item_count: int
+    subtotal: int
+    version: int
+
+
+class CartOperationType(str, Enum):
+    ADD = "add"  # quantity is added to the line, negative takes away
+    SET = "set"  # line ends up with exactly quantity
+    REMOVE = "remove"  # quantity is ignored
+
+
+class CartOperation(SQLModel):
+    op: CartOperationType
+    product_id: uuid.UUID
+    quantity: int = 0
+
+
+class CartBatchUpdate(SQLModel):
+    # applied in order, all or nothing
+    operations: list[CartOperation] = Field(min_length=1, max_length=100)
+
+
+class CartBatchResult(SQLModel):
+    items: list[CartItemDisplay]
+    summary: CartSummary
+
+
+class ReservedLine(SQLModel):
+    product_id: uuid.UUID
+    quantity: int
+
+
+class CartReservation(SQLModel):
+    # held stock for every line of the cart, until expires_at
+    items: list[ReservedLine]
+    expires_at: datetime
+
+
 class OrderStatus(str, Enum):
     PENDING = "pending"  # (1) Order created, but money hasn't moved
     PAID = "paid"  # (2) Money received
@@ -103,8 +207,8 @@ class CreateOrderRequest(SQLModel):
 
 
 class PaymentInitiate(SQLModel):
+    # the amount is the order's total, whatever the client sends is ignored
     order_id: uuid.UUID
-    amount: int  # in paisa
 
 
 class OrderIdBody(SQLModel):
@@ -119,6 +223,24 @@ class OrderDisplay(SQLModel):
     ordered_at: datetime
 
 
+class OrderHistoryItem(SQLModel):
+    id: uuid.UUID
+    product_id: uuid.UUID
+    name: str
+    quantity: int
+    price_at_purchase: int
+
+
+class OrderWithItems(OrderDisplay):
+    items: list[OrderHistoryItem]
+
+
+class OrderHistoryPage(SQLModel):
+    # newest first, next_cursor walks back in time and is None on the last page
+    items: list[OrderWithItems]
+    next_cursor: str | None = None
+
+
 VALID_TRANSACTIONS: dict[OrderStatus, set[OrderStatus]] = {
     OrderStatus.PENDING: {OrderStatus.PAID, OrderStatus.CANCELLED},
     OrderStatus.PAID: {OrderStatus.SHIPPED, OrderStatus.CANCELLED},
@@ -0,0 +1,197 @@
+import logging
+import os
+import uuid
+from typing import Any, Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.dbmodel import Product
+from app.utils.cache import CACHE_REGISTRY, CacheBackend, MemoryBackend, RedisBackend
+from app.utils.env import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+# the catalog only changes through the admin routes, update_stock and stock
+# moving at checkout / cancellation, so reads are served from here and every
+# one of those writes invalidates.
+#
+# single products are cached under their id and name and deleted on write.
+# list pages depend on every product so instead of tracking them they are
+# keyed by a catalog version that each write bumps, old pages just age out
+#
+# the in memory backend is per worker process, set CATALOG_CACHE_URL to a
+# redis:// url to share one cache (and its invalidations) between workers
+
+_PRODUCT_FIELDS = (
+    "id",
+    "name",
+    "price",
+    "description",
+    "stock",
+    "category",
+    "image_url",
+)
+
+
+class CatalogCache:
+    VERSION_KEY = "catalog:version"
+    # session.info key of the invalidations waiting for the session to commit
+    PENDING_KEY = "catalog_cache_pending"
+    DELETE_BATCH = 1000
+
+    def __init__(
+        self, backend: CacheBackend, *, page_ttl: float, product_ttl: float
+    ) -> None:
+        self.backend = backend
+        self.page_ttl = page_ttl
+        self.product_ttl = product_ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        CACHE_REGISTRY["catalog"] = self
+
+    # a broken cache server must never take the catalog down with it, any
+    # backend error is counted and treated as a miss / no-op
+    async def _get(self, key: str) -> Any | None:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("catalog cache get failed: %s", e)
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def _set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            await self.backend.set(key, value, ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("catalog cache set failed: %s", e)
+
+    async def version(self) -> int:
+        try:
+            return await self.backend.get_counter(self.VERSION_KEY)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("catalog cache version read failed: %s", e)
+            return -1
+
+    def _page_key(self, version: int, sort: str, limit: int, cursor: str | None) -> str:
+        return f"catalog:v{version}:page:{sort}:{limit}:{cursor or ''}"
+
+    async def get_page(
+        self, *, version: int, sort: str, limit: int, cursor: str | None
+    ) -> dict | None:
+        if version < 0:
+            return None
+        return await self._get(self._page_key(version, sort, limit, cursor))
+
+    async def set_page(
+        self, *, version: int, sort: str, limit: int, cursor: str | None, page: dict
+    ) -> None:
+        # version is read before the query ran, if a write landed in between
+        # the page goes under the old version and is never served
+        if version < 0:
+            return
+        await self._set(
+            self._page_key(version, sort, limit, cursor), page, self.page_ttl
+        )
+
+    async def get_product(
+        self, *, product_id: uuid.UUID | None = None, name: str | None = None
+    ) -> Product | None:
+        key = f"product:id:{product_id}" if product_id else f"product:name:{name}"
+        data = await self._get(key)
+        if data is None:
+            return None
+        # a fresh detached object per hit, and ids come back as str from redis
+        data = dict(data)
+        data["id"] = uuid.UUID(str(data["id"]))
+        return Product(**data)
+
+    async def set_product(self, product: Product) -> None:
+        data = {field: getattr(product, field) for field in _PRODUCT_FIELDS}
+        data["id"] = str(data["id"])
+        await self._set(f"product:id:{product.id}", data, self.product_ttl)
+        await self._set(f"product:name:{product.name}", data, self.product_ttl)
+
+    async def invalidate(
+        self,
+        *,
+        product_ids: Iterable[uuid.UUID] = (),
+        names: Iterable[str] = (),
+    ) -> None:
+        keys = [f"product:id:{product_id}" for product_id in product_ids]
+        keys += [f"product:name:{name}" for name in names]
+        try:
+            # a bulk import can change the whole catalog, keep each DEL sane
+            for start in range(0, len(keys), self.DELETE_BATCH):
+                await self.backend.delete(*keys[start : start + self.DELETE_BATCH])
+            await self.backend.incr(self.VERSION_KEY)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("catalog cache invalidation failed: %s", e)
+
+    # crud that leaves the commit to its caller can't invalidate itself, a
+    # read between the invalidation and the commit would cache the old rows
+    # again for a whole ttl. it queues the keys on the session instead and
+    # whoever commits calls invalidate_committed right after
+    def invalidate_after_commit(
+        self,
+        session: AsyncSession,
+        *,
+        product_ids: Iterable[uuid.UUID] = (),
+        names: Iterable[str] = (),
+    ) -> None:
+        pending_ids, pending_names = session.info.setdefault(
+            self.PENDING_KEY, (set(), set())
+        )
+        pending_ids.update(product_ids)
+        pending_names.update(names)
+
+    async def invalidate_committed(self, session: AsyncSession) -> None:
+        pending = session.info.pop(self.PENDING_KEY, None)
+        if pending is not None:
+            product_ids, names = pending
+            await self.invalidate(product_ids=product_ids, names=names)
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": self.backend.name,
+            "page_ttl_seconds": self.page_ttl,
+            "product_ttl_seconds": self.product_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+        if isinstance(self.backend, MemoryBackend):
+            stats["size"] = len(self.backend.cache)
+            stats["evictions"] = self.backend.cache.evictions
+        return stats
+
+
+def _make_backend() -> CacheBackend:
+    url = os.getenv("CATALOG_CACHE_URL")
+    if url:
+        return RedisBackend.from_url(url)
+    return MemoryBackend(
+        name="catalog",
+        max_size=env_int("CATALOG_CACHE_MAX_SIZE", 5_000),
+        ttl=env_float("CATALOG_CACHE_PRODUCT_TTL_SECONDS", 300.0),
+    )
+
+
+catalog_cache = CatalogCache(
+    _make_backend(),
+    page_ttl=env_float("CATALOG_CACHE_PAGE_TTL_SECONDS", 30.0),
+    product_ttl=env_float("CATALOG_CACHE_PRODUCT_TTL_SECONDS", 300.0),
+)
@@ -1,27 +1,55 @@
 from .cart import (
+    apply_cart_operations,
     check_for_cart_or_create,
     clear_cart,
     create_cart,
     create_cart_item,
+    get_cartitem_rows,
+    get_cart_summary,
     get_cartitems,
     get_total_price,
+    inc_dec_cart_item_quantity,
     remove_cart_item,
+    reprice_cart_summaries,
     update_quantity,
 )
+from .checkout import checkout_cart
 from .order import (
-    create_order,
-    create_order_items,
     delete_all_order_items_of_order,
     delete_order,
     delete_order_item,
+    get_order_history,
+    get_payable_order,
     get_users_order_items,
     get_users_orders,
+    restore_order_items_stock,
+    set_order_payment_pidx,
+    stream_users_order_items,
+    stream_users_orders,
 )
 from .product import (
     create_product,
     get_product_by_id,
     get_product_by_name,
+    get_products_page_data,
     get_products_paginated,
+    search_products,
+    stream_products,
+    stream_products_statement,
+    update_product,
     update_product_stock,
 )
-from .user import authenticate, create_user, get_user_by_email
+from .product_bulk import export_products, import_products
+from .reservation import (
+    release_cart_reservations,
+    release_expired_reservations,
+    reserve_cart,
+)
+from .stock_shards import set_stock_shards, take_sharded_stock
+from .user import (
+    authenticate,
+    create_user,
+    get_user_by_email,
+    set_user_admin,
+    update_user_password,
+)
@@ -1,12 +1,78 @@
 import uuid
+from typing import Sequence
 
 from fastapi import HTTPException, status
-from sqlalchemy import func
+from sqlalchemy import Row, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import delete, select
 
 from app.models.dbmodel import Cart, CartItem, Product, User
-from app.schemas.schema import CartItemDisplay, DisplayTotalPrice
+from app.schemas.schema import (
+    CartBatchResult,
+    CartItemDisplay,
+    CartOperation,
+    CartOperationType,
+    CartSummary,
+    DisplayTotalPrice,
+)
+from app.services.crud.cart_lock import (
+    lock_cart,
+    lock_cart_and_products,
+    lock_product_prices,
+)
+from app.services.crud.reservation import release_cart_reservations
+from app.services.crud.stock_shards import PRODUCT_STOCK
+
+# Cart.item_count / subtotal / version are kept in step with the cart lines
+# by applying the change of every write as a delta. every write locks the
+# cart row before it reads or writes a line, so two writes to one cart can't
+# interleave (crud/cart_lock.py has the order the locks go in). subtotal is
+# at current prices, update_product reprices the carts holding a product
+# whose price changes. for that delta to be exact a cart write has to hold
+# the product's price still until it commits, see lock_product_prices
+
+
+def cart_summary_delta(cart_id, *, items, subtotal):
+    # items / subtotal can be plain ints or sql expressions
+    return (
+        update(Cart)
+        .where(Cart.id == cart_id)  # pyright: ignore
+        .values(
+            item_count=Cart.item_count + items,
+            subtotal=Cart.subtotal + subtotal,
+            version=Cart.version + 1,
+        )
+    )
+
+
+async def reprice_cart_summaries(
+    *,
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    old_price: int,
+    new_price: int,
+) -> None:
+    # a cart holds at most one line per product so the change is exactly
+    # (new - old) * that line's quantity
+    stmt = (
+        update(Cart)
+        .where(
+            Cart.id == CartItem.cart_id,  # pyright: ignore
+            CartItem.product_id == product_id,
+        )
+        .values(
+            subtotal=Cart.subtotal + (new_price - old_price) * CartItem.quantity,
+            version=Cart.version + 1,
+        )
+    )
+    await session.execute(stmt)
+
+
+def _line_product(cart_item_id: uuid.UUID):
+    return (
+        select(CartItem.product_id).where(CartItem.id == cart_item_id).scalar_subquery()
+    )
 
 
 async def create_cart(
@@ -32,11 +98,21 @@ async def check_for_cart_or_create(
     if cart_exists:
         return cart_exists
 
-    new_cart = await create_cart(
-        session=session,
-        user=user,
+    # Cart.user_id is unique so two requests racing to make the first cart
+    # can't both win, the loser gets nothing back and reads the winner's cart
+    insert_stmt = (
+        insert(Cart)
+        .values(id=uuid.uuid4(), user_id=user.id)
+        .on_conflict_do_nothing(index_elements=["user_id"])
+        .returning(Cart)
     )
-    return new_cart
+    result = await session.execute(insert_stmt)
+    new_cart = result.scalars().first()
+    if new_cart:
+        return new_cart
+
+    result = await session.execute(statement)
+    return result.scalars().one()
 
 
 async def create_cart_item(
@@ -46,62 +122,85 @@ async def create_cart_item(
     product: Product,
     quantity: int,
 ) -> CartItem:
-    statement = select(CartItem).where(
-        CartItem.cart_id == cart_id,
-        CartItem.product_id == product.id,
+    await session.execute(
+        lock_product_prices(select(Product.id).where(Product.id == product.id))
+    )
+    await lock_cart(session=session, where=Cart.id == cart_id)
+
+    # single upsert on (cart_id, product_id), no read-then-write race that
+    # used to leave two lines for the same product
+    stmt = insert(CartItem).values(
+        id=uuid.uuid4(),
+        cart_id=cart_id,
+        product_id=product.id,
+        quantity=quantity,
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_CartItem_cart_id_product_id",
+        set_={"quantity": CartItem.quantity + stmt.excluded.quantity},
+    ).returning(CartItem)
+
+    result = await session.execute(stmt, execution_options={"populate_existing": True})
+    cart_item = result.scalars().one()
+
+    # priced in sql, the product passed in may have come from the cache
+    price = select(Product.price).where(Product.id == product.id).scalar_subquery()
+    await session.execute(
+        cart_summary_delta(cart_id, items=quantity, subtotal=price * quantity)
     )
-    result = await session.execute(statement)
-    cart_item = result.scalars().first()
-
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(
-            cart_id=cart_id,
-            product_id=product.id,
-            quantity=quantity,
-        )
-        session.add(cart_item)
-
     await session.commit()
-    await session.refresh(cart_item)
 
     return cart_item
 
 
-async def get_cartitems(
+async def get_cartitem_rows(
     *,
     session: AsyncSession,
     user: User,
-):
+) -> Sequence[Row]:
+    # columns named after the CartItemDisplay fields, so the rows can go
+    # straight to a RowSerializer
     stmt = (
         select(
-            CartItem,
+            CartItem.id,
             Product.name,
+            CartItem.quantity,
             Product.price,
+            CartItem.product_id,
         )
         .join(CartItem, Product.id == CartItem.product_id)  # pyright: ignore
         .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
         .where(Cart.user_id == user.id)
     )
+    result = await session.execute(stmt)
+    return result.all()
+
 
+async def get_cartitems(
+    *,
+    session: AsyncSession,
+    user: User,
+) -> list[CartItemDisplay]:
+    rows = await get_cartitem_rows(session=session, user=user)
+    return [CartItemDisplay(**row._mapping) for row in rows]
+
+
+async def get_cart_summary(
+    *,
+    session: AsyncSession,
+    user: User,
+) -> CartSummary:
+    # one row off the unique Cart.user_id index
+    stmt = select(Cart.item_count, Cart.subtotal, Cart.version).where(
+        Cart.user_id == user.id
+    )
     result = await session.execute(stmt)
-    cart_data = result.all()
-
-    # Optional: If you strictly want that 404 when the cart is empty
-    if not cart_data:
-        return []
-    # SQLAlchemy Rows automatically map to your Pydantic 'CartItemDisplay'
-    return [
-        CartItemDisplay(
-            id=r.CartItem.id,
-            quantity=r.CartItem.quantity,
-            name=r.name,
-            price=r.price,
-            product_id=r.CartItem.product_id,
-        )
-        for r in cart_data
-    ]
+    row = result.first()
+    if row is None:
+        return CartSummary(item_count=0, subtotal=0, version=0)
+    return CartSummary(
+        item_count=row.item_count, subtotal=row.subtotal, version=row.version
+    )
 
 
 async def get_total_price(
@@ -109,23 +208,15 @@ async def get_total_price(
     session: AsyncSession,
     user: User,
 ) -> int:
-    stmt = (
-        select(func.sum(Product.price * CartItem.quantity))
-        .join(CartItem, Product.id == CartItem.product_id)  # pyright: ignore
-        .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
-        .where(Cart.user_id == user.id)
-    )
-
-    result = await session.execute(stmt)
-    total = result.scalar() or 0
+    summary = await get_cart_summary(session=session, user=user)
 
-    if total == 0:
+    if summary.item_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Cart is empty",
         )
 
-    return total
+    return summary.subtotal
 
 
 async def clear_cart(
@@ -133,21 +224,25 @@ async def clear_cart(
     session: AsyncSession,
     user: User,
 ):
-    cart_stmt = select(Cart).where(Cart.user_id == user.id)
-    cart_res = await session.execute(cart_stmt)
-    cart = cart_res.scalars().first()
-
-    if cart:
-        delete_stmt = delete(CartItem).where(
-            CartItem.cart_id == cart.id  # pyright: ignore
-        )
-        await session.execute(delete_stmt)
-
-    if cart is None:
+    cart_id = await lock_cart_and_products(session=session, user=user)
+    if cart_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found"
         )
 
+    # nothing left to check out, the cart's holds go back to stock
+    await release_cart_reservations(session=session, user=user)
+
+    delete_stmt = delete(CartItem).where(CartItem.cart_id == cart_id)  # pyright: ignore
+    await session.execute(delete_stmt)
+
+    summary_stmt = (
+        update(Cart)
+        .where(Cart.id == cart_id)  # pyright: ignore
+        .values(item_count=0, subtotal=0, version=Cart.version + 1)
+    )
+    await session.execute(summary_stmt)
+
 
 async def remove_cart_item(
     *,
@@ -155,18 +250,38 @@ async def remove_cart_item(
     user: User,
     cart_item_id: uuid.UUID,
 ):
-    stmt = select(CartItem).where(
-        Cart.user_id == user.id,
-        CartItem.id == cart_item_id,
+    await session.execute(
+        lock_product_prices(
+            select(Product.id).where(Product.id == _line_product(cart_item_id))
+        )
+    )
+    await lock_cart(session=session, where=Cart.user_id == user.id)
+    stmt = (
+        select(CartItem, Product.price)
+        .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
+        .join(Product, CartItem.product_id == Product.id)  # pyright: ignore
+        .where(
+            Cart.user_id == user.id,
+            CartItem.id == cart_item_id,
+        )
+        .with_for_update(of=CartItem)  # pyright: ignore
     )
     result = await session.execute(stmt)
-    cart_item = result.scalar_one_or_none()
-    if cart_item is None:
+    row = result.one_or_none()
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Item not found in cart"
         )
+    cart_item = row.CartItem
 
     await session.delete(cart_item)
+    await session.execute(
+        cart_summary_delta(
+            cart_item.cart_id,
+            items=-cart_item.quantity,
+            subtotal=-row.price * cart_item.quantity,
+        )
+    )
 
 
 async def update_quantity(
@@ -176,27 +291,203 @@ async def update_quantity(
     product_id: uuid.UUID,
     new_quantity: int,
 ):
+    await session.execute(
+        lock_product_prices(select(Product.id).where(Product.id == product_id))
+    )
+    await lock_cart(session=session, where=Cart.user_id == user.id)
     stmt = (
-        select(CartItem)
+        select(CartItem, Product.price)
         .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
+        .join(Product, CartItem.product_id == Product.id)  # pyright: ignore
         .where(
             Cart.user_id == user.id,
             CartItem.product_id == product_id,
         )
+        .with_for_update(of=CartItem)  # pyright: ignore
     )
     result = await session.execute(stmt)
-    cart_item = result.scalar_one_or_none()
-    if cart_item is None:
+    row = result.one_or_none()
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Item not found in cart"
         )
+    cart_item = row.CartItem
+    change = max(new_quantity, 0) - cart_item.quantity
     cart_item.quantity = new_quantity
+    await session.execute(
+        cart_summary_delta(cart_item.cart_id, items=change, subtotal=row.price * change)
+    )
 
     if new_quantity <= 0:
         await session.delete(cart_item)
         await session.commit()
         return None
 
+    # expire_on_commit is off, cart_item already has what was written. a
+    # refresh would fail when a checkout took the line right after the commit
     await session.commit()
-    await session.refresh(cart_item)
     return cart_item
+
+
+async def inc_dec_cart_item_quantity(
+    *,
+    session: AsyncSession,
+    user: User,
+    cart_item_id: uuid.UUID,
+    amount: int,
+) -> CartItem:
+    await session.execute(
+        lock_product_prices(
+            select(Product.id).where(Product.id == _line_product(cart_item_id))
+        )
+    )
+    await lock_cart(session=session, where=Cart.user_id == user.id)
+    stmt = (
+        select(CartItem, Product.price, PRODUCT_STOCK.label("stock"))
+        .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
+        .join(Product, CartItem.product_id == Product.id)  # pyright: ignore
+        .where(
+            Cart.user_id == user.id,
+            CartItem.id == cart_item_id,
+        )
+        .with_for_update(of=CartItem)  # pyright: ignore
+    )
+    result = await session.execute(stmt)
+    row = result.one_or_none()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Item not found in cart"
+        )
+    cart_item = row.CartItem
+
+    # stays between 1 and what's in stock
+    new_quantity = max(cart_item.quantity + amount, 1)
+    new_quantity = min(new_quantity, row.stock)
+    change = new_quantity - cart_item.quantity
+    cart_item.quantity = new_quantity
+    await session.execute(
+        cart_summary_delta(cart_item.cart_id, items=change, subtotal=row.price * change)
+    )
+
+    await session.commit()
+    return cart_item
+
+
+async def apply_cart_operations(
+    *,
+    session: AsyncSession,
+    user: User,
+    operations: list[CartOperation],
+) -> CartBatchResult:
+    # the whole batch is folded down to a final quantity per product first,
+    # then it's one stock query, one bulk upsert, one delete and one summary
+    # update no matter how many operations came in
+    cart = await check_for_cart_or_create(session=session, user=user)
+
+    # per product: absolute quantity from the last set/remove (None means
+    # start from what's in the cart) plus everything added after it
+    plan: dict[uuid.UUID, tuple[int | None, int]] = {}
+    for operation in operations:
+        base, added = plan.get(operation.product_id, (None, 0))
+        if operation.op == CartOperationType.ADD:
+            plan[operation.product_id] = (base, added + operation.quantity)
+        elif operation.op == CartOperationType.SET:
+            plan[operation.product_id] = (operation.quantity, 0)
+        else:
+            plan[operation.product_id] = (0, 0)
+    product_ids = list(plan)
+
+    products_stmt = lock_product_prices(
+        select(
+            Product.id, Product.name, Product.price, PRODUCT_STOCK.label("stock")
+        ).where(
+            Product.id.in_(product_ids)  # pyright: ignore
+        )
+    )
+    result = await session.execute(products_stmt)
+    products = {row.id: row for row in result.all()}
+
+    # with the cart row locked no other write can add, change or drop a
+    # line before the upsert below, so the deltas from this read stay exact
+    await lock_cart(session=session, where=Cart.id == cart.id)
+    lines_stmt = (
+        select(CartItem.product_id, CartItem.quantity)
+        .where(
+            CartItem.cart_id == cart.id,
+            CartItem.product_id.in_(product_ids),  # pyright: ignore
+        )
+        .with_for_update()
+    )
+    result = await session.execute(lines_stmt)
+    current = {row.product_id: row.quantity for row in result.all()}
+
+    missing = [
+        str(product_id) for product_id in product_ids if product_id not in products
+    ]
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"error": "product_not_found", "product_ids": missing},
+        )
+
+    upserts = []
+    removed = []
+    item_change = 0
+    subtotal_change = 0
+    for product_id, (base, added) in plan.items():
+        product = products[product_id]
+        before = current.get(product_id, 0)
+        after = max((before if base is None else base) + added, 0)
+
+        # only growing a line is checked, so a line that's already over the
+        # stock can still be brought down
+        if after > before and after > product.stock:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "error": "insufficient_stock",
+                    "message": f"Not enough stock for {product.name}",
+                    "available_stock": product.stock,
+                    "product_id": str(product_id),
+                },
+            )
+
+        if after == before:
+            continue
+        if after == 0:
+            removed.append(product_id)
+        else:
+            upserts.append(
+                {
+                    "id": uuid.uuid4(),
+                    "cart_id": cart.id,
+                    "product_id": product_id,
+                    "quantity": after,
+                }
+            )
+        item_change += after - before
+        subtotal_change += (after - before) * product.price
+
+    if upserts:
+        upsert_stmt = insert(CartItem).values(upserts)
+        upsert_stmt = upsert_stmt.on_conflict_do_update(
+            constraint="uq_CartItem_cart_id_product_id",
+            set_={"quantity": upsert_stmt.excluded.quantity},
+        )
+        await session.execute(upsert_stmt)
+    if removed:
+        delete_stmt = delete(CartItem).where(
+            CartItem.cart_id == cart.id,  # pyright: ignore
+            CartItem.product_id.in_(removed),  # pyright: ignore
+        )
+        await session.execute(delete_stmt)
+    if upserts or removed:
+        await session.execute(
+            cart_summary_delta(cart.id, items=item_change, subtotal=subtotal_change)
+        )
+    await session.commit()
+
+    return CartBatchResult(
+        items=await get_cartitems(session=session, user=user),
+        summary=await get_cart_summary(session=session, user=user),
+    )
@@ -0,0 +1,77 @@
+import uuid
+
+from sqlalchemy import union
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.models.dbmodel import Cart, CartItem, Product, StockReservation, User
+
+# every write to a cart takes its locks in the same order so two of them
+# can't deadlock:
+#
+#   1. the products it prices or moves stock of, FOR KEY SHARE
+#      (lock_product_prices). a price change holds its product FOR UPDATE
+#      and then reprices the carts, so it has to come before the cart
+#   2. the Cart row, FOR NO KEY UPDATE (lock_cart). this is what serializes
+#      the writes to one cart
+#   3. the cart's lines and stock holds, and only then the UPDATE of the
+#      cart's running totals
+#
+# stock decrements and increments (FOR NO KEY UPDATE on Product) don't
+# conflict with the KEY SHARE of step 1, so checkouts of one product still
+# don't queue behind each other's carts
+
+
+def lock_product_prices(statement):
+    # FOR KEY SHARE on the products a cart write prices its lines at. a price
+    # change (update_product, the bulk import) holds its products FOR UPDATE
+    # until the carts are repriced, so the write either commits first and
+    # gets repriced or waits and reads the new price. stock updates only take
+    # FOR NO KEY UPDATE, checkouts of the product don't block on it
+    return statement.with_for_update(read=True, key_share=True)
+
+
+async def lock_cart(*, session: AsyncSession, where) -> uuid.UUID | None:
+    # NO KEY UPDATE, a line's foreign key still only needs KEY SHARE on it.
+    # where picks the cart, by Cart.id or Cart.user_id
+    result = await session.execute(
+        select(Cart.id).where(where).with_for_update(key_share=True)
+    )
+    return result.scalar_one_or_none()
+
+
+async def lock_cart_and_products(
+    *,
+    session: AsyncSession,
+    user: User,
+) -> uuid.UUID | None:
+    # steps 1 and 2 for the writes that only learn the products from the
+    # cart itself (checkout, reserving, clearing): every product with a line
+    # or a hold in the cart, then the cart. when a line for another product
+    # went in between the two it starts over from a savepoint, locking that
+    # product while holding the cart could deadlock with a price change
+    cart_ids = select(Cart.id).where(Cart.user_id == user.id)
+    cart_products = union(
+        select(CartItem.product_id).where(
+            CartItem.cart_id.in_(cart_ids)  # pyright: ignore
+        ),
+        select(StockReservation.product_id).where(
+            StockReservation.cart_id.in_(cart_ids)  # pyright: ignore
+        ),
+    ).subquery()
+    products_stmt = lock_product_prices(
+        select(Product.id).where(
+            Product.id.in_(select(cart_products.c.product_id))  # pyright: ignore
+        )
+    )
+
+    while True:
+        savepoint = await session.begin_nested()
+        result = await session.execute(products_stmt)
+        locked = set(result.scalars().all())
+        cart_id = await lock_cart(session=session, where=Cart.user_id == user.id)
+        result = await session.execute(select(cart_products.c.product_id))
+        if set(result.scalars().all()) <= locked:
+            await savepoint.commit()
+            return cart_id
+        await savepoint.rollback()
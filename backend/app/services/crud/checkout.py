@@ -0,0 +1,264 @@
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import HTTPException, status
+from sqlalchemy import (
+    Integer,
+    Uuid,
+    case,
+    column,
+    func,
+    insert,
+    or_,
+    select,
+    true,
+    update,
+    values,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete
+
+from app.models.dbmodel import (
+    Cart,
+    CartItem,
+    Order,
+    OrderItem,
+    Product,
+    StockReservation,
+    User,
+)
+from app.schemas.schema import CreateOrderRequest, OrderStatus
+from app.services.catalog_cache import catalog_cache
+from app.services.crud.cart import cart_summary_delta
+from app.services.crud.cart_lock import lock_cart_and_products
+from app.services.crud.stock_shards import PRODUCT_STOCK, take_stock_for_striped
+
+# checkout in two round trips instead of a select/lock/loop/add per cart line
+# (plus locking the cart and its products first, see crud/cart_lock.py):
+#
+#   1. one statement claims the cart's stock holds (crud/reservation.py),
+#      decrements stock for whatever the cart holds beyond them (UPDATE
+#      Product ... FROM the difference WHERE stock >= needed RETURNING) and
+#      reports back every line, reserved or not. a line fully covered by its
+#      hold doesn't touch Product at all. products with striped stock are
+#      left out of the UPDATE and taken off their shards right after
+#      (crud/stock_shards.py)
+#   2. one statement inserts the Order, bulk inserts the reserved lines into
+#      OrderItem with INSERT ... SELECT, removes them from the cart and takes
+#      them off the cart's running totals
+#
+# the product rows are only locked from statement 1 until the commit, and if
+# any line is short we raise so the caller's transaction rolls the partial
+# decrement back
+
+
+async def _reserve_cart_stock(
+    *,
+    session: AsyncSession,
+    user: User,
+):
+    # the locks every cart write takes, in the same order. a reserve can't
+    # add holds this checkout's DELETE doesn't see, and a cart edit can't
+    # hold a line the checkout is about to delete. they have to be their own
+    # statements, the one below works off a snapshot taken before any lock
+    # it waits on
+    await lock_cart_and_products(session=session, user=user)
+
+    cart_lines = (
+        select(
+            CartItem.cart_id,
+            CartItem.product_id,
+            CartItem.quantity,
+        )
+        .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
+        .where(Cart.user_id == user.id)
+        .cte("cart_lines")
+    )
+
+    # the holds are deleted here, if the checkout fails the rollback puts
+    # them back
+    held = (
+        delete(StockReservation)
+        .where(
+            StockReservation.cart_id.in_(  # pyright: ignore
+                select(Cart.id).where(Cart.user_id == user.id)
+            )
+        )
+        .returning(StockReservation.product_id, StockReservation.quantity)
+        .cte("held")
+    )
+
+    # what still has to come out of stock per product, negative when the
+    # cart shrank since the holds were taken (or a held product left it)
+    needed = (
+        select(
+            func.coalesce(cart_lines.c.product_id, held.c.product_id).label(
+                "product_id"
+            ),
+            (
+                func.coalesce(cart_lines.c.quantity, 0)
+                - func.coalesce(held.c.quantity, 0)
+            ).label("quantity"),
+        )
+        .select_from(
+            cart_lines.join(
+                held, held.c.product_id == cart_lines.c.product_id, full=True
+            )
+        )
+        .cte("needed")
+    )
+
+    reserved = (
+        update(Product)
+        .where(
+            Product.id == needed.c.product_id,  # pyright: ignore
+            needed.c.quantity != 0,
+            Product.stock >= needed.c.quantity,  # pyright: ignore
+            # giving back always goes to Product.stock
+            or_(Product.stock_shards == 0, needed.c.quantity < 0),
+        )
+        .values(stock=Product.stock - needed.c.quantity)
+        .returning(Product.id.label("product_id"), Product.price)  # pyright: ignore
+        .cte("reserved")
+    )
+
+    # every statement in a WITH sees the same snapshot, so Product here is
+    # still the stock from before the decrement which is what we report
+    stmt = (
+        select(
+            cart_lines.c.cart_id,
+            cart_lines.c.product_id,
+            cart_lines.c.quantity,
+            Product.name,
+            # what this cart could have had, its own holds included
+            (PRODUCT_STOCK + cart_lines.c.quantity - needed.c.quantity).label("stock"),
+            # null only when the line needed stock and didn't get it
+            func.coalesce(
+                reserved.c.price,
+                case((needed.c.quantity == 0, Product.price)),
+            ).label("price"),
+            needed.c.quantity.label("needed"),
+            Product.price.label("current_price"),
+        )
+        .join(Product, Product.id == cart_lines.c.product_id)  # pyright: ignore
+        .join(needed, needed.c.product_id == cart_lines.c.product_id)
+        .outerjoin(reserved, reserved.c.product_id == cart_lines.c.product_id)
+    )
+
+    result = await session.execute(stmt)
+    return result.all()
+
+
+async def checkout_cart(
+    *,
+    payload: CreateOrderRequest,
+    session: AsyncSession,
+    user: User,
+) -> uuid.UUID:
+    lines = await _reserve_cart_stock(session=session, user=user)
+
+    if not lines:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cart is empty",
+        )
+
+    # price is only null when the update skipped the row, for lack of stock
+    # or because the product's stock is striped
+    left_out = {line.product_id: line.needed for line in lines if line.price is None}
+    if left_out:
+        short = await take_stock_for_striped(session=session, needed=left_out)
+        for line in lines:
+            if line.product_id == short:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail={
+                        "error": "insufficient_stock",
+                        "message": f"Not enough stock for {line.name}",
+                        "available_stock": line.stock,
+                        "product_id": str(line.product_id),
+                    },
+                )
+    prices = {
+        line.product_id: line.current_price if line.price is None else line.price
+        for line in lines
+    }
+
+    cart_id = lines[0].cart_id
+    order_id = uuid.uuid4()
+    total_price = sum(prices[line.product_id] * line.quantity for line in lines)
+
+    new_order = (
+        insert(Order)
+        .values(
+            id=order_id,
+            user_id=user.id,
+            total_price=total_price,
+            status=OrderStatus.PENDING.value,
+            ordered_at=datetime.now(timezone.utc).replace(tzinfo=None),
+            latitude=payload.latitude,
+            longitude=payload.longitude,
+            address=payload.address,
+            phone_number=payload.phone_number,
+        )
+        .returning(Order.id)
+        .cte("new_order")
+    )
+
+    # the items are built from what step 1 actually reserved rather than
+    # re-reading the cart, so a concurrent cart edit can't sneak in unpaid lines
+    reserved_lines = values(
+        column("product_id", Uuid),
+        column("quantity", Integer),
+        column("price", Integer),
+        name="reserved_lines",
+    ).data(
+        [(line.product_id, line.quantity, prices[line.product_id]) for line in lines]
+    )
+
+    new_items = (
+        insert(OrderItem)
+        .from_select(
+            ["id", "order_id", "product_id", "quantity", "price_at_purchase"],
+            select(
+                func.gen_random_uuid(),
+                new_order.c.id,
+                reserved_lines.c.product_id,
+                reserved_lines.c.quantity,
+                reserved_lines.c.price,
+            ).select_from(new_order.join(reserved_lines, true())),
+        )
+        .returning(OrderItem.id)
+        .cte("new_items")
+    )
+
+    # reserved prices are the current ones, the same the cart totals hold
+    cart_summary = (
+        cart_summary_delta(
+            cart_id,
+            items=-sum(line.quantity for line in lines),
+            subtotal=-total_price,
+        )
+        .returning(Cart.id)
+        .cte("cart_summary")
+    )
+
+    clear_stmt = (
+        delete(CartItem)
+        .where(
+            CartItem.cart_id == cart_id,  # pyright: ignore
+            CartItem.product_id.in_(
+                [line.product_id for line in lines]
+            ),  # pyright: ignore
+        )
+        .add_cte(new_order, new_items, cart_summary)
+    )
+    await session.execute(clear_stmt)
+
+    # stock moved, cached products and pages go stale once the caller commits
+    catalog_cache.invalidate_after_commit(
+        session,
+        product_ids=[line.product_id for line in lines],
+        names=[line.name for line in lines],
+    )
+    return order_id
@@ -1,136 +1,258 @@
 import uuid
+from datetime import datetime
+from typing import AsyncIterator, Sequence
 
 from fastapi import HTTPException, status
+from sqlalchemy import Row, func, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import delete, select
 
-from app.models.dbmodel import Cart, CartItem, Order, OrderItem, Product, User
+from app.models.dbmodel import Order, OrderItem, Product, User
 from app.schemas.schema import (
-    CreateOrderRequest,
-    OrderDisplay,
-    OrderItemDisplay,
+    OrderHistoryItem,
+    OrderHistoryPage,
     OrderStatus,
+    OrderWithItems,
 )
-from app.services import crud
+from app.services.catalog_cache import catalog_cache
+from app.utils.pagination import decode_cursor, encode_cursor
 
+ORDER_HISTORY_SORT = "ordered_at"
 
-async def create_order(
+
+async def get_users_orders(
     *,
-    payload: CreateOrderRequest,
     session: AsyncSession,
     user: User,
-) -> Order:
-    total_price = await crud.get_total_price(session=session, user=user)
-    order = Order(
-        user_id=user.id,
-        total_price=total_price,
-        status=OrderStatus.PENDING,
-        latitude=payload.latitude,
-        longitude=payload.longitude,
-        address=payload.address,
-        phone_number=payload.phone_number,
+) -> Sequence[Row]:
+    # rows shaped like OrderDisplay, the route encodes them without building
+    # a model per order
+    stmt = select(
+        Order.id,
+        Order.total_price,
+        Order.address,
+        Order.status,
+        Order.ordered_at,
+    ).where(Order.user_id == user.id)
+    result = await session.execute(stmt)
+    return result.all()
+
+
+async def get_users_order_items(
+    *,
+    session: AsyncSession,
+    user: User,
+) -> Sequence[Row]:
+    # rows shaped like OrderItemDisplay
+    stmt = (
+        select(
+            OrderItem.id,
+            OrderItem.order_id,
+            Product.name,
+            OrderItem.quantity,
+            Order.status,
+            Order.ordered_at.label("date"),  # pyright: ignore
+            OrderItem.price_at_purchase,
+        )
+        .join(OrderItem, Product.id == OrderItem.product_id)  # pyright: ignore
+        .join(Order, OrderItem.order_id == Order.id)  # pyright: ignore
+        .where(Order.user_id == user.id)
     )
-    if order.ordered_at and order.ordered_at.tzinfo:
-        order.ordered_at = order.ordered_at.replace(tzinfo=None)
-    session.add(order)
+    result = await session.execute(stmt)
+    return result.all()
 
-    return order
 
+async def stream_users_orders(
+    *,
+    session: AsyncSession,
+    user: User,
+    batch_size: int,
+) -> AsyncIterator[Sequence[Row]]:
+    # newest first off ix_Order_user_id_ordered_at_id, plain columns rather
+    # than Order objects so nothing piles up in the identity map
+    stmt = (
+        select(
+            Order.id,
+            Order.total_price,
+            Order.address,
+            Order.status,
+            Order.ordered_at,
+        )
+        .where(Order.user_id == user.id)
+        .order_by(Order.ordered_at.desc(), Order.id.desc())  # pyright: ignore
+        .execution_options(yield_per=batch_size)
+    )
+    result = await session.stream(stmt)
+    async for rows in result.partitions():
+        yield rows
 
-async def create_order_items(
+
+async def stream_users_order_items(
     *,
     session: AsyncSession,
     user: User,
-    order_id: uuid.UUID,
-) -> None:
+    batch_size: int,
+) -> AsyncIterator[Sequence[Row]]:
     stmt = (
-        select(Product, CartItem.quantity)
-        .join(CartItem, Product.id == CartItem.product_id)  # pyright: ignore
-        .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
-        .where(Cart.user_id == user.id)
-        .with_for_update()  # eliminated race conditions by locking the row
+        select(
+            OrderItem.id,
+            OrderItem.order_id,
+            Product.name,
+            OrderItem.quantity,
+            Order.status,
+            Order.ordered_at.label("date"),  # pyright: ignore
+            OrderItem.price_at_purchase,
+        )
+        .join(OrderItem, Product.id == OrderItem.product_id)  # pyright: ignore
+        .join(Order, OrderItem.order_id == Order.id)  # pyright: ignore
+        .where(Order.user_id == user.id)
+        .order_by(
+            Order.ordered_at.desc(),  # pyright: ignore
+            Order.id.desc(),  # pyright: ignore
+            OrderItem.id,
+        )
+        .execution_options(yield_per=batch_size)
     )
+    result = await session.stream(stmt)
+    async for rows in result.partitions():
+        yield rows
 
-    result = await session.execute(stmt)
-    # result.all() will return tuples of (Product, quantity)
-    items = result.all()
 
-    for product, quantity in items:
-        if product.stock < quantity:
+async def get_order_history(
+    *,
+    session: AsyncSession,
+    user: User,
+    limit: int,
+    cursor: str | None = None,
+) -> OrderHistoryPage:
+    # one page of orders off ix_Order_user_id_ordered_at_id, then the items
+    # of just those orders in one more query, two round trips whatever the
+    # page size or however long the history
+    stmt = select(Order).where(Order.user_id == user.id)
+    if cursor is not None:
+        key, row_id, _ = decode_cursor(cursor, sort=ORDER_HISTORY_SORT, key_type=str)
+        try:
+            ordered_at = datetime.fromisoformat(key)
+        except ValueError:
+            ordered_at = None
+        # ordered_at is naive utc, an aware key would only fail in postgres
+        if ordered_at is None or ordered_at.tzinfo is not None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail={
-                    "error": "insufficient_stock",
-                    "message": f"Not enough stock for {product.name}",
-                    "available_stock": product.stock,
-                    "product_id": str(product.id),
-                },
+                detail="Invalid cursor",
             )
+        stmt = stmt.where(
+            tuple_(Order.ordered_at, Order.id) < tuple_(ordered_at, row_id)
+        )
+    stmt = stmt.order_by(
+        Order.ordered_at.desc(), Order.id.desc()  # pyright: ignore
+    ).limit(limit + 1)
 
-        order_item = OrderItem(
-            order_id=order_id,
-            product_id=product.id,
-            quantity=quantity,
-            price_at_purchase=product.price,
+    result = await session.execute(stmt)
+    orders = list(result.scalars().all())
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+
+    items_by_order: dict[uuid.UUID, list[OrderHistoryItem]] = {
+        order.id: [] for order in orders
+    }
+    if orders:
+        items_stmt = (
+            select(OrderItem, Product.name)
+            .join(Product, Product.id == OrderItem.product_id)  # pyright: ignore
+            .where(OrderItem.order_id.in_(list(items_by_order)))  # pyright: ignore
+            .order_by(OrderItem.order_id, Product.name)
         )
+        result = await session.execute(items_stmt)
+        for r in result.all():
+            items_by_order[r.OrderItem.order_id].append(
+                OrderHistoryItem(
+                    id=r.OrderItem.id,
+                    product_id=r.OrderItem.product_id,
+                    name=r.name,
+                    quantity=r.OrderItem.quantity,
+                    price_at_purchase=r.OrderItem.price_at_purchase,
+                )
+            )
 
-        product.stock -= quantity
+    next_cursor = None
+    if has_more:
+        last = orders[-1]
+        next_cursor = encode_cursor(
+            sort=ORDER_HISTORY_SORT,
+            key=last.ordered_at.isoformat(),
+            row_id=last.id,
+            forward=True,
+        )
 
-        session.add(order_item)
-        session.add(product)
+    return OrderHistoryPage(
+        items=[
+            OrderWithItems(
+                id=order.id,
+                total_price=order.total_price,
+                address=order.address,
+                status=order.status,
+                ordered_at=order.ordered_at,
+                items=items_by_order[order.id],
+            )
+            for order in orders
+        ],
+        next_cursor=next_cursor,
+    )
 
 
-async def get_users_orders(
+async def get_payable_order(
     *,
     session: AsyncSession,
+    order_id: uuid.UUID,
     user: User,
-):
-    stmt = select(Order).where(Order.user_id == user.id)
+) -> Order:
+    # a payment can only be started for your own order that's still pending,
+    # what gets charged is its total and not anything the client sends
+    stmt = select(Order).where(
+        Order.id == order_id,
+        Order.user_id == user.id,
+    )
     result = await session.execute(stmt)
-    orders = result.all()
-
-    if not orders:
-        return []
-
-    return [
-        OrderDisplay(
-            id=r.Order.id,
-            total_price=r.Order.total_price,
-            address=r.Order.address,
-            status=r.Order.status,
-            ordered_at=r.Order.ordered_at,
+    order = result.scalar_one_or_none()
+    if order is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found",
+        )
+    if order.status != OrderStatus.PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Order cannot be paid, current status is '{order.status}'",
         )
-        for r in orders
-    ]
+    return order
 
 
-async def get_users_order_items(
+async def set_order_payment_pidx(
     *,
     session: AsyncSession,
+    order_id: uuid.UUID,
     user: User,
-):
+    pidx: str,
+) -> None:
+    # remembered so the payment reconciler can match khalti's answer back
+    # to the order, a retried initiate just replaces it
     stmt = (
-        select(Product.name, OrderItem, Order)
-        .join(OrderItem, Product.id == OrderItem.product_id)  # pyright: ignore
-        .join(Order, OrderItem.order_id == Order.id)  # pyright: ignore
-        .where(Order.user_id == user.id)
+        update(Order)
+        .where(
+            Order.id == order_id,  # pyright: ignore
+            Order.user_id == user.id,  # pyright: ignore
+        )
+        .values(payment_pidx=pidx)
+        .returning(Order.id)
     )
     result = await session.execute(stmt)
-    order_item = result.all()
-    if not order_item:
-        return []
-    return [
-        OrderItemDisplay(
-            id=r.OrderItem.id,
-            order_id=r.OrderItem.order_id,
-            name=r.name,
-            quantity=r.OrderItem.quantity,
-            status=r.Order.status,
-            date=r.Order.ordered_at,
-            price_at_purchase=r.OrderItem.price_at_purchase,
-        )
-        for r in order_item
-    ]
+    if result.first() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found",
+        )
+    await session.commit()
 
 
 async def delete_order_item(
@@ -156,6 +278,9 @@ async def delete_order_item(
         OrderItem.id == order_item_id  # pyright: ignore
     )
     await session.execute(delete_stmt)
+    catalog_cache.invalidate_after_commit(
+        session, product_ids=[product.id], names=[product.name]
+    )
 
     return product
 
@@ -188,37 +313,64 @@ async def delete_order(
         user=user,
     )
 
-    delete_stmt = delete(Order).where(
-        Order.id == order_id  # pyright: ignore
-    )
+    delete_stmt = delete(Order).where(Order.id == order_id)  # pyright: ignore
     await session.execute(delete_stmt)
 
 
+async def restore_order_items_stock(
+    *,
+    order_id: uuid.UUID,
+    session: AsyncSession,
+) -> int:
+    # deletes every item of the order and hands the stock back in a single
+    # statement: the DELETE ... RETURNING feeds a per product sum that the
+    # UPDATE joins against, so big orders don't cost a query per line
+    deleted_items = (
+        delete(OrderItem)
+        .where(OrderItem.order_id == order_id)  # pyright: ignore
+        .returning(OrderItem.product_id, OrderItem.quantity)  # pyright: ignore
+        .cte("deleted_items")
+    )
+    returned = (
+        select(
+            deleted_items.c.product_id,
+            func.sum(deleted_items.c.quantity).label("quantity"),
+        )
+        .group_by(deleted_items.c.product_id)
+        .subquery("returned")
+    )
+    stmt = (
+        update(Product)
+        .where(Product.id == returned.c.product_id)  # pyright: ignore
+        .values(stock=Product.stock + returned.c.quantity)
+        .returning(Product.id, Product.name)  # pyright: ignore
+        .execution_options(synchronize_session=False)
+    )
+
+    result = await session.execute(stmt)
+    restocked = result.all()
+    catalog_cache.invalidate_after_commit(
+        session,
+        product_ids=[row.id for row in restocked],
+        names=[row.name for row in restocked],
+    )
+    # number of distinct products that got stock back
+    return len(restocked)
+
+
 async def delete_all_order_items_of_order(
     *,
     order_id: uuid.UUID,
     session: AsyncSession,
     user: User,
 ):
-    stmt = select(OrderItem).where(OrderItem.order_id == order_id)
-    result = await session.execute(stmt)
-    order_items = result.scalars().all()
+    restocked = await restore_order_items_stock(
+        order_id=order_id,
+        session=session,
+    )
 
-    if not order_items:
+    if not restocked:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order Item not found in order",
         )
-
-    for order_item in order_items:
-        stmt = select(Product).where(Product.id == order_item.product_id)
-        result = await session.execute(stmt)
-        product = result.scalar_one()
-        product.stock += order_item.quantity
-
-        session.add(product)
-
-        delete_stmt = delete(OrderItem).where(
-            OrderItem.id == order_item.id  # pyright: ignore
-        )
-        await session.execute(delete_stmt)
@@ -1,11 +1,66 @@
 import uuid
+from typing import AsyncIterator, Sequence
 
 from fastapi import HTTPException, status
+from sqlalchemy import (
+    JSON,
+    Row,
+    Select,
+    func,
+    literal_column,
+    or_,
+    true,
+    tuple_,
+    type_coerce,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR, aggregate_order_by
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 
 from app.models.dbmodel import Product
-from app.schemas.schema import ProductCreate
+from app.schemas.schema import (
+    ProductCreate,
+    ProductDisplay,
+    ProductPage,
+    ProductSearchResult,
+    ProductSort,
+    ProductUpdate,
+)
+from app.services.catalog_cache import catalog_cache
+from app.services.crud.cart import reprice_cart_summaries
+from app.services.crud.stock_shards import PRODUCT_STOCK, reset_stock_shards
+from app.utils.http_cache import make_etag
+from app.utils.pagination import decode_cursor, encode_cursor
+from app.utils.serialization import RowSerializer
+
+# has to line up with the composite indexes on Product
+PRODUCT_SORT_COLUMNS = {
+    ProductSort.NAME: Product.name,
+    ProductSort.PRICE: Product.price,
+    ProductSort.CATEGORY: func.coalesce(Product.category, literal_column("''")),
+}
+# what a cursor's key has to be for each sort
+PRODUCT_SORT_KEY_TYPES = {
+    ProductSort.NAME: str,
+    ProductSort.PRICE: int,
+    ProductSort.CATEGORY: str,
+}
+
+# ProductDisplay's fields, for the list endpoints that skip loading Product
+PRODUCT_DISPLAY_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.price,
+    Product.description,
+    PRODUCT_STOCK.label("stock"),
+    Product.category,
+    Product.image_url,
+)
+PRODUCT_ROWS = RowSerializer(ProductDisplay)
+
+# generated + GIN indexed by migration, not part of the model so normal
+# product queries don't drag the tsvector along
+PRODUCT_SEARCH_VECTOR = literal_column('"Product".search_vector', type_=TSVECTOR)
 
 
 async def create_product(
@@ -20,6 +75,7 @@ async def create_product(
     session.add(db_obj)
     await session.commit()
     await session.refresh(db_obj)
+    await catalog_cache.invalidate()
     return db_obj
 
 
@@ -28,22 +84,137 @@ async def get_product_by_name(
     session: AsyncSession,
     name: str,
 ) -> Product | None:
-    statement = select(Product).where(Product.name == name)
+    cached = await catalog_cache.get_product(name=name)
+    if cached is not None:
+        return cached
+
+    # built like a cache hit, detached and with the product's whole stock
+    statement = select(*PRODUCT_DISPLAY_COLUMNS).where(Product.name == name)
     result = await session.execute(statement)
-    product = result.scalars().first()
+    row = result.first()
+    if row is None:
+        return None
+    product = Product(**row._mapping)
+    await catalog_cache.set_product(product)
     return product
 
 
+def _product_sort_key(product: Product | Row, sort: ProductSort):
+    if sort == ProductSort.CATEGORY:
+        return product.category or ""
+    return getattr(product, sort.value)
+
+
 async def get_products_paginated(
     *,
     session: AsyncSession,
     limit: int,
-    offset: int,
-):
-    statement = select(Product).offset(offset).limit(limit)
+    sort: ProductSort = ProductSort.NAME,
+    cursor: str | None = None,
+) -> ProductPage:
+    data, _ = await get_products_page_data(
+        session=session, limit=limit, sort=sort, cursor=cursor
+    )
+    return ProductPage.model_validate(data)
+
+
+async def get_products_page_data(
+    *,
+    session: AsyncSession,
+    limit: int,
+    sort: ProductSort = ProductSort.NAME,
+    cursor: str | None = None,
+) -> tuple[dict, str]:
+    # the page as json ready data plus its etag. the etag is hashed once when
+    # the page is built and cached next to it, so a conditional request that
+    # hits the cache never serializes or hashes anything
+    version = await catalog_cache.version()
+    cached = await catalog_cache.get_page(
+        version=version, sort=sort.value, limit=limit, cursor=cursor
+    )
+    if cached is not None:
+        return cached["page"], cached["etag"]
+
+    data = await _query_products_page(
+        session=session, limit=limit, sort=sort, cursor=cursor
+    )
+    etag = make_etag(data)
+    await catalog_cache.set_page(
+        version=version,
+        sort=sort.value,
+        limit=limit,
+        cursor=cursor,
+        page={"page": data, "etag": etag},
+    )
+    return data, etag
+
+
+async def _query_products_page(
+    *,
+    session: AsyncSession,
+    limit: int,
+    sort: ProductSort,
+    cursor: str | None,
+) -> dict:
+    # shaped like ProductPage but built off plain rows, no model per product
+    sort_col = PRODUCT_SORT_COLUMNS[sort]
+    statement = select(*PRODUCT_DISPLAY_COLUMNS)
+
+    forward = True
+    if cursor:
+        key, last_id, forward = decode_cursor(
+            cursor, sort=sort.value, key_type=PRODUCT_SORT_KEY_TYPES[sort]
+        )
+        # row value comparison so postgres can seek straight into the index
+        if forward:
+            statement = statement.where(
+                tuple_(sort_col, Product.id) > tuple_(key, last_id)
+            )
+        else:
+            statement = statement.where(
+                tuple_(sort_col, Product.id) < tuple_(key, last_id)
+            )
+
+    if forward:
+        statement = statement.order_by(sort_col, Product.id)
+    else:
+        # walk the index backwards then flip the rows so pages always read in order
+        statement = statement.order_by(
+            sort_col.desc(),
+            Product.id.desc(),  # pyright: ignore
+        )
+
+    # one extra row tells us if theres another page without a count(*)
+    statement = statement.limit(limit + 1)
     result = await session.execute(statement)
-    result_scaled = result.scalars().all()
-    return result_scaled
+    products = list(result.all())
+
+    has_more = len(products) > limit
+    products = products[:limit]
+    if not forward:
+        products.reverse()
+
+    if not products:
+        return {"items": [], "next_cursor": None, "prev_cursor": None}
+
+    def make_cursor(product: Row, *, forward: bool) -> str:
+        return encode_cursor(
+            sort=sort.value,
+            key=_product_sort_key(product, sort),
+            row_id=product.id,
+            forward=forward,
+        )
+
+    # going forward there is a previous page only if we came from a cursor,
+    # going backward there is always a next page (the one we came from)
+    has_next = has_more if forward else True
+    has_prev = bool(cursor) if forward else has_more
+
+    return {
+        "items": PRODUCT_ROWS.jsonable(products),
+        "next_cursor": make_cursor(products[-1], forward=True) if has_next else None,
+        "prev_cursor": make_cursor(products[0], forward=False) if has_prev else None,
+    }
 
 
 async def get_product_by_id(
@@ -51,16 +222,22 @@ async def get_product_by_id(
     session: AsyncSession,
     product_id: uuid.UUID,
 ) -> Product:
-    statement = select(Product).where(Product.id == product_id)
+    cached = await catalog_cache.get_product(product_id=product_id)
+    if cached is not None:
+        return cached
+
+    statement = select(*PRODUCT_DISPLAY_COLUMNS).where(Product.id == product_id)
     result = await session.execute(statement)
-    product = result.scalars().first()
+    row = result.first()
 
-    if not product:
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found",
         )
 
+    product = Product(**row._mapping)
+    await catalog_cache.set_product(product)
     return product
 
 
@@ -81,8 +258,204 @@ async def update_product_stock(
         )
 
     product.stock = stock
+    if product.stock_shards:
+        await reset_stock_shards(session=session, product_ids=[product.id])
 
     session.add(product)
     await session.commit()
     await session.refresh(product)
+    await catalog_cache.invalidate(product_ids=[product.id], names=[product.name])
     return product
+
+
+async def update_product(
+    *,
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    product_update: ProductUpdate,
+) -> Product:
+    # locked so two price changes can't both reprice carts off the same old price
+    db_product = await session.get(Product, product_id, with_for_update=True)
+    if not db_product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found",
+        )
+    old_name = db_product.name
+    old_price = db_product.price
+
+    # only the fields the client actually sent
+    update_dict = product_update.model_dump(exclude_unset=True)
+    db_product.sqlmodel_update(update_dict)
+    if "stock" in update_dict and db_product.stock_shards:
+        await reset_stock_shards(session=session, product_ids=[db_product.id])
+
+    session.add(db_product)
+    if db_product.price != old_price:
+        await reprice_cart_summaries(
+            session=session,
+            product_id=db_product.id,
+            old_price=old_price,
+            new_price=db_product.price,
+        )
+    await session.commit()
+    await session.refresh(db_product)
+    if db_product.stock_shards:
+        # shown with its whole stock, detached so that never gets written
+        session.expunge(db_product)
+        db_product.stock = await session.scalar(
+            select(PRODUCT_STOCK).where(Product.id == db_product.id)
+        )
+    # a rename leaves the old name key behind, drop both
+    await catalog_cache.invalidate(
+        product_ids=[db_product.id], names={old_name, db_product.name}
+    )
+    return db_product
+
+
+def stream_products_statement(
+    *,
+    sort: ProductSort = ProductSort.NAME,
+    cursor: str | None = None,
+    batch_size: int,
+) -> Select:
+    # the rest of the catalog in page order, starting after cursor. always
+    # walks forward, a prev_cursor just marks where to pick up from. built
+    # before the response starts, once it streams a bad cursor can't be a 400
+    sort_col = PRODUCT_SORT_COLUMNS[sort]
+    statement = select(*PRODUCT_DISPLAY_COLUMNS)
+    if cursor:
+        key, last_id, _ = decode_cursor(
+            cursor, sort=sort.value, key_type=PRODUCT_SORT_KEY_TYPES[sort]
+        )
+        statement = statement.where(tuple_(sort_col, Product.id) > tuple_(key, last_id))
+    return statement.order_by(sort_col, Product.id).execution_options(
+        yield_per=batch_size
+    )
+
+
+async def stream_products(
+    *,
+    session: AsyncSession,
+    statement: Select,
+) -> AsyncIterator[Sequence[Row]]:
+    # rows named like ProductDisplay, for PRODUCT_ROWS like the buffered page
+    result = await session.stream(statement)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def search_products(
+    *,
+    session: AsyncSession,
+    q: str,
+    category: str | None = None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    limit: int,
+    offset: int,
+) -> ProductSearchResult:
+    # one statement: the matches are found once in a CTE using the GIN
+    # indexes (full text on name+description OR trigram similarity on name),
+    # then the page, the total and the category facet counts are all read
+    # off that CTE. facets ignore the category filter so the client can
+    # still show the other categories with their counts
+    ts_query = func.websearch_to_tsquery(literal_column("'english'::regconfig"), q)
+    score = func.ts_rank_cd(PRODUCT_SEARCH_VECTOR, ts_query) + func.similarity(
+        Product.name, q
+    )
+
+    conditions = [
+        or_(
+            PRODUCT_SEARCH_VECTOR.op("@@")(ts_query),
+            Product.name.op("%")(q),  # pyright: ignore
+        )
+    ]
+    if min_price is not None:
+        conditions.append(Product.price >= min_price)
+    if max_price is not None:
+        conditions.append(Product.price <= max_price)
+
+    matched = (
+        select(
+            Product.id,
+            Product.name,
+            Product.price,
+            Product.description,
+            PRODUCT_STOCK.label("stock"),
+            Product.category,
+            Product.image_url,
+            score.label("rank"),
+        )
+        .where(*conditions)
+        .cte("matched")
+    )
+    in_category = matched.c.category == category if category else true()
+
+    page = (
+        select(matched)
+        .where(in_category)
+        .order_by(matched.c.rank.desc(), matched.c.id)
+        .limit(limit)
+        .offset(offset)
+        .subquery("page")
+    )
+    items = select(
+        func.coalesce(
+            func.json_agg(
+                aggregate_order_by(
+                    func.json_build_object(
+                        *(
+                            part
+                            for col in page.c
+                            for part in (literal_column(f"'{col.name}'"), col)
+                        )
+                    ),
+                    page.c.rank.desc(),
+                    page.c.id,
+                )
+            ),
+            literal_column("'[]'::json"),
+        )
+    ).scalar_subquery()
+
+    total = select(func.count()).select_from(matched).where(in_category)
+
+    facet_rows = (
+        select(matched.c.category, func.count().label("count"))
+        .group_by(matched.c.category)
+        .subquery("facet_rows")
+    )
+    facets = select(
+        func.coalesce(
+            func.json_agg(
+                aggregate_order_by(
+                    func.json_build_object(
+                        literal_column("'category'"),
+                        facet_rows.c.category,
+                        literal_column("'count'"),
+                        facet_rows.c.count,
+                    ),
+                    facet_rows.c.count.desc(),
+                    facet_rows.c.category,
+                )
+            ),
+            literal_column("'[]'::json"),
+        )
+    ).scalar_subquery()
+
+    stmt = select(
+        type_coerce(items, JSON).label("items"),
+        total.scalar_subquery().label("total"),
+        type_coerce(facets, JSON).label("facets"),
+    )
+    result = await session.execute(stmt)
+    row = result.one()
+
+    return ProductSearchResult(
+        items=row.items,
+        total=row.total,
+        facets=row.facets,
+        limit=limit,
+        offset=offset,
+    )
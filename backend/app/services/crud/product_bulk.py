@@ -0,0 +1,318 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+import asyncpg
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    Integer,
+    MetaData,
+    Table,
+    Text,
+    Uuid,
+    delete,
+    func,
+    literal_column,
+    or_,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.models.dbmodel import Cart, CartItem, Product
+from app.schemas.schema import ProductFileFormat, ProductImportResult, ProductImportRow
+from app.services.catalog_cache import catalog_cache
+from app.services.crud.stock_shards import PRODUCT_STOCK, reset_stock_shards
+
+# bulk catalog load. the upload is streamed straight into a temp staging
+# table with COPY (csv is parsed by postgres itself, json lines are
+# validated here and sent as binary COPY records), then everything after
+# that is a handful of set based statements: drop duplicate names (the last
+# line wins), lock the existing products and remember their old price, one
+# upsert on Product.name and one UPDATE repricing the carts that hold a
+# product whose price changed. the whole import is one transaction
+
+IMPORT_COLUMNS = ("name", "price", "description", "category", "stock", "image_url")
+EXPORT_COLUMNS = ("id", *IMPORT_COLUMNS)
+EXPORT_BATCH_SIZE = 1000
+
+# not part of SQLModel.metadata, alembic never sees it
+_staging_metadata = MetaData()
+PRODUCT_IMPORT = Table(
+    "product_import",
+    _staging_metadata,
+    Column("line", BigInteger, autoincrement=True, primary_key=True),
+    Column("name", Text),
+    Column("price", Integer),
+    Column("description", Text),
+    Column("category", Text),
+    Column("stock", Integer),
+    Column("image_url", Text),
+    # filled in from the existing product, if there is one
+    Column("product_id", Uuid),
+    Column("old_price", Integer),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+async def _read_header(body: AsyncIterator[bytes]) -> tuple[list[str], bytes]:
+    buffered = b""
+    async for chunk in body:
+        buffered += chunk
+        if b"\n" in buffered:
+            break
+    first_line = buffered.split(b"\n", 1)[0].decode("utf-8-sig")
+    header = next(csv.reader([first_line]), [])
+    return [column.strip().lower() for column in header], buffered
+
+
+def _check_columns(columns: list[str]) -> None:
+    unknown = [c for c in columns if c not in IMPORT_COLUMNS]
+    if unknown or "name" not in columns or len(set(columns)) != len(columns):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                "CSV header needs a name column and may only use "
+                f"{', '.join(IMPORT_COLUMNS)} once each"
+            ),
+        )
+
+
+async def _copy_csv(raw, body: AsyncIterator[bytes]) -> int:
+    columns, buffered = await _read_header(body)
+    _check_columns(columns)
+
+    async def source():
+        # the header line goes along too, COPY skips it
+        yield buffered
+        async for chunk in body:
+            yield chunk
+
+    copied = await raw.copy_to_table(
+        PRODUCT_IMPORT.name,
+        source=source(),
+        columns=columns,
+        format="csv",
+        header=True,
+    )
+    return int(copied.split()[-1])
+
+
+async def _copy_ndjson(raw, body: AsyncIterator[bytes]) -> int:
+    async def records():
+        line_number = 0
+        pending = b""
+        async for chunk in body:
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield _parse_ndjson_line(line, line_number)
+        if pending.strip():
+            yield _parse_ndjson_line(pending, line_number + 1)
+
+    copied = await raw.copy_records_to_table(
+        PRODUCT_IMPORT.name, records=records(), columns=IMPORT_COLUMNS
+    )
+    return int(copied.split()[-1])
+
+
+def _parse_ndjson_line(line: bytes, line_number: int) -> tuple:
+    try:
+        row = ProductImportRow.model_validate_json(line)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"line {line_number}: {e.errors(include_url=False)}",
+        )
+    return tuple(getattr(row, column) for column in IMPORT_COLUMNS)
+
+
+async def import_products(
+    *,
+    session: AsyncSession,
+    body: AsyncIterator[bytes],
+    file_format: ProductFileFormat,
+) -> ProductImportResult:
+    staged = PRODUCT_IMPORT
+    conn = await session.connection()
+    await conn.run_sync(staged.create)
+
+    # COPY isn't exposed through sqlalchemy, it runs on the asyncpg
+    # connection underneath, inside the transaction the session already began
+    raw = (await conn.get_raw_connection()).driver_connection
+    try:
+        if file_format == ProductFileFormat.CSV:
+            rows = await _copy_csv(raw, body)
+        else:
+            rows = await _copy_ndjson(raw, body)
+    except asyncpg.PostgresError as e:
+        await session.rollback()
+        context = getattr(e, "context", None)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{e}" + (f" ({context})" if context else ""),
+        )
+    except HTTPException:
+        await session.rollback()
+        raise
+    # temp tables are never auto analyzed, without stats the joins below
+    # get planned for a near empty table
+    await session.execute(text(f"ANALYZE {staged.name}"))
+
+    later = staged.alias("later")
+    await session.execute(
+        delete(staged).where(
+            later.c.name == staged.c.name, later.c.line > staged.c.line
+        )
+    )
+
+    # lock the products being overwritten before reading their price, a
+    # concurrent price change would otherwise reprice carts off a stale one
+    existing = (
+        select(Product.id, Product.name, Product.price)
+        .where(Product.name.in_(select(staged.c.name)))  # pyright: ignore
+        .with_for_update()
+        .subquery()
+    )
+    await session.execute(
+        update(staged)
+        .where(staged.c.name == existing.c.name)
+        .values(product_id=existing.c.id, old_price=existing.c.price)
+    )
+
+    # columns the file didn't carry fall back to the current value, then the
+    # model default, so excluded.* already holds the final row
+    columns = {
+        "id": func.coalesce(staged.c.product_id, func.gen_random_uuid()),
+        "name": staged.c.name,
+        "price": func.coalesce(staged.c.price, Product.price),
+        "description": func.coalesce(staged.c.description, Product.description),
+        "category": func.coalesce(staged.c.category, Product.category, "Home"),
+        "stock": func.coalesce(staged.c.stock, Product.stock, 0),
+        "image_url": func.coalesce(staged.c.image_url, Product.image_url, " "),
+    }
+    stmt = insert(Product).from_select(
+        list(columns),
+        select(*columns.values())
+        .select_from(staged)
+        .outerjoin(Product, Product.id == staged.c.product_id)  # pyright: ignore
+        .where(staged.c.name.is_not(None)),
+    )
+    changing = IMPORT_COLUMNS[1:]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Product.name],
+        set_={column: stmt.excluded[column] for column in changing},
+        # re-importing an unchanged catalog shouldn't rewrite every row. a
+        # striped one always is, the shard reset below can change its stock
+        # even when Product.stock already matches the file
+        where=or_(
+            tuple_(*(getattr(Product, c) for c in changing)).is_distinct_from(
+                tuple_(*(stmt.excluded[c] for c in changing))
+            ),
+            Product.stock_shards > 0,
+        ),
+    )
+    upserted = stmt.returning(
+        Product.id,
+        Product.name,
+        literal_column("xmax = 0", Boolean).label("inserted"),
+    ).cte("upserted")
+    try:
+        # the updated products are what has to leave the catalog cache, a
+        # new one can't be in it
+        result = await session.execute(
+            select(upserted.c.id, upserted.c.name, upserted.c.inserted)
+        )
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="New products need at least a price and a description",
+        )
+    changed = result.all()
+    inserted = sum(1 for row in changed if row.inserted)
+    updated = len(changed) - inserted
+
+    # a striped product whose stock the file set has all of it in
+    # Product.stock now
+    await reset_stock_shards(
+        session=session,
+        product_ids=select(staged.c.product_id).where(staged.c.stock.is_not(None)),
+    )
+
+    # a cart can hold several repriced products, so sum per cart first
+    deltas = (
+        select(
+            CartItem.cart_id,
+            func.sum((staged.c.price - staged.c.old_price) * CartItem.quantity).label(
+                "delta"
+            ),
+        )
+        .join(staged, staged.c.product_id == CartItem.product_id)
+        .where(staged.c.price != staged.c.old_price)
+        .group_by(CartItem.cart_id)  # pyright: ignore
+        .subquery()
+    )
+    await session.execute(
+        update(Cart)
+        .where(Cart.id == deltas.c.cart_id)  # pyright: ignore
+        .values(subtotal=Cart.subtotal + deltas.c.delta, version=Cart.version + 1)
+    )
+
+    await session.commit()
+    await catalog_cache.invalidate(
+        product_ids=[row.id for row in changed if not row.inserted],
+        names=[row.name for row in changed if not row.inserted],
+    )
+    return ProductImportResult(
+        rows=rows,
+        inserted=inserted,
+        updated=updated,
+        unchanged=rows - inserted - updated,
+    )
+
+
+async def export_products(
+    *,
+    session: AsyncSession,
+    file_format: ProductFileFormat,
+) -> AsyncIterator[bytes]:
+    # server side cursor, only EXPORT_BATCH_SIZE rows are held at a time
+    export_columns = {column: getattr(Product, column) for column in EXPORT_COLUMNS} | {
+        "stock": PRODUCT_STOCK.label("stock")
+    }
+    stmt = (
+        select(*export_columns.values())
+        .order_by(Product.name)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    result = await session.stream(stmt)
+
+    if file_format == ProductFileFormat.CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        async for rows in result.partitions():
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+        return
+
+    async for rows in result.mappings().partitions():
+        yield "".join(
+            json.dumps(dict(row), default=str) + "\n" for row in rows
+        ).encode()
@@ -0,0 +1,248 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, Uuid, column, func, or_, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete, select
+
+from app.models.dbmodel import Cart, CartItem, Product, StockReservation, User
+from app.schemas.schema import CartReservation, ReservedLine
+from app.services.catalog_cache import catalog_cache
+from app.services.crud.cart_lock import lock_cart_and_products
+from app.services.crud.stock_shards import PRODUCT_STOCK, take_stock_for_striped
+from app.utils.env import env_int
+
+# stock holds. starting checkout moves the cart's quantities out of
+# Product.stock into StockReservation rows, each product row is only locked
+# for that one short statement. the checkout itself then claims the holds
+# (crud/checkout.py) and only touches Product for whatever the cart changed
+# by since, so paying for a hot item doesn't queue on its row lock behind
+# every other checkout. holds nobody checks out are handed back by the
+# reservation sweeper once they expire
+#
+# Product.stock is what's left to sell, held units are not part of it
+
+RESERVATION_TTL = timedelta(seconds=env_int("RESERVATION_TTL_SECONDS", 600))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _return_to_stock(released):
+    # released is a DELETE ... RETURNING product_id, quantity cte
+    returned = (
+        select(
+            released.c.product_id,
+            func.sum(released.c.quantity).label("quantity"),
+        )
+        .group_by(released.c.product_id)
+        .subquery("returned")
+    )
+    return (
+        update(Product)
+        .where(Product.id == returned.c.product_id)  # pyright: ignore
+        .values(stock=Product.stock + returned.c.quantity)
+        .returning(Product.id, Product.name)  # pyright: ignore
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reserve_cart(
+    *,
+    session: AsyncSession,
+    user: User,
+) -> CartReservation:
+    # (re)holds exactly what's in the cart now and pushes the expiry out.
+    # only the difference to the holds the cart already has touches stock.
+    # the cart row is locked first (after its products, see
+    # crud/cart_lock.py), locking holds that don't exist yet doesn't keep
+    # two reserves (or a reserve and a checkout) of one cart apart
+    cart_id = await lock_cart_and_products(session=session, user=user)
+    lines: dict[uuid.UUID, int] = {}
+    if cart_id is not None:
+        result = await session.execute(
+            select(CartItem.product_id, CartItem.quantity).where(
+                CartItem.cart_id == cart_id
+            )
+        )
+        lines = {row.product_id: row.quantity for row in result.all()}
+    if not lines:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cart is empty",
+        )
+
+    # locked so the sweeper (which skips locked holds) can't release them
+    # under us
+    result = await session.execute(
+        select(StockReservation.product_id, StockReservation.quantity)
+        .where(StockReservation.cart_id == cart_id)
+        .with_for_update()
+    )
+    held = {row.product_id: row.quantity for row in result.all()}
+
+    deltas = {
+        product_id: lines.get(product_id, 0) - held.get(product_id, 0)
+        for product_id in lines.keys() | held.keys()
+    }
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+
+    if deltas:
+        # one statement for every line, a negative delta gives stock back.
+        # striped products are taken off their shards afterwards
+        changes = values(
+            column("product_id", Uuid),
+            column("delta", Integer),
+            name="changes",
+        ).data(list(deltas.items()))
+        stmt = (
+            update(Product)
+            .where(
+                Product.id == changes.c.product_id,  # pyright: ignore
+                Product.stock >= changes.c.delta,  # pyright: ignore
+                or_(Product.stock_shards == 0, changes.c.delta < 0),
+            )
+            .values(stock=Product.stock - changes.c.delta)
+            .returning(Product.id, Product.name)  # pyright: ignore
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(stmt)
+        changed = list(result.all())
+
+        changed_ids = {row.id for row in changed}
+        left_out = [
+            product_id for product_id in deltas if product_id not in changed_ids
+        ]
+        if left_out:
+            short = await take_stock_for_striped(
+                session=session,
+                needed={product_id: deltas[product_id] for product_id in left_out},
+            )
+            result = await session.execute(
+                select(Product.id, Product.name, PRODUCT_STOCK.label("stock")).where(
+                    Product.id.in_(left_out)  # pyright: ignore
+                )
+            )
+            taken = result.all()
+            if short is not None:
+                product = next(row for row in taken if row.id == short)
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail={
+                        "error": "insufficient_stock",
+                        "message": f"Not enough stock for {product.name}",
+                        # what this cart could hold in total
+                        "available_stock": product.stock + held.get(product.id, 0),
+                        "product_id": str(product.id),
+                    },
+                )
+            changed += taken
+
+    expires_at = _utcnow() + RESERVATION_TTL
+    upsert_stmt = insert(StockReservation).values(
+        [
+            {
+                "id": uuid.uuid4(),
+                "cart_id": cart_id,
+                "product_id": product_id,
+                "quantity": quantity,
+                "expires_at": expires_at,
+            }
+            for product_id, quantity in lines.items()
+        ]
+    )
+    upsert_stmt = upsert_stmt.on_conflict_do_update(
+        constraint="uq_StockReservation_cart_id_product_id",
+        set_={
+            "quantity": upsert_stmt.excluded.quantity,
+            "expires_at": upsert_stmt.excluded.expires_at,
+        },
+    )
+    await session.execute(upsert_stmt)
+
+    dropped = [product_id for product_id in held if product_id not in lines]
+    if dropped:
+        await session.execute(
+            delete(StockReservation).where(
+                StockReservation.cart_id == cart_id,  # pyright: ignore
+                StockReservation.product_id.in_(dropped),  # pyright: ignore
+            )
+        )
+    await session.commit()
+
+    if deltas:
+        await catalog_cache.invalidate(
+            product_ids=[row.id for row in changed],
+            names=[row.name for row in changed],
+        )
+    return CartReservation(
+        items=[
+            ReservedLine(product_id=product_id, quantity=quantity)
+            for product_id, quantity in lines.items()
+        ],
+        expires_at=expires_at,
+    )
+
+
+async def release_cart_reservations(
+    *,
+    session: AsyncSession,
+    user: User,
+) -> int:
+    # hands every hold of the cart back to stock, doesn't commit
+    released = (
+        delete(StockReservation)
+        .where(
+            StockReservation.cart_id.in_(  # pyright: ignore
+                select(Cart.id).where(Cart.user_id == user.id)
+            )
+        )
+        .returning(StockReservation.product_id, StockReservation.quantity)
+        .cte("released")
+    )
+    result = await session.execute(_return_to_stock(released))
+    restocked = result.all()
+    if restocked:
+        catalog_cache.invalidate_after_commit(
+            session,
+            product_ids=[row.id for row in restocked],
+            names=[row.name for row in restocked],
+        )
+    return len(restocked)
+
+
+async def release_expired_reservations(
+    *,
+    session: AsyncSession,
+    batch_size: int,
+) -> int:
+    # one batch of expired holds back to stock, oldest first. holds a
+    # checkout (or a re-reserve) has locked are skipped rather than waited
+    # on, the checkout is about to claim them anyway
+    expired = (
+        select(StockReservation.id)
+        .where(StockReservation.expires_at < _utcnow())
+        .order_by(StockReservation.expires_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    released = (
+        delete(StockReservation)
+        .where(StockReservation.id.in_(expired))  # pyright: ignore
+        .returning(StockReservation.product_id, StockReservation.quantity)
+        .cte("released")
+    )
+    result = await session.execute(_return_to_stock(released))
+    restocked = result.all()
+    await session.commit()
+
+    if restocked:
+        await catalog_cache.invalidate(
+            product_ids=[row.id for row in restocked],
+            names=[row.name for row in restocked],
+        )
+    # distinct products restocked, 0 once there's nothing left to release
+    return len(restocked)
@@ -0,0 +1,269 @@
+import uuid
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, case, column, func, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete, insert, select
+
+from app.models.dbmodel import Product, ProductStockShard
+from app.schemas.schema import ProductStockShards
+from app.services.catalog_cache import catalog_cache
+from app.utils.env import env_int
+
+# striped stock for hot products. every checkout of a product used to
+# decrement the same Product row, so in a flash sale all buyers of one item
+# queued on that row's lock. an admin can spread a product's stock over N
+# ProductStockShard rows instead:
+#
+#   - a checkout takes its quantity from one random shard that has enough,
+#     skipping shards other checkouts hold locked, and only if they are all
+#     busy does it wait on one of them (again picked at random)
+#   - when no single shard covers the quantity any more it gathers: locks
+#     the product and all its shards, takes the quantity from the total and
+#     spreads what's left evenly again
+#   - stock coming back (cancellations, expired holds, restocks) is still
+#     added to Product.stock, which the next gather spreads over the shards.
+#     setting an absolute stock puts it all in Product.stock and empties the
+#     shards
+#
+# so what's for sale is always Product.stock plus the sum of the shards,
+# PRODUCT_STOCK is that as a column expression for the read queries.
+#
+# locks on Product here are FOR NO KEY UPDATE, a checkout holding a shard
+# still needs KEY SHARE on the product for its OrderItem foreign key
+
+MAX_STOCK_SHARDS = env_int("MAX_STOCK_SHARDS", 64)
+
+# how each sharded take was served, for /metrics and the benchmark
+SHARD_TAKES = {"free": 0, "waited": 0, "gathered": 0, "short": 0}
+
+PRODUCT_STOCK = Product.stock + case(
+    (
+        Product.stock_shards > 0,
+        select(func.coalesce(func.sum(ProductStockShard.stock), 0))
+        .where(ProductStockShard.product_id == Product.id)
+        .scalar_subquery(),
+    ),
+    else_=0,
+)
+
+
+def _spread(total: int, shards: int) -> list[int]:
+    share, left = divmod(total, shards)
+    return [share + (1 if shard < left else 0) for shard in range(shards)]
+
+
+async def _take_from_one_shard(
+    *,
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    quantity: int,
+    skip_locked: bool,
+) -> bool:
+    # picks one random shard that had enough and updates only that one.
+    # without skip_locked the UPDATE waits on that single row, never on a
+    # second shard while holding a first, and re-checks stock >= quantity
+    # once it gets it. no row when it was drained in the meantime
+    pick = (
+        select(ProductStockShard.shard)
+        .where(
+            ProductStockShard.product_id == product_id,
+            ProductStockShard.stock >= quantity,
+        )
+        .order_by(func.random())
+        .limit(1)
+    )
+    if skip_locked:
+        pick = pick.with_for_update(skip_locked=True)
+    stmt = (
+        update(ProductStockShard)
+        .where(
+            ProductStockShard.product_id == product_id,  # pyright: ignore
+            ProductStockShard.shard == pick.scalar_subquery(),  # pyright: ignore
+            ProductStockShard.stock >= quantity,  # pyright: ignore
+        )
+        .values(stock=ProductStockShard.stock - quantity)
+        .returning(ProductStockShard.shard)
+    )
+    result = await session.execute(stmt)
+    return result.first() is not None
+
+
+async def _gather(
+    *,
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    quantity: int,
+) -> bool:
+    result = await session.execute(
+        select(Product.stock, Product.stock_shards)
+        .where(Product.id == product_id)
+        .with_for_update(key_share=True)
+    )
+    product = result.one()
+    result = await session.execute(
+        select(ProductStockShard.shard, ProductStockShard.stock)
+        .where(ProductStockShard.product_id == product_id)
+        .order_by(ProductStockShard.shard)
+        .with_for_update()
+    )
+    shards = result.all()
+
+    total = product.stock + sum(shard.stock for shard in shards)
+    if total < quantity:
+        return False
+
+    if shards:
+        spread = values(
+            column("shard", Integer),
+            column("stock", Integer),
+            name="spread",
+        ).data(
+            list(
+                zip(
+                    [shard.shard for shard in shards],
+                    _spread(total - quantity, len(shards)),
+                )
+            )
+        )
+        await session.execute(
+            update(ProductStockShard)
+            .where(
+                ProductStockShard.product_id == product_id,  # pyright: ignore
+                ProductStockShard.shard == spread.c.shard,  # pyright: ignore
+            )
+            .values(stock=spread.c.stock)
+        )
+        new_stock = 0
+    else:
+        # striping was switched off since the caller looked
+        new_stock = total - quantity
+    await session.execute(
+        update(Product)
+        .where(Product.id == product_id)  # pyright: ignore
+        .values(stock=new_stock)
+    )
+    return True
+
+
+async def take_sharded_stock(
+    *,
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    quantity: int,
+) -> bool:
+    # False when the product doesn't have quantity left in total. doesn't
+    # commit, the caller's rollback puts it back
+    if await _take_from_one_shard(
+        session=session, product_id=product_id, quantity=quantity, skip_locked=True
+    ):
+        SHARD_TAKES["free"] += 1
+        return True
+    # when the shard waited on turns out drained postgres still leaves it
+    # locked by us, and a gather holding that one while waiting on the
+    # others can deadlock with another gather. rolling back the savepoint
+    # hands it back first
+    savepoint = await session.begin_nested()
+    if await _take_from_one_shard(
+        session=session, product_id=product_id, quantity=quantity, skip_locked=False
+    ):
+        await savepoint.commit()
+        SHARD_TAKES["waited"] += 1
+        return True
+    await savepoint.rollback()
+    if await _gather(session=session, product_id=product_id, quantity=quantity):
+        SHARD_TAKES["gathered"] += 1
+        return True
+    SHARD_TAKES["short"] += 1
+    return False
+
+
+async def take_stock_for_striped(
+    *,
+    session: AsyncSession,
+    needed: dict[uuid.UUID, int],
+) -> uuid.UUID | None:
+    # for the products a bulk stock UPDATE left out (it only decrements
+    # unstriped ones): takes the striped ones off their shards and returns
+    # the first product that is short, None when everything was taken.
+    # products go in id order so two checkouts never wait on each other's
+    # shards in a cycle
+    result = await session.execute(
+        select(Product.id).where(
+            Product.id.in_(list(needed)),  # pyright: ignore
+            Product.stock_shards > 0,
+        )
+    )
+    striped = set(result.scalars().all())
+
+    for product_id in sorted(needed):
+        if product_id not in striped or not await take_sharded_stock(
+            session=session, product_id=product_id, quantity=needed[product_id]
+        ):
+            return product_id
+    return None
+
+
+async def reset_stock_shards(
+    *,
+    session: AsyncSession,
+    product_ids,
+) -> None:
+    # the caller just set Product.stock to the products' whole stock.
+    # product_ids can be a list or a select of ids
+    await session.execute(
+        update(ProductStockShard)
+        .where(ProductStockShard.product_id.in_(product_ids))  # pyright: ignore
+        .values(stock=0)
+    )
+
+
+async def set_stock_shards(
+    *,
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    shards: int,
+) -> ProductStockShards:
+    # (re)stripes the product's whole stock over shards rows, 0 folds it back
+    # into Product.stock
+    if not 0 <= shards <= MAX_STOCK_SHARDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"shards has to be between 0 and {MAX_STOCK_SHARDS}",
+        )
+    product = await session.get(
+        Product, product_id, with_for_update={"key_share": True}
+    )
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found",
+        )
+    result = await session.execute(
+        select(ProductStockShard.stock)
+        .where(ProductStockShard.product_id == product_id)
+        .order_by(ProductStockShard.shard)
+        .with_for_update()
+    )
+    total = product.stock + sum(result.scalars().all())
+
+    await session.execute(
+        delete(ProductStockShard).where(
+            ProductStockShard.product_id == product_id  # pyright: ignore
+        )
+    )
+    if shards:
+        await session.execute(
+            insert(ProductStockShard).values(
+                [
+                    {"product_id": product_id, "shard": shard, "stock": stock}
+                    for shard, stock in enumerate(_spread(total, shards))
+                ]
+            )
+        )
+    product.stock = 0 if shards else total
+    product.stock_shards = shards
+    session.add(product)
+    await session.commit()
+    await catalog_cache.invalidate(product_ids=[product_id], names=[product.name])
+    return ProductStockShards(product_id=product_id, shards=shards, stock=total)
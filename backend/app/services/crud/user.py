@@ -1,6 +1,10 @@
+import uuid
+
 from app.models.dbmodel import User
 from app.schemas.schema import UserCreate
+from app.services.user_cache import invalidate_user
 from app.utils.security import get_password_hash, verify_password
+from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 
@@ -64,4 +68,53 @@ async def authenticate(
         session.add(db_user)
         await session.commit()
         await session.refresh(db_user)
+        invalidate_user(db_user.id)
+    return db_user
+
+
+async def _get_user_or_404(
+    *,
+    session: AsyncSession,
+    user_id: uuid.UUID,
+) -> User:
+    db_user = await session.get(User, user_id)
+    if not db_user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    return db_user
+
+
+# anything that changes what a token is allowed to do has to go through here
+# so the cached principal in get_current_user gets dropped
+async def update_user_password(
+    *,
+    session: AsyncSession,
+    user_id: uuid.UUID,
+    new_password: str,
+) -> User:
+    db_user = await _get_user_or_404(session=session, user_id=user_id)
+    db_user.hashed_password = await get_password_hash(new_password)
+
+    session.add(db_user)
+    await session.commit()
+    await session.refresh(db_user)
+    invalidate_user(db_user.id)
+    return db_user
+
+
+async def set_user_admin(
+    *,
+    session: AsyncSession,
+    user_id: uuid.UUID,
+    is_admin: bool,
+) -> User:
+    db_user = await _get_user_or_404(session=session, user_id=user_id)
+    db_user.is_admin = is_admin
+
+    session.add(db_user)
+    await session.commit()
+    await session.refresh(db_user)
+    invalidate_user(db_user.id)
     return db_user
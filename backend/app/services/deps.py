@@ -1,8 +1,7 @@
-import os
+import uuid
 from threading import current_thread
 from typing import Annotated
 
-import jwt
 from dotenv import load_dotenv
 from fastapi import Depends, Form, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -13,15 +12,13 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_async_session
 from app.models.dbmodel import User
 from app.schemas.schema import TokenPayload
+from app.services.user_cache import cache_user, get_cached_user
+from app.utils.tokens import token_service
 
 load_dotenv()
 
 reusable_oauth2 = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
-SECRET_KEY = os.getenv("SECRET_KEY")
-if SECRET_KEY is None:
-    raise RuntimeError("SECRET_KEY env var is not set")
-
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
@@ -29,21 +26,23 @@ async def get_current_user(
     token: TokenDep,
     session: AsyncSession = Depends(get_async_session),
 ) -> User:
-    ALGORITHM = os.getenv("ALGORITHM")
-    if ALGORITHM is None:
-        raise RuntimeError("ALGORITHM env var is not set")
-
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = token_service.decode(token)
         token_data = TokenPayload(**payload)
-    except (InvalidTokenError, ValidationError):
+        user_id = uuid.UUID(token_data.sub)
+    except (InvalidTokenError, ValidationError, TypeError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = await session.get(User, token_data.sub)
+    cached_user = get_cached_user(user_id)
+    if cached_user is not None:
+        return cached_user
+
+    user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    cache_user(user)
     return user
 
 
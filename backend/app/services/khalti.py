@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from app.utils.env import env_float, env_int
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# one pooled client for every call to the khalti gateway instead of a new
+# AsyncClient (and a new TCP + TLS handshake) per request. opened in
+# main.lifespan and closed on shutdown.
+#
+# initiate creates a payment so it is never retried. lookup only reads the
+# payment state, that one is retried with backoff on network errors and 5xx.
+# both go through a circuit breaker so a dead gateway fails fast with a 503
+# instead of tying up request handlers for the full timeout
+
+
+# order totals are in rupees, khalti amounts in paisa
+PAISA_PER_RUPEE = 100
+
+
+class CircuitBreaker:
+    # closed -> open after failure_threshold failures in a row, open -> half
+    # open once reset_timeout passed, where one trial call decides between
+    # closed and open again
+    def __init__(self, *, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 0
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        return max(1, int(remaining + 0.999))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        tripped = self.opened_at is None and self.failures >= self.failure_threshold
+        if tripped or self.trial_in_flight:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+        self.trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_seconds": self.reset_timeout,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class KhaltiClient:
+    def __init__(
+        self,
+        *,
+        secret_key: str | None,
+        initiate_url: str | None,
+        verify_url: str | None,
+        timeout: httpx.Timeout,
+        limits: httpx.Limits,
+        verify_retries: int,
+        retry_backoff: float,
+        breaker: CircuitBreaker,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.secret_key = secret_key
+        self.initiate_url = initiate_url
+        self.verify_url = verify_url
+        self.timeout = timeout
+        self.limits = limits
+        self.verify_retries = verify_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker
+        # lets tests point the client at an in process stub
+        self.transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls) -> "KhaltiClient":
+        return cls(
+            secret_key=os.getenv("KHALTI_SECRET_KEY"),
+            initiate_url=os.getenv("KHALTI_INITIATE_URL"),
+            verify_url=os.getenv("KHALTI_VERIFY_URL"),
+            timeout=httpx.Timeout(
+                env_float("KHALTI_TIMEOUT_SECONDS", 10.0),
+                connect=env_float("KHALTI_CONNECT_TIMEOUT_SECONDS", 3.0),
+            ),
+            limits=httpx.Limits(
+                max_connections=env_int("KHALTI_MAX_CONNECTIONS", 20),
+                max_keepalive_connections=env_int("KHALTI_MAX_KEEPALIVE", 10),
+                keepalive_expiry=env_float("KHALTI_KEEPALIVE_SECONDS", 30.0),
+            ),
+            verify_retries=env_int("KHALTI_VERIFY_RETRIES", 2),
+            retry_backoff=env_float("KHALTI_RETRY_BACKOFF_SECONDS", 0.2),
+            breaker=CircuitBreaker(
+                failure_threshold=env_int("KHALTI_BREAKER_FAILURES", 5),
+                reset_timeout=env_float("KHALTI_BREAKER_RESET_SECONDS", 30.0),
+            ),
+        )
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self.transport,
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, url: str, payload: dict, *, retries: int) -> dict[str, Any]:
+        if self.secret_key is None:
+            raise RuntimeError("KHALTI_SECRET_KEY env var not set")
+        await self.start()
+        assert self._client is not None
+        headers = {"Authorization": f"Key {self.secret_key}"}
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Payment gateway is unavailable, try again shortly",
+                    headers={"Retry-After": str(self.breaker.retry_after())},
+                )
+
+            self.calls += 1
+            error: HTTPException
+            settled = False
+            try:
+                res = await self._client.post(url, json=payload, headers=headers)
+                if res.status_code < 500 and res.status_code != 429:
+                    # a 4xx is khalti answering about the payment, the
+                    # gateway itself is fine
+                    body = res.json() if res.is_success else None
+                    self.breaker.record_success()
+                    settled = True
+                    if body is None:
+                        raise HTTPException(
+                            status_code=res.status_code, detail=res.text
+                        )
+                    return body
+                error = HTTPException(status_code=res.status_code, detail=res.text)
+            except httpx.TransportError as e:
+                logger.warning("khalti %s failed: %r", url, e)
+                error = HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"Khalti unreachable at: {url}",
+                )
+            except ValueError as e:
+                # a 2xx that isn't json
+                logger.warning("khalti %s answered garbage: %r", url, e)
+                error = HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"Invalid response from Khalti at: {url}",
+                )
+            finally:
+                # whatever ended the call, 5xx, cancellation or anything
+                # unexpected, it counts as a failure. otherwise a half open
+                # trial would stay in flight and every later call get a 503
+                if not settled:
+                    self.breaker.record_failure()
+
+            if attempt >= retries:
+                self.failures += 1
+                raise error
+            # full jitter so a burst of retries doesn't land at once
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(random.uniform(0, self.retry_backoff * 2**attempt))
+
+    async def initiate(self, payload: dict) -> dict[str, Any]:
+        if self.initiate_url is None:
+            raise RuntimeError("KHALTI_INITIATE_URL env var not set")
+        return await self._post(self.initiate_url, payload, retries=0)
+
+    async def lookup(self, pidx: str) -> dict[str, Any]:
+        if self.verify_url is None:
+            raise RuntimeError("KHALTI_VERIFY_URL env var not set")
+        return await self._post(
+            self.verify_url, {"pidx": pidx}, retries=self.verify_retries
+        )
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "breaker": self.breaker.stats(),
+        }
+
+
+khalti_client = KhaltiClient.from_env()
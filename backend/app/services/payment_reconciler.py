@@ -0,0 +1,283 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from fastapi import HTTPException, status
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlmodel import select
+
+from app.database import async_session_factory
+from app.models.dbmodel import Order
+from app.schemas.schema import VALID_TRANSACTIONS, OrderStatus
+from app.services.khalti import PAISA_PER_RUPEE, KhaltiClient, khalti_client
+from app.utils.env import env_bool, env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+# moves orders to paid once khalti says the payment completed, without a
+# request handler waiting on khalti to do it.
+#
+# /payment/verify hands its pidx to the worker and waits (bounded) on a
+# future that every concurrent verify of the same pidx shares, so a double
+# clicked return page is one lookup. the worker wakes up on those requests or
+# every interval, looks the batch up with limited concurrency, flips all the
+# completed ones to paid in one UPDATE and only then resolves the futures.
+# on the timer it also sweeps recent pending orders nobody came back to verify
+#
+# started and stopped from main.lifespan, one per worker process
+
+KHALTI_COMPLETED = "Completed"
+
+# every status khalti payment completion is allowed to move out of
+_PAYABLE_STATUSES = [
+    current.value
+    for current, allowed in VALID_TRANSACTIONS.items()
+    if OrderStatus.PAID in allowed
+]
+_SETTLED_STATUSES = {
+    OrderStatus.PAID.value,
+    OrderStatus.SHIPPED.value,
+    OrderStatus.DELIVERED.value,
+}
+
+
+class PaymentReconciler:
+    def __init__(
+        self,
+        *,
+        client: KhaltiClient,
+        session_factory: async_sessionmaker[AsyncSession],
+        interval: float,
+        batch_window: float,
+        batch_size: int,
+        concurrency: int,
+        max_age: timedelta,
+    ) -> None:
+        self.client = client
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_age = max_age
+        self._requested: set[str] = set()
+        self._waiters: dict[str, asyncio.Future] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.lookups = 0
+        self.lookup_errors = 0
+        self.orders_paid = 0
+        self.amount_mismatches = 0
+        self.deduplicated = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.cancel()
+        self._waiters.clear()
+
+    async def verify(self, pidx: str, *, wait: float) -> dict[str, Any]:
+        # an order that's already paid doesn't need khalti at all
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Order.status).where(Order.payment_pidx == pidx)
+            )
+            order_status = result.scalar_one_or_none()
+        if order_status in _SETTLED_STATUSES:
+            return {"pidx": pidx, "status": KHALTI_COMPLETED}
+
+        waiter = self._waiters.get(pidx)
+        if waiter is None:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[pidx] = waiter
+            self._requested.add(pidx)
+            self._wakeup.set()
+        else:
+            self.deduplicated += 1
+        if self._task is None:
+            # no worker in this process (disabled, or a script), do it inline
+            await self.reconcile_once()
+
+        try:
+            # shielded, one caller timing out mustn't cancel it for the others
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout=wait)
+        except TimeoutError:
+            # the worker still gets to it, the order flips to paid either way
+            return {"pidx": pidx, "status": "Pending"}
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                # let a burst of verify calls land in the same batch
+                await asyncio.sleep(self.batch_window)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.reconcile_once()
+            except Exception:
+                logger.exception("payment reconciliation batch failed")
+
+    async def reconcile_once(self) -> None:
+        requested = list(self._requested)[: self.batch_size]
+        self._requested.difference_update(requested)
+        if self._requested:
+            # more than one batch waiting, go again right away
+            self._wakeup.set()
+
+        results: dict[str, Any] = {}
+        try:
+            results = await self._reconcile(list(requested))
+        except Exception as e:
+            # nobody may be left hanging on a future that's never resolved
+            results = {pidx: e for pidx in requested}
+            raise
+        finally:
+            self._resolve(results)
+
+    async def _reconcile(self, batch: list[str]) -> dict[str, Any]:
+        async with self.session_factory() as session:
+            if len(batch) < self.batch_size:
+                cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - self.max_age
+                stmt = (
+                    select(Order.payment_pidx)
+                    .where(
+                        Order.status == OrderStatus.PENDING.value,
+                        Order.payment_pidx.is_not(None),  # pyright: ignore
+                        Order.ordered_at >= cutoff,
+                    )
+                    .order_by(Order.ordered_at.desc())  # pyright: ignore
+                    .limit(self.batch_size)
+                )
+                result = await session.execute(stmt)
+                for pidx in result.scalars().all():
+                    if len(batch) >= self.batch_size:
+                        break
+                    if pidx not in batch:
+                        batch.append(pidx)
+            if not batch:
+                return {}
+
+            self.batches += 1
+            results = await self._lookup_all(batch)
+
+            completed = [
+                pidx
+                for pidx, data in results.items()
+                if isinstance(data, dict) and data.get("status") == KHALTI_COMPLETED
+            ]
+            paid: list[str] = []
+            if completed:
+                # completed only counts when khalti got the order's whole
+                # total, a payment for less never marks the order paid
+                stmt = select(Order.payment_pidx, Order.total_price).where(
+                    Order.payment_pidx.in_(completed)  # pyright: ignore
+                )
+                result = await session.execute(stmt)
+                for pidx, total_price in result.all():
+                    amount = results[pidx].get("total_amount")
+                    if amount == total_price * PAISA_PER_RUPEE:
+                        paid.append(pidx)
+                        continue
+                    self.amount_mismatches += 1
+                    logger.warning(
+                        "khalti payment %s completed with %r paisa, order total "
+                        "is %d, not marking it paid",
+                        pidx,
+                        amount,
+                        total_price * PAISA_PER_RUPEE,
+                    )
+                    results[pidx] = HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail="Paid amount doesn't match the order total",
+                    )
+
+            if paid:
+                stmt = (
+                    update(Order)
+                    .where(
+                        Order.payment_pidx.in_(paid),  # pyright: ignore
+                        Order.status.in_(_PAYABLE_STATUSES),  # pyright: ignore
+                    )
+                    .values(status=OrderStatus.PAID.value)
+                    .returning(Order.id)
+                )
+                result = await session.execute(stmt)
+                self.orders_paid += len(result.all())
+                await session.commit()
+
+        return results
+
+    def _resolve(self, results: dict[str, Any]) -> None:
+        for pidx, data in results.items():
+            waiter = self._waiters.pop(pidx, None)
+            if waiter is None or waiter.done():
+                continue
+            if isinstance(data, BaseException):
+                waiter.set_exception(data)
+            else:
+                waiter.set_result(data)
+
+    async def _lookup_all(self, batch: list[str]) -> dict[str, Any]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def lookup(pidx: str):
+            async with semaphore:
+                self.lookups += 1
+                return await self.client.lookup(pidx)
+
+        results = await asyncio.gather(
+            *(lookup(pidx) for pidx in batch), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                self.lookup_errors += 1
+                if not isinstance(result, HTTPException):
+                    logger.warning("khalti lookup failed: %r", result)
+        return dict(zip(batch, results))
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "waiting_requests": len(self._waiters),
+            "batches": self.batches,
+            "lookups": self.lookups,
+            "lookup_errors": self.lookup_errors,
+            "deduplicated": self.deduplicated,
+            "orders_paid": self.orders_paid,
+            "amount_mismatches": self.amount_mismatches,
+        }
+
+
+def _make_reconciler() -> PaymentReconciler:
+    return PaymentReconciler(
+        client=khalti_client,
+        session_factory=async_session_factory,
+        interval=env_float("PAYMENT_RECONCILE_INTERVAL_SECONDS", 30.0),
+        batch_window=env_float("PAYMENT_RECONCILE_BATCH_WINDOW_SECONDS", 0.05),
+        batch_size=env_int("PAYMENT_RECONCILE_BATCH_SIZE", 50),
+        concurrency=env_int("PAYMENT_RECONCILE_CONCURRENCY", 5),
+        max_age=timedelta(
+            minutes=env_float("PAYMENT_RECONCILE_MAX_AGE_MINUTES", 120.0)
+        ),
+    )
+
+
+payment_reconciler = _make_reconciler()
+PAYMENT_RECONCILER_ENABLED = env_bool("PAYMENT_RECONCILER_ENABLED", True)
+PAYMENT_VERIFY_WAIT_SECONDS = env_float("PAYMENT_VERIFY_WAIT_SECONDS", 10.0)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database import async_session_factory
+from app.services.crud.reservation import release_expired_reservations
+from app.utils.env import env_bool, env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+# hands the stock of expired holds (crud/reservation.py) back. every interval
+# it releases batch after batch until nothing expired is left, each batch its
+# own short transaction so it never holds many product rows at once. holds a
+# checkout has locked are skipped, several workers can sweep side by side
+#
+# started and stopped from main.lifespan, one per worker process
+
+
+class ReservationSweeper:
+    def __init__(
+        self,
+        *,
+        session_factory: async_sessionmaker[AsyncSession],
+        interval: float,
+        batch_size: int,
+    ) -> None:
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: asyncio.Task | None = None
+        self.sweeps = 0
+        self.batches = 0
+        self.products_restocked = 0
+        self.errors = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("reservation sweep failed")
+
+    async def sweep_once(self) -> int:
+        self.sweeps += 1
+        restocked = 0
+        while True:
+            async with self.session_factory() as session:
+                released = await release_expired_reservations(
+                    session=session, batch_size=self.batch_size
+                )
+            if not released:
+                return restocked
+            self.batches += 1
+            self.products_restocked += released
+            restocked += released
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "sweeps": self.sweeps,
+            "batches": self.batches,
+            "products_restocked": self.products_restocked,
+            "errors": self.errors,
+        }
+
+
+reservation_sweeper = ReservationSweeper(
+    session_factory=async_session_factory,
+    interval=env_float("RESERVATION_SWEEP_INTERVAL_SECONDS", 30.0),
+    batch_size=env_int("RESERVATION_SWEEP_BATCH_SIZE", 500),
+)
+RESERVATION_SWEEPER_ENABLED = env_bool("RESERVATION_SWEEPER_ENABLED", True)
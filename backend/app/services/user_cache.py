@@ -0,0 +1,35 @@
+import uuid
+
+from app.models.dbmodel import User
+from app.utils.cache import TTLCache
+from app.utils.env import env_float, env_int
+
+# get_current_user runs on every authenticated request, so keep the hot
+# principals in memory instead of doing session.get(User) each time
+user_cache = TTLCache(
+    name="users",
+    max_size=env_int("USER_CACHE_MAX_SIZE", 10_000),
+    ttl=env_float("USER_CACHE_TTL_SECONDS", 60.0),
+)
+
+# the password hash never needs to leave the db for an authenticated request
+_CACHED_FIELDS = ("id", "username", "useremail", "userphone", "is_admin", "created_at")
+
+
+def cache_user(user: User) -> None:
+    user_cache.set(
+        str(user.id),
+        {field: getattr(user, field) for field in _CACHED_FIELDS},
+    )
+
+
+def get_cached_user(user_id: str | uuid.UUID) -> User | None:
+    data = user_cache.get(str(user_id))
+    if data is None:
+        return None
+    # hand out a fresh detached object so one request cant mutate another's user
+    return User(**data)
+
+
+def invalidate_user(user_id: str | uuid.UUID) -> None:
+    user_cache.delete(str(user_id))
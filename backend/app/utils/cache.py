@@ -0,0 +1,176 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# every cache registers itself here so the admin routes can report on all of
+# them, anything with a stats() -> dict method can go in
+CACHE_REGISTRY: dict[str, Any] = {}
+
+
+class TTLCache:
+    # in process LRU with a per entry expiry. no locking because everything
+    # that touches it runs on the event loop thread
+    def __init__(
+        self, *, name: str, max_size: int, ttl: float, register: bool = True
+    ) -> None:
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        if register:
+            CACHE_REGISTRY[name] = self
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# async key/value backends for caches that may live outside the process.
+# values are anything json can carry, each backend deals with its own encoding
+
+
+class CacheBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def get(self, key: str) -> Any | None: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None: ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None: ...
+
+    @abstractmethod
+    async def incr(self, key: str) -> int: ...
+
+    @abstractmethod
+    async def get_counter(self, key: str) -> int: ...
+
+    async def close(self) -> None:
+        return None
+
+
+class MemoryBackend(CacheBackend):
+    # values are stored as is, callers must treat what they get back as read only
+    name = "memory"
+
+    def __init__(self, *, name: str, max_size: int, ttl: float) -> None:
+        # whoever owns the backend reports stats, so dont register twice
+        self.cache = TTLCache(name=name, max_size=max_size, ttl=ttl, register=False)
+        self._counters: dict[str, int] = {}
+
+    async def get(self, key: str) -> Any | None:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.cache.delete(key)
+
+    async def incr(self, key: str) -> int:
+        # counters never expire or get evicted, they version other keys
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    async def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+
+class RedisBackend(CacheBackend):
+    # takes any client with the redis.asyncio interface (get / set(px=) /
+    # delete / incr), so a local fake can stand in for a real server
+    name = "redis"
+
+    def __init__(self, client: Any, *, prefix: str = "ecom:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, *, prefix: str = "ecom:") -> "RedisBackend":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError(
+                "a redis:// cache url is set but the 'redis' package isn't installed"
+            )
+        return cls(redis.from_url(url), prefix=prefix)
+
+    async def get(self, key: str) -> Any | None:
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self.client.set(
+            self.prefix + key,
+            json.dumps(value, separators=(",", ":")),
+            px=max(1, int(ttl * 1000)),
+        )
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def incr(self, key: str) -> int:
+        return int(await self.client.incr(self.prefix + key))
+
+    async def get_counter(self, key: str) -> int:
+        raw = await self.client.get(self.prefix + key)
+        return int(raw) if raw is not None else 0
+
+    async def close(self) -> None:
+        close = getattr(self.client, "aclose", None) or getattr(
+            self.client, "close", None
+        )
+        if close is not None:
+            await close()
@@ -0,0 +1,29 @@
+import hashlib
+import json
+from typing import Any
+
+from fastapi import Response, status
+
+
+# weak etags, the same data can be rendered to slightly different bytes
+def make_etag(value: Any) -> str:
+    raw = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison so the W/ prefix doesn't matter
+    wanted = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        if candidate.strip().removeprefix("W/") == wanted:
+            return True
+    return False
+
+
+def not_modified(headers: dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
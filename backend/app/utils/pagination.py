@@ -0,0 +1,49 @@
+import base64
+import binascii
+import json
+import uuid
+from typing import Any
+
+from fastapi import HTTPException, status
+
+
+# cursors are opaque to the client, its just the (sort_key, id) of the row at
+# the edge of a page plus which way we were walking, base64 encoded json
+def encode_cursor(*, sort: str, key: Any, row_id: uuid.UUID, forward: bool) -> str:
+    payload = {"s": sort, "k": key, "id": str(row_id), "f": forward}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(
+    cursor: str, *, sort: str, key_type: type
+) -> tuple[Any, uuid.UUID, bool]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        key = payload["k"]
+        row_id = uuid.UUID(payload["id"])
+        forward = bool(payload["f"])
+        cursor_sort = payload["s"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+    # a cursor from one sort order makes no sense in another
+    if cursor_sort != sort:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cursor was issued for sort '{cursor_sort}', not '{sort}'",
+        )
+
+    # the key goes straight into the keyset comparison, one of the wrong type
+    # would only fail in postgres. bool is an int to isinstance
+    if not isinstance(key, key_type) or isinstance(key, bool):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+    return key, row_id, forward
@@ -0,0 +1,202 @@
+import contextvars
+import heapq
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.utils.env import env_bool, env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+# counts the sql every request runs. cursor execute hooks on the engine add
+# to the stats of whichever request is current (a contextvar, set by the
+# middleware below), the middleware then reports them in a Server-Timing
+# header, folds them into per route totals for /admin/queries and warns when
+# a request blows through its query budget, which is nearly always an N+1
+
+
+@dataclass
+class RequestQueries:
+    count: int = 0
+    duration: float = 0.0
+    # (seconds, statement), slowest first, at most SLOWEST_PER_REQUEST long
+    slowest: list[tuple[float, str]] = field(default_factory=list)
+    statements: Counter = field(default_factory=Counter)
+
+
+@dataclass
+class RouteQueries:
+    requests: int = 0
+    queries: int = 0
+    db_seconds: float = 0.0
+    max_queries: int = 0
+    over_budget: int = 0
+
+
+_current: contextvars.ContextVar[RequestQueries | None] = contextvars.ContextVar(
+    "request_queries", default=None
+)
+
+
+class QueryStats:
+    SLOWEST_PER_REQUEST = 3
+
+    def __init__(self, *, budget: int, slow_query_ms: float, keep_slowest: int) -> None:
+        self.budget = budget
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.keep_slowest = keep_slowest
+        self.routes: dict[str, RouteQueries] = {}
+        # min heap of the slowest statements seen, (seconds, statement)
+        self._slowest: list[tuple[float, str]] = []
+        self.slow_queries = 0
+
+    def install(self, engine: AsyncEngine) -> None:
+        event.listen(engine.sync_engine, "before_cursor_execute", self._before)
+        event.listen(engine.sync_engine, "after_cursor_execute", self._after)
+        event.listen(engine.sync_engine, "handle_error", self._failed)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(
+            (statement, time.perf_counter())
+        )
+
+    def _failed(self, context) -> None:
+        # a statement that raised never gets to _after, its start time has to
+        # come off the connection's stack here or every later timing on that
+        # pooled connection pairs up with the wrong start. an error before
+        # the cursor ran (connecting, binding) never pushed one
+        conn = context.connection
+        started = conn.info.get("query_started_at") if conn is not None else None
+        if started and started[-1][0] == context.statement:
+            started.pop()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        _, started_at = conn.info["query_started_at"].pop()
+        elapsed = time.perf_counter() - started_at
+
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries += 1
+            logger.warning(
+                "slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split())
+            )
+        if len(self._slowest) < self.keep_slowest:
+            heapq.heappush(self._slowest, (elapsed, statement))
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (elapsed, statement))
+
+        stats = _current.get()
+        if stats is None:
+            return
+        stats.count += 1
+        stats.duration += elapsed
+        stats.statements[statement] += 1
+        if (
+            len(stats.slowest) < self.SLOWEST_PER_REQUEST
+            or elapsed > stats.slowest[-1][0]
+        ):
+            stats.slowest.append((elapsed, statement))
+            stats.slowest.sort(reverse=True)
+            del stats.slowest[self.SLOWEST_PER_REQUEST :]
+
+    def begin_request(self) -> tuple[RequestQueries, contextvars.Token]:
+        stats = RequestQueries()
+        return stats, _current.set(stats)
+
+    def end_request(
+        self, route: str, stats: RequestQueries, token: contextvars.Token
+    ) -> None:
+        _current.reset(token)
+
+        totals = self.routes.get(route)
+        if totals is None:
+            totals = self.routes[route] = RouteQueries()
+        totals.requests += 1
+        totals.queries += stats.count
+        totals.db_seconds += stats.duration
+        totals.max_queries = max(totals.max_queries, stats.count)
+
+        if stats.count > self.budget:
+            totals.over_budget += 1
+            statement, repeats = stats.statements.most_common(1)[0]
+            slowest_seconds, slowest = stats.slowest[0]
+            logger.warning(
+                "possible N+1: %s ran %d queries in %.1f ms (budget %d), most "
+                "repeated (%d times): %s | slowest (%.1f ms): %s",
+                route,
+                stats.count,
+                stats.duration * 1000,
+                self.budget,
+                repeats,
+                " ".join(statement.split()),
+                slowest_seconds * 1000,
+                " ".join(slowest.split()),
+            )
+
+    def stats(self) -> dict:
+        return {
+            "query_budget": self.budget,
+            "slow_query_ms": self.slow_query_seconds * 1000,
+            "slow_queries": self.slow_queries,
+            "routes": {
+                route: {
+                    "requests": r.requests,
+                    "queries": r.queries,
+                    "queries_per_request": round(r.queries / r.requests, 2),
+                    "max_queries": r.max_queries,
+                    "db_ms_per_request": round(r.db_seconds / r.requests * 1000, 3),
+                    "over_budget": r.over_budget,
+                }
+                for route, r in sorted(self.routes.items())
+            },
+            "slowest_statements": [
+                {"ms": round(seconds * 1000, 3), "statement": " ".join(s.split())}
+                for seconds, s in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+
+class QueryStatsMiddleware:
+    # plain asgi rather than BaseHTTPMiddleware, no extra task per request
+    def __init__(self, app, *, query_stats: QueryStats) -> None:
+        self.app = app
+        self.query_stats = query_stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats, token = self.query_stats.begin_request()
+        started_at = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total_ms = (time.perf_counter() - started_at) * 1000
+                timing = (
+                    f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries",'
+                    f" app;dur={total_ms:.2f}"
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", timing.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # routing fills in the matched route, unmatched paths share a bucket
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            self.query_stats.end_request(f"{scope['method']} {path}", stats, token)
+
+
+query_stats = QueryStats(
+    budget=env_int("QUERY_BUDGET_PER_REQUEST", 20),
+    slow_query_ms=env_float("SLOW_QUERY_MS", 200.0),
+    keep_slowest=env_int("QUERY_STATS_KEEP_SLOWEST", 10),
+)
+QUERY_STATS_ENABLED = env_bool("QUERY_STATS_ENABLED", True)
@@ -1,40 +1,100 @@
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import Any, Callable, TypeVar
 
-import jwt
-from dotenv import find_dotenv, load_dotenv
+from fastapi import HTTPException, status
 from pwdlib import PasswordHash
 
+from app.utils.env import env_int
+from app.utils.tokens import token_service
+
 # Initialize with recommended Argon2 settings
 password_hash = PasswordHash.recommended()
 
-load_dotenv()
-print(f"Loading .env from: {find_dotenv()}")
 
-SECRET_KEY = os.getenv("SECRET_KEY")
-print(f"SECRET_KEY: {SECRET_KEY}")
+T = TypeVar("T")
+
+
+class HashingPool:
+    # argon2 is cpu heavy and blocks whatever thread it runs on. the cffi
+    # bindings drop the GIL while hashing so a small thread pool is enough to
+    # keep it off the event loop. the semaphore caps how many run at once and
+    # max_pending caps how many can pile up behind it during a login storm
+    def __init__(self, *, workers: int, max_pending: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="argon2"
+        )
+        self._semaphore = asyncio.Semaphore(workers)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.queued + self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+
+        self.queued += 1
+        if self.queued > self.max_queue_depth:
+            self.max_queue_depth = self.queued
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
-if SECRET_KEY is None:
-    raise RuntimeError("SECRET_KEY env var is not set")
 
-ALGORITHM = os.getenv("ALGORITHM")
-if ALGORITHM is None:
-    raise RuntimeError("ALGORITHM env var is not set")
+hashing_pool = HashingPool(
+    workers=env_int("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)),
+    max_pending=env_int("PASSWORD_HASH_MAX_PENDING", 64),
+)
 
 
 async def get_password_hash(password: str) -> str:
-    return password_hash.hash(password)
+    return await hashing_pool.run(password_hash.hash, password)
 
 
 async def verify_password(
     plain_password: str, hashed_password: str
 ) -> tuple[bool, str | None]:
-    return password_hash.verify_and_update(plain_password, hashed_password)
+    return await hashing_pool.run(
+        password_hash.verify_and_update, plain_password, hashed_password
+    )
 
 
 async def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
     expire = datetime.now(timezone.utc).replace(tzinfo=None) + expires_delta
     to_encode = {"exp": expire, "sub": str(subject)}
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return token_service.encode(to_encode)
@@ -0,0 +1,85 @@
+import operator
+from typing import Any, Callable, Sequence
+
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from pydantic_core import to_json, to_jsonable_python
+from sqlalchemy import Row
+
+try:
+    import orjson
+except ImportError:
+    # optional, pydantic_core's rust encoder (always installed) is close
+    orjson = None
+
+# read endpoints that return whole lists used to build a pydantic model per
+# row in crud, then fastapi validated every one of them again against the
+# route's response_model before encoding. here a schema gets a serializer
+# that knows its field names, each row becomes a plain dict of those fields
+# and the whole list is encoded in one call. routes keep response_model for
+# the openapi docs, returning a Response is what skips the re-validation.
+#
+# nothing is validated on this path, so the query has to select columns
+# named like the schema fields (label() them where they differ)
+
+
+# asyncpg hands back its own UUID class, which neither encoder knows
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return to_json(value, fallback=str)
+
+
+class FastJSONResponse(JSONResponse):
+    # for content that is already json shaped, like the cached catalog pages
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RowSerializer:
+    def __init__(self, schema: type[BaseModel]) -> None:
+        self.schema = schema
+        self.fields = tuple(schema.model_fields)
+        # column positions per result shape, worked out on the first result
+        self._getters: dict[tuple[str, ...], Callable[[Row], tuple]] = {}
+
+    def _getter(self, keys: tuple[str, ...]) -> Callable[[Row], tuple]:
+        getter = self._getters.get(keys)
+        if getter is None:
+            missing = [f for f in self.fields if f not in keys]
+            if missing:
+                raise ValueError(
+                    f"{self.schema.__name__} needs the columns {', '.join(missing)}"
+                )
+            positions = [keys.index(f) for f in self.fields]
+            if len(positions) == 1:
+                (position,) = positions
+                getter = lambda row: (row[position],)  # noqa: E731
+            else:
+                getter = operator.itemgetter(*positions)
+            self._getters[keys] = getter
+        return getter
+
+    def dicts(self, rows: Sequence[Row]) -> list[dict[str, Any]]:
+        if not rows:
+            return []
+        getter = self._getter(tuple(rows[0]._fields))
+        fields = self.fields
+        return [dict(zip(fields, getter(row))) for row in rows]
+
+    def jsonable(self, rows: Sequence[Row]) -> list[dict[str, Any]]:
+        # uuids and datetimes as strings, for values that get cached as json
+        return to_jsonable_python(self.dicts(rows), fallback=str)
+
+    def json(self, rows: Sequence[Row]) -> bytes:
+        return dumps(self.dicts(rows))
+
+    def ndjson(self, rows: Sequence[Row]) -> bytes:
+        return b"".join(dumps(item) + b"\n" for item in self.dicts(rows))
+
+    def response(
+        self, rows: Sequence[Row], *, headers: dict[str, str] | None = None
+    ) -> Response:
+        return Response(
+            content=self.json(rows), media_type="application/json", headers=headers
+        )
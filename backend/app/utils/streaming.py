@@ -0,0 +1,60 @@
+from typing import AsyncIterator, Sequence
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Row
+
+from app.utils.env import env_int
+from app.utils.serialization import RowSerializer
+
+# streamed list responses. the crud stream_* functions yield batches of
+# rows off a server side cursor and each batch goes out as one chunk, so
+# memory stays at one batch and the first rows leave before the last are
+# read. rows are encoded by the same RowSerializer as the buffered list, so
+# both send the same json. clients opt in per request, plain requests keep
+# the buffered list (and its ETag, which needs the whole body up front)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = env_int("STREAM_BATCH_SIZE", 500)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def _ndjson(batches: AsyncIterator[Sequence[Row]], serializer: RowSerializer):
+    async for batch in batches:
+        if batch:
+            yield serializer.ndjson(batch)
+
+
+async def _json_array(batches: AsyncIterator[Sequence[Row]], serializer: RowSerializer):
+    # same body as the buffered response, just sent in pieces
+    yield b"["
+    separator = b""
+    async for batch in batches:
+        if batch:
+            # the batch's own array without its brackets
+            yield separator + serializer.json(batch)[1:-1]
+            separator = b","
+    yield b"]"
+
+
+def stream_rows(
+    batches: AsyncIterator[Sequence[Row]],
+    *,
+    serializer: RowSerializer,
+    ndjson: bool,
+    headers: dict[str, str] | None = None,
+) -> StreamingResponse:
+    if ndjson:
+        return StreamingResponse(
+            _ndjson(batches, serializer),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=headers,
+        )
+    return StreamingResponse(
+        _json_array(batches, serializer),
+        media_type="application/json",
+        headers=headers,
+    )
@@ -0,0 +1,129 @@
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+import jwt
+from dotenv import load_dotenv
+from jwt import InvalidTokenError
+from jwt.algorithms import get_default_algorithms
+
+from app.utils.cache import TTLCache
+from app.utils.env import env_float, env_int
+
+load_dotenv()
+
+# signs and verifies the access tokens. keys are read and parsed once at
+# startup instead of on every request, and claims of tokens that already
+# passed verification are kept until the token expires so a repeat token
+# costs a dict lookup
+#
+# HS256 etc sign with SECRET_KEY. RS256 / ES256 / EdDSA sign with the PEM in
+# JWT_PRIVATE_KEY_FILE and verify with the public keys in JWT_PUBLIC_KEYS_DIR,
+# one <kid>.pem per key. new tokens carry JWT_KEY_ID as their kid, so to
+# rotate: drop the new public key in the dir, roll out, switch the private
+# key + JWT_KEY_ID, and remove the old public key once its tokens expired
+
+
+class TokenService:
+    def __init__(
+        self,
+        *,
+        algorithm: str,
+        signing_key: Any,
+        verification_keys: dict[str | None, Any],
+        key_id: str | None,
+        claims_cache: TTLCache,
+    ) -> None:
+        algorithms = get_default_algorithms()
+        if algorithm not in algorithms:
+            raise RuntimeError(
+                f"JWT algorithm {algorithm} isn't available, asymmetric "
+                "algorithms need the 'cryptography' package"
+            )
+        self.algorithm = algorithm
+        self.key_id = key_id
+        # parsed key objects, PyJWT would otherwise load the PEM every call
+        prepare = algorithms[algorithm].prepare_key
+        self.signing_key = prepare(signing_key)
+        self.verification_keys = {
+            kid: prepare(key) for kid, key in verification_keys.items()
+        }
+        self.claims_cache = claims_cache
+
+    @classmethod
+    def from_env(cls) -> "TokenService":
+        algorithm = os.getenv("ALGORITHM")
+        if algorithm is None:
+            raise RuntimeError("ALGORITHM env var is not set")
+        key_id = os.getenv("JWT_KEY_ID") or None
+
+        if algorithm.startswith("HS"):
+            secret = os.getenv("SECRET_KEY")
+            if secret is None:
+                raise RuntimeError("SECRET_KEY env var is not set")
+            signing_key = secret
+            # tokens from before kids were issued have none
+            verification_keys = {key_id: secret, None: secret}
+        else:
+            private_key_file = os.getenv("JWT_PRIVATE_KEY_FILE")
+            public_keys_dir = os.getenv("JWT_PUBLIC_KEYS_DIR")
+            if private_key_file is None or public_keys_dir is None:
+                raise RuntimeError(
+                    f"{algorithm} needs JWT_PRIVATE_KEY_FILE and JWT_PUBLIC_KEYS_DIR"
+                )
+            signing_key = Path(private_key_file).read_text()
+            verification_keys = {
+                path.stem: path.read_text()
+                for path in sorted(Path(public_keys_dir).glob("*.pem"))
+            }
+            if key_id not in verification_keys:
+                raise RuntimeError(
+                    f"no public key for JWT_KEY_ID {key_id!r} in {public_keys_dir}"
+                )
+
+        return cls(
+            algorithm=algorithm,
+            signing_key=signing_key,
+            verification_keys=verification_keys,
+            key_id=key_id,
+            claims_cache=TTLCache(
+                name="jwt_claims",
+                max_size=env_int("JWT_CLAIMS_CACHE_MAX_SIZE", 10_000),
+                ttl=env_float("JWT_CLAIMS_CACHE_MAX_TTL_SECONDS", 3600.0),
+            ),
+        )
+
+    def encode(self, claims: dict[str, Any]) -> str:
+        headers = {"kid": self.key_id} if self.key_id else None
+        return jwt.encode(
+            claims, self.signing_key, algorithm=self.algorithm, headers=headers
+        )
+
+    def decode(self, token: str) -> dict[str, Any]:
+        # raises InvalidTokenError. the returned claims are shared between
+        # requests, treat them as read only
+        claims = self.claims_cache.get(token)
+        if claims is not None:
+            return claims
+
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.verification_keys.get(kid)
+        if key is None:
+            raise InvalidTokenError(f"unknown key id {kid!r}")
+
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[self.algorithm],
+            options={"require": ["exp", "sub"]},
+        )
+        # dropped right when the token expires (or sooner), so a cache hit is
+        # never an expired token
+        ttl = min(claims["exp"] - time.time(), self.claims_cache.ttl)
+        if ttl > 0:
+            self.claims_cache.set(token, claims, ttl=ttl)
+        return claims
+
+
+token_service = TokenService.from_env()
@@ -0,0 +1,33 @@
+"""product_keyset_pagination_indexes
+
+Revision ID: 3b7e1c9a4d20
+Revises: 94abc8d17c36
+Create Date: 2026-10-18 10:12:41.208114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7e1c9a4d20'
+down_revision: Union[str, Sequence[str], None] = '94abc8d17c36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_Product_name_id', 'Product', ['name', 'id'], unique=False)
+    op.create_index('ix_Product_price_id', 'Product', ['price', 'id'], unique=False)
+    op.create_index('ix_Product_category_id', 'Product', [sa.text("coalesce(category, '')"), 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_Product_category_id', table_name='Product')
+    op.drop_index('ix_Product_price_id', table_name='Product')
+    op.drop_index('ix_Product_name_id', table_name='Product')
@@ -0,0 +1,32 @@
+"""order_history_index
+
+Revision ID: 4f8c2d7e9a13
+Revises: e7f31b6a0d92
+Create Date: 2026-10-18 15:07:52.630914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f8c2d7e9a13'
+down_revision: Union[str, Sequence[str], None] = 'e7f31b6a0d92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_Order_user_id_ordered_at_id', 'Order', ['user_id', 'ordered_at', 'id'], unique=False)
+    # the composite index leads with user_id, this one is now dead weight
+    op.drop_index(op.f('ix_Order_user_id'), table_name='Order')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_Order_user_id'), 'Order', ['user_id'], unique=False)
+    op.drop_index('ix_Order_user_id_ordered_at_id', table_name='Order')
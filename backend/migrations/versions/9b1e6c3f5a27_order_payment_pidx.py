@@ -0,0 +1,33 @@
+"""order_payment_pidx
+
+Revision ID: 9b1e6c3f5a27
+Revises: 4f8c2d7e9a13
+Create Date: 2026-10-18 16:12:05.418337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b1e6c3f5a27'
+down_revision: Union[str, Sequence[str], None] = '4f8c2d7e9a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('Order', sa.Column('payment_pidx', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.create_unique_constraint(op.f('Order_payment_pidx_key'), 'Order', ['payment_pidx'])
+    op.create_index('ix_Order_pending_payment', 'Order', ['ordered_at'], unique=False, postgresql_where=sa.text("status = 'pending' AND payment_pidx IS NOT NULL"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_Order_pending_payment', table_name='Order', postgresql_where=sa.text("status = 'pending' AND payment_pidx IS NOT NULL"))
+    op.drop_constraint(op.f('Order_payment_pidx_key'), 'Order', type_='unique')
+    op.drop_column('Order', 'payment_pidx')
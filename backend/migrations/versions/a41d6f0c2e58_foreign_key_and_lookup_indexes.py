@@ -0,0 +1,84 @@
+"""foreign_key_and_lookup_indexes
+
+Revision ID: a41d6f0c2e58
+Revises: 3b7e1c9a4d20
+Create Date: 2026-10-18 11:02:17.554301
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41d6f0c2e58'
+down_revision: Union[str, Sequence[str], None] = '3b7e1c9a4d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the unique indexes below fail if older races already left duplicates,
+    # so fold every user's carts into one and merge repeated cart lines first
+    op.execute(
+        """
+        WITH keep AS (
+            SELECT DISTINCT ON (user_id) user_id, id
+            FROM "Cart"
+            ORDER BY user_id, id
+        )
+        UPDATE "CartItem" ci
+        SET cart_id = keep.id
+        FROM "Cart" c
+        JOIN keep ON keep.user_id = c.user_id
+        WHERE ci.cart_id = c.id AND c.id <> keep.id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM "Cart" c
+        USING "Cart" other
+        WHERE c.user_id = other.user_id AND c.id > other.id
+        """
+    )
+    op.execute(
+        """
+        WITH merged AS (
+            SELECT cart_id, product_id, min(id::text)::uuid AS keep_id, sum(quantity) AS quantity
+            FROM "CartItem"
+            GROUP BY cart_id, product_id
+            HAVING count(*) > 1
+        ),
+        dropped AS (
+            DELETE FROM "CartItem" ci
+            USING merged
+            WHERE ci.cart_id = merged.cart_id
+              AND ci.product_id = merged.product_id
+              AND ci.id <> merged.keep_id
+        )
+        UPDATE "CartItem" ci
+        SET quantity = merged.quantity
+        FROM merged
+        WHERE ci.id = merged.keep_id
+        """
+    )
+
+    op.create_index(op.f('ix_Cart_user_id'), 'Cart', ['user_id'], unique=True)
+    op.create_unique_constraint('uq_CartItem_cart_id_product_id', 'CartItem', ['cart_id', 'product_id'])
+    op.create_index(op.f('ix_CartItem_product_id'), 'CartItem', ['product_id'], unique=False)
+    op.create_index(op.f('ix_Order_user_id'), 'Order', ['user_id'], unique=False)
+    op.create_index(op.f('ix_OrderItem_order_id'), 'OrderItem', ['order_id'], unique=False)
+    op.create_index(op.f('ix_Product_category'), 'Product', ['category'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_Product_category'), table_name='Product')
+    op.drop_index(op.f('ix_OrderItem_order_id'), table_name='OrderItem')
+    op.drop_index(op.f('ix_Order_user_id'), table_name='Order')
+    op.drop_index(op.f('ix_CartItem_product_id'), table_name='CartItem')
+    op.drop_constraint('uq_CartItem_cart_id_product_id', 'CartItem', type_='unique')
+    op.drop_index(op.f('ix_Cart_user_id'), table_name='Cart')
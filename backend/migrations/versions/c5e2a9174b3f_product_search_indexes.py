@@ -0,0 +1,57 @@
+"""product_search_indexes
+
+Revision ID: c5e2a9174b3f
+Revises: a41d6f0c2e58
+Create Date: 2026-10-18 12:40:03.918227
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "c5e2a9174b3f"
+down_revision: Union[str, Sequence[str], None] = "a41d6f0c2e58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # pg_trgm ships with the official postgres images (contrib)
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # postgres keeps this up to date itself on every insert/update, the app
+    # never writes it. name weighs more than description in the ranking
+    op.execute("""
+        ALTER TABLE "Product" ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(name, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ) STORED
+        """)
+    op.create_index(
+        "ix_Product_search_vector",
+        "Product",
+        ["search_vector"],
+        unique=False,
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_Product_name_trgm",
+        "Product",
+        ["name"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_Product_name_trgm", table_name="Product")
+    op.drop_index("ix_Product_search_vector", table_name="Product")
+    op.drop_column("Product", "search_vector")
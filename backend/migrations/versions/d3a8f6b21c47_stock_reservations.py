@@ -0,0 +1,62 @@
+"""stock_reservations
+
+Revision ID: d3a8f6b21c47
+Revises: 9b1e6c3f5a27
+Create Date: 2026-10-18 21:05:47.290114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "d3a8f6b21c47"
+down_revision: Union[str, Sequence[str], None] = "9b1e6c3f5a27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "StockReservation",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("cart_id", sa.Uuid(), nullable=False),
+        sa.Column("product_id", sa.Uuid(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["cart_id"],
+            ["Cart.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["product_id"],
+            ["Product.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "cart_id", "product_id", name="uq_StockReservation_cart_id_product_id"
+        ),
+    )
+    op.create_index(
+        op.f("ix_StockReservation_expires_at"),
+        "StockReservation",
+        ["expires_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_StockReservation_product_id"),
+        "StockReservation",
+        ["product_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_StockReservation_product_id"), table_name="StockReservation")
+    op.drop_index(op.f("ix_StockReservation_expires_at"), table_name="StockReservation")
+    op.drop_table("StockReservation")
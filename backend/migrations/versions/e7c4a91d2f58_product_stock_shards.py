@@ -0,0 +1,53 @@
+"""product_stock_shards
+
+Revision ID: e7c4a91d2f58
+Revises: d3a8f6b21c47
+Create Date: 2026-10-18 20:39:50.517501
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "e7c4a91d2f58"
+down_revision: Union[str, Sequence[str], None] = "d3a8f6b21c47"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "ProductStockShard",
+        sa.Column("product_id", sa.Uuid(), nullable=False),
+        sa.Column("shard", sa.Integer(), nullable=False),
+        sa.Column("stock", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["product_id"],
+            ["Product.id"],
+        ),
+        sa.PrimaryKeyConstraint("product_id", "shard"),
+    )
+    # existing products start out unstriped
+    op.add_column(
+        "Product",
+        sa.Column("stock_shards", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.alter_column("Product", "stock_shards", server_default=None)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # fold any striped stock back into Product.stock first
+    op.execute(
+        'UPDATE "Product" SET stock = "Product".stock + s.stock '
+        'FROM (SELECT product_id, sum(stock) AS stock FROM "ProductStockShard" '
+        "GROUP BY product_id) AS s "
+        'WHERE "Product".id = s.product_id'
+    )
+    op.drop_column("Product", "stock_shards")
+    op.drop_table("ProductStockShard")
@@ -0,0 +1,53 @@
+"""cart_summary_columns
+
+Revision ID: e7f31b6a0d92
+Revises: c5e2a9174b3f
+Create Date: 2026-10-18 14:21:40.118273
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "e7f31b6a0d92"
+down_revision: Union[str, Sequence[str], None] = "c5e2a9174b3f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "Cart",
+        sa.Column("item_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.add_column(
+        "Cart", sa.Column("subtotal", sa.Integer(), server_default="0", nullable=False)
+    )
+    op.add_column(
+        "Cart", sa.Column("version", sa.Integer(), server_default="0", nullable=False)
+    )
+
+    # seed the totals from the lines already sitting in carts
+    op.execute("""
+        UPDATE "Cart" c
+        SET item_count = totals.item_count, subtotal = totals.subtotal
+        FROM (
+            SELECT ci.cart_id, sum(ci.quantity) AS item_count, sum(ci.quantity * p.price) AS subtotal
+            FROM "CartItem" ci
+            JOIN "Product" p ON p.id = ci.product_id
+            GROUP BY ci.cart_id
+        ) totals
+        WHERE totals.cart_id = c.id
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("Cart", "version")
+    op.drop_column("Cart", "subtotal")
+    op.drop_column("Cart", "item_count")
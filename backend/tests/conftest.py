@@ -0,0 +1,16 @@
+import os
+
+import pytest
+from dotenv import load_dotenv
+
+# app.utils.tokens builds its TokenService from the environment on import.
+# the environment and .env win, these only fill in what's missing
+load_dotenv()
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("SECRET_KEY", "tests-only-secret-key-of-32-bytes!")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,222 @@
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# the crud code leans on postgres only statements (data modifying CTEs,
+# SKIP LOCKED, NO KEY UPDATE), sqlite can't stand in for it. point
+# DATABASE_URL at a scratch database with the migrations applied, every test
+# removes the rows it made but the sweeper tests release any expired hold.
+# without it only the tests one level up run
+if not os.getenv("DATABASE_URL", "").startswith("postgresql"):
+    collect_ignore_glob = ["test_*.py"]
+else:
+    from sqlalchemy import delete, insert, select
+
+    from httpx import ASGITransport, AsyncClient
+
+    from app.database import async_session_factory, engine
+    from app.main import app
+    from app.models.dbmodel import (
+        Cart,
+        CartItem,
+        Order,
+        OrderItem,
+        Product,
+        ProductStockShard,
+        StockReservation,
+        User,
+    )
+    from app.schemas.schema import CartOperation, CartOperationType, CreateOrderRequest
+    from app.services import crud
+    from app.services.crud.stock_shards import PRODUCT_STOCK
+    from app.utils.security import create_access_token
+
+CHECKOUT = {
+    "phone_number": "0",
+    "latitude": 0.0,
+    "longitude": 0.0,
+    "address": "tests",
+}
+
+
+class Shop:
+    # throwaway products and buyers, all named after one tag so cleanup can
+    # find them again
+    def __init__(self) -> None:
+        self.tag = uuid.uuid4().hex[:8]
+        self.product_ids: list[uuid.UUID] = []
+        self.user_ids: list[uuid.UUID] = []
+
+    async def product(self, *, stock: int, price: int = 100, shards: int = 0):
+        product_id = uuid.uuid4()
+        async with async_session_factory() as session:
+            await session.execute(
+                insert(Product).values(
+                    id=product_id,
+                    name=f"test-{self.tag}-{len(self.product_ids)}",
+                    price=price,
+                    description="test",
+                    stock=stock,
+                    stock_shards=0,
+                )
+            )
+            await session.commit()
+            if shards:
+                await crud.set_stock_shards(
+                    session=session, product_id=product_id, shards=shards
+                )
+        self.product_ids.append(product_id)
+        return product_id
+
+    async def buyer(self, *, is_admin: bool = False) -> "User":
+        name = f"test-{self.tag}-{len(self.user_ids)}"
+        user = User(
+            id=uuid.uuid4(),
+            username=name,
+            useremail=f"{name}@tests.invalid",
+            userphone=name,
+            hashed_password="!",
+            is_admin=is_admin,
+            created_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        )
+        async with async_session_factory() as session:
+            await session.execute(insert(User).values(**user.model_dump()))
+            await session.execute(insert(Cart).values(id=uuid.uuid4(), user_id=user.id))
+            await session.commit()
+        self.user_ids.append(user.id)
+        return user
+
+    async def auth(self, user: "User") -> dict[str, str]:
+        # nobody logs in, the token is made the way /auth/token makes it
+        token = await create_access_token(user.id, timedelta(minutes=5))
+        return {"Authorization": f"Bearer {token}"}
+
+    async def set_cart(self, user: "User", quantities: dict[uuid.UUID, int]) -> None:
+        async with async_session_factory() as session:
+            await crud.apply_cart_operations(
+                session=session,
+                user=user,
+                operations=[
+                    CartOperation(
+                        op=CartOperationType.SET,
+                        product_id=product_id,
+                        quantity=quantity,
+                    )
+                    for product_id, quantity in quantities.items()
+                ],
+            )
+
+    async def reserve(self, user: "User"):
+        async with async_session_factory() as session:
+            return await crud.reserve_cart(session=session, user=user)
+
+    async def checkout(self, user: "User") -> uuid.UUID:
+        async with async_session_factory() as session:
+            order_id = await crud.checkout_cart(
+                payload=CreateOrderRequest(**CHECKOUT), session=session, user=user
+            )
+            await session.commit()
+        return order_id
+
+    async def stock(self, product_id: uuid.UUID) -> int:
+        # what's for sale, shards included
+        async with async_session_factory() as session:
+            return await session.scalar(
+                select(PRODUCT_STOCK).where(Product.id == product_id)
+            )
+
+    async def holds(self, user: "User") -> dict[uuid.UUID, int]:
+        async with async_session_factory() as session:
+            result = await session.execute(
+                select(StockReservation.product_id, StockReservation.quantity)
+                .join(Cart, StockReservation.cart_id == Cart.id)  # pyright: ignore
+                .where(Cart.user_id == user.id)
+            )
+            return {row.product_id: row.quantity for row in result.all()}
+
+    async def ordered(self, user: "User") -> dict[uuid.UUID, int]:
+        async with async_session_factory() as session:
+            result = await session.execute(
+                select(OrderItem.product_id, OrderItem.quantity)
+                .join(Order, OrderItem.order_id == Order.id)  # pyright: ignore
+                .where(Order.user_id == user.id)
+            )
+            ordered: dict[uuid.UUID, int] = {}
+            for row in result.all():
+                ordered[row.product_id] = ordered.get(row.product_id, 0) + row.quantity
+            return ordered
+
+    async def cart(self, user: "User") -> tuple[int, int, int, int]:
+        # the cart's running totals next to what its lines add up to
+        async with async_session_factory() as session:
+            result = await session.execute(
+                select(Cart.item_count, Cart.subtotal).where(Cart.user_id == user.id)
+            )
+            summary = result.one()
+            result = await session.execute(
+                select(CartItem.quantity, Product.price)
+                .join(Cart, CartItem.cart_id == Cart.id)  # pyright: ignore
+                .join(Product, CartItem.product_id == Product.id)  # pyright: ignore
+                .where(Cart.user_id == user.id)
+            )
+            lines = result.all()
+        return (
+            summary.item_count,
+            summary.subtotal,
+            sum(line.quantity for line in lines),
+            sum(line.quantity * line.price for line in lines),
+        )
+
+    async def cleanup(self) -> None:
+        user_ids = self.user_ids
+        cart_ids = select(Cart.id).where(Cart.user_id.in_(user_ids))  # pyright: ignore
+        order_ids = select(Order.id).where(
+            Order.user_id.in_(user_ids)
+        )  # pyright: ignore
+        async with async_session_factory() as session:
+            for stmt in (
+                delete(OrderItem).where(
+                    OrderItem.order_id.in_(order_ids)  # pyright: ignore
+                ),
+                delete(Order).where(Order.user_id.in_(user_ids)),  # pyright: ignore
+                delete(StockReservation).where(
+                    StockReservation.cart_id.in_(cart_ids)  # pyright: ignore
+                ),
+                delete(CartItem).where(
+                    CartItem.cart_id.in_(cart_ids)  # pyright: ignore
+                ),
+                delete(Cart).where(Cart.user_id.in_(user_ids)),  # pyright: ignore
+                delete(ProductStockShard).where(
+                    ProductStockShard.product_id.in_(  # pyright: ignore
+                        self.product_ids
+                    )
+                ),
+                delete(Product).where(
+                    Product.id.in_(self.product_ids)  # pyright: ignore
+                ),
+                delete(User).where(User.id.in_(user_ids)),  # pyright: ignore
+            ):
+                await session.execute(stmt)
+            await session.commit()
+
+
+@pytest.fixture
+async def shop():
+    shop = Shop()
+    try:
+        yield shop
+    finally:
+        await shop.cleanup()
+        # pooled connections belong to this test's event loop
+        await engine.dispose()
+
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+    await engine.dispose()
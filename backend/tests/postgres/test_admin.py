@@ -0,0 +1,29 @@
+import pytest
+
+from app.database import async_session_factory
+from app.models.dbmodel import Product
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_only_admins_can_update_products(client, shop):
+    product = await shop.product(stock=5, price=100)
+    buyer, admin = await shop.buyer(), await shop.buyer(is_admin=True)
+    url = f"/admin/products/{product}"
+
+    anonymous = await client.patch(url, json={"price": 1})
+    assert anonymous.status_code == 401
+    forbidden = await client.patch(
+        url, json={"price": 1}, headers=await shop.auth(buyer)
+    )
+    assert forbidden.status_code == 403
+    async with async_session_factory() as session:
+        assert (await session.get(Product, product)).price == 100
+
+    response = await client.patch(
+        url, json={"price": 150}, headers=await shop.auth(admin)
+    )
+    assert response.status_code == 200
+    assert response.json()["price"] == 150
+    async with async_session_factory() as session:
+        assert (await session.get(Product, product)).price == 150
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from app.database import async_session_factory
+from app.models.dbmodel import Product
+from app.schemas.schema import CartOperation, CartOperationType
+from app.services import crud
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_batch_and_add_to_cart_of_a_new_line_both_count(shop):
+    products = [await shop.product(stock=100, price=10 * (i + 1)) for i in range(4)]
+    buyers = [await shop.buyer() for _ in range(8)]
+
+    async def add(user, product_id):
+        async with async_session_factory() as session:
+            product = await session.get(Product, product_id)
+            cart = await crud.check_for_cart_or_create(session=session, user=user)
+            await crud.create_cart_item(
+                session=session, cart_id=cart.id, product=product, quantity=2
+            )
+
+    async def batch(user):
+        async with async_session_factory() as session:
+            await crud.apply_cart_operations(
+                session=session,
+                user=user,
+                operations=[
+                    CartOperation(
+                        op=CartOperationType.ADD, product_id=product_id, quantity=1
+                    )
+                    for product_id in products
+                ],
+            )
+
+    # every product goes in new, once through the batch and once on its own
+    results = await asyncio.gather(
+        *(batch(buyer) for buyer in buyers),
+        *(add(buyer, product_id) for buyer in buyers for product_id in products),
+        return_exceptions=True,
+    )
+
+    assert [r for r in results if isinstance(r, BaseException)] == []
+
+    for buyer in buyers:
+        item_count, subtotal, quantity, total = await shop.cart(buyer)
+        assert quantity == 3 * len(products)
+        assert (item_count, subtotal) == (quantity, total)
+
+
+async def test_remove_and_set_keep_the_totals(shop):
+    cheap, dear = await shop.product(stock=10, price=5), await shop.product(
+        stock=10, price=70
+    )
+    user = await shop.buyer()
+    await shop.set_cart(user, {cheap: 3, dear: 2})
+    assert await shop.cart(user) == (5, 155, 5, 155)
+
+    async with async_session_factory() as session:
+        await crud.update_quantity(
+            session=session, user=user, product_id=dear, new_quantity=0
+        )
+    await shop.set_cart(user, {cheap: 1})
+    assert await shop.cart(user) == (1, 5, 1, 5)
@@ -0,0 +1,79 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app.database import async_session_factory
+from app.schemas.schema import ProductUpdate
+from app.services import crud
+from app.services.crud.order import ORDER_HISTORY_SORT
+from app.utils.pagination import encode_cursor
+
+pytestmark = pytest.mark.anyio
+
+
+async def history(user, cursor=None):
+    async with async_session_factory() as session:
+        return await crud.get_order_history(
+            session=session, user=user, limit=1, cursor=cursor
+        )
+
+
+async def test_order_history_pages_through_every_order(shop):
+    product = await shop.product(stock=10)
+    user = await shop.buyer()
+    order_ids = []
+    for _ in range(3):
+        await shop.set_cart(user, {product: 1})
+        order_ids.append(await shop.checkout(user))
+
+    seen = []
+    page = await history(user)
+    seen += [order.id for order in page.items]
+    while page.next_cursor:
+        page = await history(user, page.next_cursor)
+        seen += [order.id for order in page.items]
+
+    assert seen == order_ids[::-1]
+
+
+@pytest.mark.parametrize(
+    "key", ["2024-05-01T10:00:00+05:45", "2024-05-01T10:00:00Z", "yesterday"]
+)
+async def test_order_history_rejects_a_cursor_postgres_cant_compare(shop, key):
+    user = await shop.buyer()
+    cursor = encode_cursor(
+        sort=ORDER_HISTORY_SORT, key=key, row_id=uuid.uuid4(), forward=True
+    )
+
+    with pytest.raises(HTTPException) as excinfo:
+        await history(user, cursor)
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == "Invalid cursor"
+
+
+async def test_order_items_change_etag_when_a_product_is_renamed(client, shop):
+    product = await shop.product(stock=5)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 1})
+    await shop.checkout(user)
+    headers = await shop.auth(user)
+
+    first = await client.get("/order/orderitems", headers=headers)
+    etag = first.headers["ETag"]
+    again = await client.get(
+        "/order/orderitems", headers={**headers, "If-None-Match": etag}
+    )
+    assert again.status_code == 304
+
+    async with async_session_factory() as session:
+        await crud.update_product(
+            session=session,
+            product_id=product,
+            product_update=ProductUpdate(name=f"renamed-{shop.tag}"),
+        )
+    renamed = await client.get(
+        "/order/orderitems", headers={**headers, "If-None-Match": etag}
+    )
+    assert renamed.status_code == 200
+    assert renamed.json()[0]["name"] == f"renamed-{shop.tag}"
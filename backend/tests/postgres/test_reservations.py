@@ -0,0 +1,265 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, update
+
+from app.database import async_session_factory
+from app.models.dbmodel import Cart, StockReservation
+from app.schemas.schema import CreateOrderRequest, ProductUpdate
+from app.services import crud
+from app.services.reservation_sweeper import ReservationSweeper
+
+pytestmark = pytest.mark.anyio
+
+PAYLOAD = CreateOrderRequest(
+    phone_number="0", latitude=0.0, longitude=0.0, address="tests"
+)
+
+
+async def test_reserve_then_checkout_takes_stock_once(shop):
+    product = await shop.product(stock=10)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 3})
+
+    reservation = await shop.reserve(user)
+    assert [(line.product_id, line.quantity) for line in reservation.items] == [
+        (product, 3)
+    ]
+    assert await shop.stock(product) == 7
+    assert await shop.holds(user) == {product: 3}
+
+    await shop.checkout(user)
+    # the hold was claimed, not taken a second time
+    assert await shop.stock(product) == 7
+    assert await shop.holds(user) == {}
+    assert await shop.ordered(user) == {product: 3}
+
+
+async def test_checkout_settles_a_cart_that_changed_after_reserving(shop):
+    grown, shrunk, dropped = [await shop.product(stock=10) for _ in range(3)]
+    user = await shop.buyer()
+    await shop.set_cart(user, {grown: 2, shrunk: 4, dropped: 1})
+    await shop.reserve(user)
+
+    await shop.set_cart(user, {grown: 5, shrunk: 1, dropped: 0})
+    await shop.checkout(user)
+
+    assert await shop.stock(grown) == 5
+    assert await shop.stock(shrunk) == 9
+    assert await shop.stock(dropped) == 10
+    assert await shop.holds(user) == {}
+    assert await shop.ordered(user) == {grown: 5, shrunk: 1}
+
+
+async def test_rereserve_holds_exactly_the_changed_cart(shop):
+    kept, removed, added = [await shop.product(stock=10) for _ in range(3)]
+    user = await shop.buyer()
+    await shop.set_cart(user, {kept: 2, removed: 1})
+    first = await shop.reserve(user)
+
+    await shop.set_cart(user, {kept: 3, removed: 0, added: 1})
+    second = await shop.reserve(user)
+
+    assert await shop.holds(user) == {kept: 3, added: 1}
+    assert await shop.stock(kept) == 7
+    assert await shop.stock(removed) == 10
+    assert await shop.stock(added) == 9
+    assert second.expires_at >= first.expires_at
+
+
+async def test_reserve_more_than_stock_changes_nothing(shop):
+    plenty, scarce = await shop.product(stock=10), await shop.product(stock=2)
+    user = await shop.buyer()
+    await shop.set_cart(user, {plenty: 1, scarce: 2})
+    # someone else bought one in the meantime
+    other = await shop.buyer()
+    await shop.set_cart(other, {scarce: 1})
+    await shop.checkout(other)
+
+    with pytest.raises(HTTPException) as excinfo:
+        await shop.reserve(user)
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail["product_id"] == str(scarce)
+    assert excinfo.value.detail["available_stock"] == 1
+    assert await shop.stock(plenty) == 10
+    assert await shop.holds(user) == {}
+
+
+async def test_release_gives_the_holds_back(shop):
+    product = await shop.product(stock=5)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 2})
+    await shop.reserve(user)
+
+    async with async_session_factory() as session:
+        released = await crud.release_cart_reservations(session=session, user=user)
+        await session.commit()
+
+    assert released == 1
+    assert await shop.stock(product) == 5
+    assert await shop.holds(user) == {}
+
+
+async def test_sweeper_releases_expired_holds_only(shop):
+    expired, live = await shop.product(stock=5), await shop.product(stock=5)
+    late, early = await shop.buyer(), await shop.buyer()
+    await shop.set_cart(late, {expired: 2})
+    await shop.set_cart(early, {live: 1})
+    await shop.reserve(late)
+    await shop.reserve(early)
+    async with async_session_factory() as session:
+        await session.execute(
+            update(StockReservation)
+            .where(
+                StockReservation.cart_id.in_(  # pyright: ignore
+                    select(Cart.id).where(Cart.user_id == late.id)
+                )
+            )
+            .values(expires_at=datetime.utcnow() - timedelta(minutes=1))
+        )
+        await session.commit()
+
+    sweeper = ReservationSweeper(
+        session_factory=async_session_factory, interval=60, batch_size=1
+    )
+    assert await sweeper.sweep_once() >= 1
+
+    assert await shop.stock(expired) == 5
+    assert await shop.holds(late) == {}
+    assert await shop.stock(live) == 4
+    assert await shop.holds(early) == {live: 1}
+
+    # the cart is still there, checking it out now takes the stock again
+    await shop.checkout(late)
+    assert await shop.stock(expired) == 3
+
+
+async def test_concurrent_reserves_hold_the_cart_once(shop):
+    product = await shop.product(stock=10)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 2})
+
+    results = await asyncio.gather(
+        *(shop.reserve(user) for _ in range(6)), return_exceptions=True
+    )
+
+    assert [r for r in results if isinstance(r, BaseException)] == []
+    assert await shop.holds(user) == {product: 2}
+    assert await shop.stock(product) == 8
+
+
+async def test_reserve_waits_for_a_running_checkout(shop):
+    product = await shop.product(stock=10)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 2})
+    await shop.reserve(user)
+    await shop.set_cart(user, {product: 3})
+
+    async with async_session_factory() as session:
+        await crud.checkout_cart(payload=PAYLOAD, session=session, user=user)
+        reserving = asyncio.create_task(shop.reserve(user))
+        await asyncio.sleep(0.2)
+        # held up on the cart lock until the checkout is done
+        assert not reserving.done()
+        await session.commit()
+
+    # by then the cart is empty, nothing is held next to the order
+    with pytest.raises(HTTPException) as excinfo:
+        await reserving
+    assert excinfo.value.status_code == 404
+    assert await shop.holds(user) == {}
+    assert await shop.stock(product) == 7
+    assert await shop.ordered(user) == {product: 3}
+
+
+async def test_checkout_and_cart_edits_of_one_cart_take_turns(shop):
+    products = [await shop.product(stock=100) for _ in range(3)]
+    buyers = [await shop.buyer() for _ in range(12)]
+    for buyer in buyers:
+        await shop.set_cart(buyer, {product: 1 for product in products})
+
+    async def edit(user, product_id):
+        async with async_session_factory() as session:
+            await crud.update_quantity(
+                session=session, user=user, product_id=product_id, new_quantity=2
+            )
+
+    # the checkout and the edits race for the same lines and cart row
+    results = await asyncio.gather(
+        *(
+            task
+            for buyer in buyers
+            for task in (
+                edit(buyer, products[0]),
+                shop.checkout(buyer),
+                edit(buyer, products[2]),
+            )
+        ),
+        return_exceptions=True,
+    )
+
+    # an edit after the checkout finds its line gone, nothing else fails
+    failed = [r for r in results if isinstance(r, BaseException)]
+    assert all(getattr(r, "status_code", None) == 404 for r in failed), failed
+    for buyer in buyers:
+        item_count, subtotal, quantity, total = await shop.cart(buyer)
+        assert (item_count, subtotal) == (quantity, total)
+        ordered = await shop.ordered(buyer)
+        assert sum(ordered.values()) + quantity in (3, 4, 5)
+    sold = sum([sum((await shop.ordered(buyer)).values()) for buyer in buyers])
+    left = sum([await shop.stock(product) for product in products])
+    assert sold + left == 300
+
+
+async def test_cart_edit_waits_for_a_running_checkout(shop):
+    product = await shop.product(stock=10)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 2})
+
+    async def edit():
+        async with async_session_factory() as session:
+            await crud.update_quantity(
+                session=session, user=user, product_id=product, new_quantity=5
+            )
+
+    async with async_session_factory() as session:
+        await crud.checkout_cart(payload=PAYLOAD, session=session, user=user)
+        editing = asyncio.create_task(edit())
+        await asyncio.sleep(0.2)
+        assert not editing.done()
+        await session.commit()
+
+    with pytest.raises(HTTPException) as excinfo:
+        await editing
+    assert excinfo.value.status_code == 404
+    assert await shop.cart(user) == (0, 0, 0, 0)
+    assert await shop.ordered(user) == {product: 2}
+
+
+async def test_checkouts_during_price_changes_keep_the_totals(shop):
+    products = [await shop.product(stock=100, price=100) for _ in range(2)]
+    buyers = [await shop.buyer() for _ in range(10)]
+    for buyer in buyers:
+        await shop.set_cart(buyer, {product: 1 for product in products})
+
+    async def reprice(product_id, price):
+        async with async_session_factory() as session:
+            await crud.update_product(
+                session=session,
+                product_id=product_id,
+                product_update=ProductUpdate(price=price),
+            )
+
+    results = await asyncio.gather(
+        *(shop.checkout(buyer) for buyer in buyers[::2]),
+        *(reprice(product, price) for price in (150, 200) for product in products),
+        *(shop.reserve(buyer) for buyer in buyers[1::2]),
+        return_exceptions=True,
+    )
+
+    assert [r for r in results if isinstance(r, BaseException)] == []
+    for buyer in buyers:
+        item_count, subtotal, quantity, total = await shop.cart(buyer)
+        assert (item_count, subtotal) == (quantity, total)
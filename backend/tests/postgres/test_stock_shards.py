@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.database import async_session_factory
+from app.services import crud
+from app.services.crud.stock_shards import SHARD_TAKES
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_striped_checkouts_sell_the_stock_once(shop):
+    product = await shop.product(stock=20, shards=4)
+    buyers = [await shop.buyer() for _ in range(25)]
+    for buyer in buyers:
+        await shop.set_cart(buyer, {product: 1})
+
+    results = await asyncio.gather(
+        *(shop.checkout(buyer) for buyer in buyers), return_exceptions=True
+    )
+
+    sold = [r for r in results if not isinstance(r, BaseException)]
+    short = [r for r in results if isinstance(r, BaseException)]
+    assert len(sold) == 20
+    assert all(getattr(r, "status_code", None) == 400 for r in short)
+    assert await shop.stock(product) == 0
+
+
+async def test_take_gathers_when_no_shard_covers_it(shop):
+    # 10 over 4 shards is 3, 3, 2, 2
+    product = await shop.product(stock=10, shards=4)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 7})
+    gathered = SHARD_TAKES["gathered"]
+
+    await shop.checkout(user)
+
+    assert SHARD_TAKES["gathered"] == gathered + 1
+    assert await shop.stock(product) == 3
+    assert await shop.ordered(user) == {product: 7}
+
+
+async def test_reserve_and_release_striped_stock(shop):
+    product = await shop.product(stock=8, shards=2)
+    user = await shop.buyer()
+    await shop.set_cart(user, {product: 3})
+
+    await shop.reserve(user)
+    assert await shop.stock(product) == 5
+
+    async with async_session_factory() as session:
+        await crud.release_cart_reservations(session=session, user=user)
+        await session.commit()
+    # back in Product.stock, still counted with the shards
+    assert await shop.stock(product) == 8
+
+
+async def test_restriping_keeps_the_total(shop):
+    product = await shop.product(stock=11)
+
+    for shards in (3, 5, 0):
+        async with async_session_factory() as session:
+            striped = await crud.set_stock_shards(
+                session=session, product_id=product, shards=shards
+            )
+        assert striped.stock == 11
+        assert await shop.stock(product) == 11
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize(
+    "query, headers",
+    [
+        ({"stream": "true"}, {}),
+        ({}, {"Accept": "application/x-ndjson"}),
+    ],
+)
+async def test_streamed_products_reject_a_bad_cursor_up_front(client, query, headers):
+    response = await client.get(
+        "/products/", params={**query, "cursor": "garbage"}, headers=headers
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+async def test_streamed_products_pick_up_after_the_cursor(client, shop):
+    await shop.product(stock=1)
+    await shop.product(stock=2)
+    first = await client.get("/products/", params={"limit": 1})
+    cursor = first.json()["next_cursor"]
+
+    response = await client.get(
+        "/products/",
+        params={"cursor": cursor},
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    seen = {row["name"] for row in rows}
+    assert first.json()["items"][0]["name"] not in seen
+    assert {f"test-{shop.tag}-0", f"test-{shop.tag}-1"} - seen <= {
+        first.json()["items"][0]["name"]
+    }
@@ -0,0 +1,74 @@
+import pytest
+
+from app.utils import cache as cache_module
+from app.utils.cache import CACHE_REGISTRY, MemoryBackend, TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache(name="test", max_size=10, ttl=5, register=False)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+
+    clock[0] += 2
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    clock[0] += 4
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(name="test", max_size=2, ttl=60, register=False)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_setting_a_key_again_refreshes_it(clock):
+    cache = TTLCache(name="test", max_size=2, ttl=60, register=False)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 10)
+    cache.set("c", 3)
+
+    assert cache.get("a") == 10
+    assert cache.get("b") is None
+
+
+def test_caches_register_unless_told_not_to():
+    registered = TTLCache(name="test-registered", max_size=1, ttl=1)
+    TTLCache(name="test-unregistered", max_size=1, ttl=1, register=False)
+
+    try:
+        assert CACHE_REGISTRY["test-registered"] is registered
+        assert "test-unregistered" not in CACHE_REGISTRY
+    finally:
+        CACHE_REGISTRY.pop("test-registered", None)
+
+
+@pytest.mark.anyio
+async def test_memory_backend_counters_outlive_entries(clock):
+    backend = MemoryBackend(name="test", max_size=1, ttl=5)
+    await backend.set("a", {"x": 1}, ttl=5)
+    await backend.set("b", {"x": 2}, ttl=5)
+    assert await backend.incr("version") == 1
+    assert await backend.incr("version") == 2
+
+    clock[0] += 10
+    assert await backend.get("a") is None
+    assert await backend.get("b") is None
+    assert await backend.get_counter("version") == 2
+    assert await backend.get_counter("other") == 0
@@ -0,0 +1,49 @@
+import uuid
+
+import pytest
+
+from app.utils.http_cache import etag_matches, make_etag, not_modified
+
+
+def test_etag_is_weak_and_stable():
+    rows = [(uuid.UUID(int=1), 2, "pending")]
+
+    etag = make_etag(rows)
+    assert etag.startswith('W/"') and etag.endswith('"')
+    assert make_etag([(uuid.UUID(int=1), 2, "pending")]) == etag
+
+
+def test_etag_changes_with_any_value():
+    etag = make_etag([(uuid.UUID(int=1), 2, "pending")])
+
+    assert make_etag([(uuid.UUID(int=1), 3, "pending")]) != etag
+    assert make_etag([(uuid.UUID(int=1), 2, "paid")]) != etag
+    assert make_etag([]) != etag
+
+
+@pytest.mark.parametrize(
+    "if_none_match, matches",
+    [
+        (None, False),
+        ("", False),
+        ("*", True),
+        ("{etag}", True),
+        ("{strong}", True),
+        ('W/"other", {etag}', True),
+        ('W/"other"', False),
+    ],
+)
+def test_etag_matches_with_weak_comparison(if_none_match, matches):
+    etag = make_etag({"page": 1})
+    if if_none_match is not None:
+        if_none_match = if_none_match.format(etag=etag, strong=etag.removeprefix("W/"))
+
+    assert etag_matches(if_none_match, etag) is matches
+
+
+def test_not_modified_keeps_the_headers_and_has_no_body():
+    response = not_modified({"ETag": 'W/"x"', "Cache-Control": "no-cache"})
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == 'W/"x"'
+    assert response.body == b""
@@ -0,0 +1,52 @@
+from app.utils.metrics import MetricsRegistry
+
+
+def test_counters_and_gauges_render_with_escaped_labels():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.")
+    in_flight = registry.gauge("in_flight", "In flight.")
+    requests.inc((("route", '/a"b'),))
+    requests.inc((("route", '/a"b'),), amount=2)
+    in_flight.inc()
+    in_flight.dec()
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 3',
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        "in_flight 0",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency.")
+    labels = (("route", "/"),)
+    for value in (0.003, 0.02, 0.02, 30.0):
+        latency.observe(labels, value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{route="/",le="0.005"} 1' in lines
+    assert 'latency_seconds_bucket{route="/",le="0.025"} 3' in lines
+    assert 'latency_seconds_bucket{route="/",le="10.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{route="/"} 4' in lines
+    assert 'latency_seconds_sum{route="/"} 30.043' in lines
+
+
+def test_collectors_are_read_at_render_time():
+    registry = MetricsRegistry()
+    pool = {"checked_out": 1}
+
+    @registry.collector
+    def collect():
+        yield "pool_connections", "gauge", "Connections.", {
+            (("state", "checked_out"),): pool["checked_out"]
+        }
+
+    pool["checked_out"] = 4
+    assert registry.render().endswith(
+        "# TYPE pool_connections gauge\n" 'pool_connections{state="checked_out"} 4\n'
+    )
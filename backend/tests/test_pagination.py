@@ -0,0 +1,57 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.pagination import decode_cursor, encode_cursor
+
+ROW_ID = uuid.UUID("6f1c1c3e-44a4-4b6e-9a35-0d5c7a3b2e10")
+
+
+@pytest.mark.parametrize("key", ["widget", 1299])
+def test_cursor_round_trips(key):
+    cursor = encode_cursor(sort="name", key=key, row_id=ROW_ID, forward=False)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor, sort="name", key_type=type(key)) == (
+        key,
+        ROW_ID,
+        False,
+    )
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "garbage",
+        "",
+        "e30",
+        encode_cursor(sort="name", key="a", row_id=ROW_ID, forward=True)[:-4],
+    ],
+)
+def test_undecodable_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor, sort="name", key_type=str)
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == "Invalid cursor"
+
+
+def test_cursor_from_another_sort_is_a_400():
+    cursor = encode_cursor(sort="price", key=10, row_id=ROW_ID, forward=True)
+
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor, sort="name", key_type=str)
+    assert excinfo.value.status_code == 400
+    assert "price" in excinfo.value.detail
+
+
+@pytest.mark.parametrize(
+    "key, key_type",
+    [("10", int), (10, str), (True, int), (None, str), (1.5, int), (["a"], str)],
+)
+def test_key_of_the_wrong_type_is_a_400(key, key_type):
+    cursor = encode_cursor(sort="name", key=key, row_id=ROW_ID, forward=True)
+
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor, sort="name", key_type=key_type)
+    assert excinfo.value.detail == "Invalid cursor"
@@ -0,0 +1,79 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+from pydantic import BaseModel
+from sqlalchemy.engine.result import result_tuple
+
+from app.utils.serialization import RowSerializer
+
+
+class Item(BaseModel):
+    id: uuid.UUID
+    name: str
+    price: int
+    category: str | None
+
+
+def rows(keys, *values):
+    # what a select of those columns hands back
+    make_row = result_tuple(keys)
+    return [make_row(value) for value in values]
+
+
+ITEM_ID = uuid.UUID(int=7)
+
+
+def test_columns_are_picked_by_name_in_schema_order():
+    serializer = RowSerializer(Item)
+    result = rows(
+        ("price", "extra", "category", "id", "name"),
+        (500, "ignored", None, ITEM_ID, "lamp"),
+    )
+
+    assert serializer.dicts(result) == [
+        {"id": ITEM_ID, "name": "lamp", "price": 500, "category": None}
+    ]
+
+
+def test_a_missing_column_is_named():
+    serializer = RowSerializer(Item)
+
+    with pytest.raises(ValueError, match="category"):
+        serializer.dicts(rows(("id", "name", "price"), (ITEM_ID, "lamp", 500)))
+
+
+def test_json_and_ndjson_encode_the_same_items():
+    serializer = RowSerializer(Item)
+    result = rows(
+        ("id", "name", "price", "category"),
+        (ITEM_ID, "lamp", 500, "home"),
+        (uuid.UUID(int=8), "mug", 120, None),
+    )
+
+    items = json.loads(serializer.json(result))
+    lines = [json.loads(line) for line in serializer.ndjson(result).splitlines()]
+    assert items == lines
+    assert items[0] == {
+        "id": str(ITEM_ID),
+        "name": "lamp",
+        "price": 500,
+        "category": "home",
+    }
+    # the same as the validated path would render
+    assert items == [
+        json.loads(Item(**row._mapping).model_dump_json()) for row in result
+    ]
+
+
+def test_single_field_schema_and_empty_results():
+    class Stamp(BaseModel):
+        at: datetime
+
+    serializer = RowSerializer(Stamp)
+    at = datetime(2024, 5, 1, 10, 30)
+
+    assert serializer.dicts([]) == []
+    assert serializer.json([]) == b"[]"
+    assert serializer.jsonable(rows(("at",), (at,))) == [{"at": "2024-05-01T10:30:00"}]
@@ -0,0 +1,135 @@
+import time
+
+import jwt
+import pytest
+from jwt import InvalidTokenError
+
+from app.utils import cache as cache_module
+from app.utils.cache import TTLCache
+from app.utils.tokens import TokenService
+
+OLD_SECRET = "old-secret-key-that-is-32-bytes!!"
+NEW_SECRET = "new-secret-key-that-is-32-bytes!!"
+
+
+def service(*, key_id, signing_key, verification_keys, algorithm="HS256"):
+    return TokenService(
+        algorithm=algorithm,
+        signing_key=signing_key,
+        verification_keys=verification_keys,
+        key_id=key_id,
+        claims_cache=TTLCache(name="test", max_size=10, ttl=3600, register=False),
+    )
+
+
+def claims(**extra):
+    return {"sub": "user", "exp": int(time.time()) + 60, **extra}
+
+
+def test_tokens_carry_the_key_id_and_round_trip():
+    tokens = service(
+        key_id="new", signing_key=NEW_SECRET, verification_keys={"new": NEW_SECRET}
+    )
+    token = tokens.encode(claims())
+
+    assert jwt.get_unverified_header(token)["kid"] == "new"
+    assert tokens.decode(token)["sub"] == "user"
+
+
+def test_rotation_keeps_old_tokens_valid_until_their_key_goes():
+    old = service(
+        key_id="old", signing_key=OLD_SECRET, verification_keys={"old": OLD_SECRET}
+    )
+    old_token = old.encode(claims())
+
+    rotated = service(
+        key_id="new",
+        signing_key=NEW_SECRET,
+        verification_keys={"old": OLD_SECRET, "new": NEW_SECRET},
+    )
+    assert rotated.decode(old_token)["sub"] == "user"
+    assert rotated.decode(rotated.encode(claims()))["sub"] == "user"
+
+    retired = service(
+        key_id="new", signing_key=NEW_SECRET, verification_keys={"new": NEW_SECRET}
+    )
+    with pytest.raises(InvalidTokenError, match="unknown key id 'old'"):
+        retired.decode(old_token)
+
+
+def test_a_token_signed_with_another_key_under_a_known_kid_fails():
+    tokens = service(
+        key_id="new", signing_key=NEW_SECRET, verification_keys={"new": NEW_SECRET}
+    )
+    forged = jwt.encode(claims(), OLD_SECRET, algorithm="HS256", headers={"kid": "new"})
+
+    with pytest.raises(InvalidTokenError):
+        tokens.decode(forged)
+
+
+def test_expired_and_incomplete_tokens_fail():
+    tokens = service(
+        key_id=None, signing_key=NEW_SECRET, verification_keys={None: NEW_SECRET}
+    )
+
+    with pytest.raises(InvalidTokenError):
+        tokens.decode(tokens.encode(claims(exp=int(time.time()) - 10)))
+    with pytest.raises(InvalidTokenError):
+        tokens.decode(tokens.encode({"exp": int(time.time()) + 60}))
+
+
+def test_cached_claims_last_no_longer_than_the_token(monkeypatch):
+    tokens = service(
+        key_id=None, signing_key=NEW_SECRET, verification_keys={None: NEW_SECRET}
+    )
+    token = tokens.encode(claims(exp=int(time.time()) + 30))
+    tokens.decode(token)
+    assert tokens.claims_cache.get(token) is not None
+
+    later = time.monotonic() + 31
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: later)
+    assert tokens.claims_cache.get(token) is None
+
+
+def test_from_env_verifies_every_public_key_in_the_dir(tmp_path, monkeypatch):
+    pytest.importorskip("cryptography")
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    def key_pair():
+        key = ed25519.Ed25519PrivateKey.generate()
+        private = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        public = key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        return private, public
+
+    old_private, old_public = key_pair()
+    new_private, new_public = key_pair()
+    keys = tmp_path / "keys"
+    keys.mkdir()
+    (keys / "2024-01.pem").write_bytes(old_public)
+    (keys / "2024-06.pem").write_bytes(new_public)
+    (tmp_path / "old.pem").write_bytes(old_private)
+    (tmp_path / "new.pem").write_bytes(new_private)
+    monkeypatch.setenv("ALGORITHM", "EdDSA")
+    monkeypatch.setenv("JWT_PUBLIC_KEYS_DIR", str(keys))
+
+    monkeypatch.setenv("JWT_PRIVATE_KEY_FILE", str(tmp_path / "old.pem"))
+    monkeypatch.setenv("JWT_KEY_ID", "2024-01")
+    old_token = TokenService.from_env().encode(claims())
+
+    monkeypatch.setenv("JWT_PRIVATE_KEY_FILE", str(tmp_path / "new.pem"))
+    monkeypatch.setenv("JWT_KEY_ID", "2024-06")
+    tokens = TokenService.from_env()
+    assert tokens.decode(old_token)["sub"] == "user"
+    assert jwt.get_unverified_header(tokens.encode(claims()))["kid"] == "2024-06"
+
+    monkeypatch.setenv("JWT_KEY_ID", "2025-01")
+    with pytest.raises(RuntimeError, match="2025-01"):
+        TokenService.from_env()
@@ -23,28 +23,37 @@ const resolvedPidx = pidx || sessionStorage.getItem("khalti_pidx");
 
 export default function PaymentVerifyPage() {
   const [status, setStatus] = useState(pidx ? "verifying" : "failed");
-  const orderId = localStorage.getItem("pending_order_id");
-  const handleUpdateOrderStatus = useStore(
-    (state) => state.handleUpdateOrderStatus,
-  );
+  const fetchOrders = useStore((state) => state.fetchOrders);
 
   useEffect(() => {
     if (!resolvedPidx) return;
+    let cancelled = false;
+
+    // the backend marks the order paid itself, "Pending" just means khalti
+    // hasn't answered yet so ask again a few times
+    const verify = (attemptsLeft) =>
+      api
+        .get(`/payment/verify?pidx=${resolvedPidx}`)
+        .then((res) => {
+          if (cancelled) return;
+          if (res.data.status === "Completed") {
+            sessionStorage.removeItem("khalti_pidx");
+            setStatus("success");
+            fetchOrders();
+          } else if (res.data.status === "Pending" && attemptsLeft > 0) {
+            setTimeout(() => verify(attemptsLeft - 1), 2000);
+          } else {
+            setStatus("failed");
+          }
+        })
+        .catch(() => !cancelled && setStatus("failed"));
 
-    api
-      .get(`/payment/verify?pidx=${pidx}`)
-      .then((res) => {
-        if (res.data.status === "Completed") {
-          sessionStorage.removeItem("khalti_pidx");
-          setStatus("success");
-          handleUpdateOrderStatus(2, orderId);
-        } else {
-          setStatus("failed");
-        }
-      })
-      .catch(() => setStatus("failed"));
+    verify(3);
     localStorage.removeItem("pending_order_id");
-  }, [handleUpdateOrderStatus, orderId]);
+    return () => {
+      cancelled = true;
+    };
+  }, [fetchOrders]);
 
   return (
     <div
@@ -45,6 +45,18 @@ export const cartService = {
     }
   },
 
+  // operations: [{ op: "add" | "set" | "remove", product_id, quantity }]
+  // applied together, resolves to { items, summary } for the updated cart
+  async updateCart(operations) {
+    try {
+      const response = await api.patch("/cart/", { operations });
+      return response.data;
+    } catch (error) {
+      this.handleError(error, "updating cart");
+      throw error;
+    }
+  },
+
   async clearCart() {
     try {
       const response = await api.delete("/cart/");
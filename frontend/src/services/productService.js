@@ -3,6 +3,7 @@ import api from "../api/axios";
 export const productService = {
   async getAllProducts() {
     const response = await api.get("/products/");
-    return response.data;
+    // the endpoint is keyset paginated, items holds the current page
+    return response.data.items;
   },
 };